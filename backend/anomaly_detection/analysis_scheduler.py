@@ -0,0 +1,143 @@
+"""
+Scheduling of the analysis of streamed measurement results.
+
+Analyzing after every result is far too expensive, so the results of a measurement are collected and analyzed in
+micro-batches: as soon as a result falls in a new bucket (by default the 20 minute buckets scored by entry_scoring), the
+results of the finished buckets are analyzed, and so are the waiting results when there are max_pending of them. A run
+gets only the results that were not handed to a previous run of its measurement.
+Runs of the same measurement never overlap: results arriving during a run are kept, and a run that becomes due in the
+meantime starts when the current one has finished. Runs of different measurements are independent.
+"""
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from backend.settings import ANALYSIS_BUCKET_MINUTES, ANALYSIS_MAX_PENDING
+
+
+class ScheduleState:
+    """ Bookkeeping of the runs of one measurement, guarded by the lock of the scheduler. """
+    __slots__ = ('pending', 'ready', 'bucket', 'running', 'thread', 'runs')
+
+    def __init__(self):
+        self.pending: List[Any] = []  # Results of the current bucket.
+        self.ready: List[Any] = []  # Results waiting for the next run.
+        self.bucket: Optional[int] = None
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self.runs = 0
+
+
+class AnalysisScheduler:
+    """
+    Calls run(key, results) per key (measurement) on a fixed cadence, with the results added since the last call.
+    """
+
+    def __init__(self, run: Callable[[Hashable, list], None],
+                 bucket: timedelta = timedelta(minutes=ANALYSIS_BUCKET_MINUTES),
+                 max_pending: int = ANALYSIS_MAX_PENDING, run_in_background: bool = True):
+        """
+        Parameters:
+                run (callable): Analysis of a batch, called with the key and the list of new results.
+                bucket (timedelta): The results of a bucket are analyzed when a result falls in a later bucket.
+                max_pending (int): All waiting results are analyzed when there are this many, 0 to disable.
+                run_in_background (bool): Run in a thread per key instead of in the thread adding the result.
+        """
+        self.run = run
+        self.bucket_seconds = bucket.total_seconds()
+        self.max_pending = max_pending
+        self.run_in_background = run_in_background
+        self.lock = threading.Lock()
+        self.states: Dict[Hashable, ScheduleState] = {}
+
+    def bucket_of(self, created: datetime) -> int:
+        """ Number of the bucket (t - bucket, t] holding the time, like pd.Grouper(closed='right'). """
+        return math.ceil(created.timestamp() / self.bucket_seconds)
+
+    def add(self, key: Hashable, result: Any, created: datetime) -> bool:
+        """
+        Adds a result of a measurement.
+
+        Parameters:
+                key (hashable): The measurement the result belongs to.
+                result (any): The result, passed on to run as is.
+                created (datetime): Time of the result.
+
+        Returns:
+                started (bool): Whether a run was started, False when no results are ready or a run is still busy.
+        """
+        bucket = self.bucket_of(created)
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = ScheduleState()
+            if state.bucket is not None and bucket > state.bucket:
+                state.ready.extend(state.pending)
+                state.pending = []
+            state.bucket = bucket if state.bucket is None else max(state.bucket, bucket)
+            state.pending.append(result)
+            if self.max_pending and len(state.ready) + len(state.pending) >= self.max_pending:
+                state.ready.extend(state.pending)
+                state.pending = []
+            started = self.claim(state)
+        if started:
+            self.start(key, state)
+        return started
+
+    def flush(self, key: Hashable) -> bool:
+        """ Hands all waiting results of a key, also those of the current bucket, to a run, for example before
+            shutting down. Returns whether a run was started. """
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                return False
+            state.ready.extend(state.pending)
+            state.pending = []
+            started = self.claim(state)
+        if started:
+            self.start(key, state)
+        return started
+
+    @staticmethod
+    def claim(state: ScheduleState) -> bool:
+        """ Marks a run as running when results are ready, unless one is running already. Called with the lock
+            held. """
+        if not state.ready or state.running:
+            return False
+        state.running = True
+        return True
+
+    def start(self, key: Hashable, state: ScheduleState) -> None:
+        if self.run_in_background:
+            state.thread = threading.Thread(target=self.work, args=(key, state), daemon=True, name=f"analysis-{key}")
+            state.thread.start()
+        else:
+            self.work(key, state)
+
+    def work(self, key: Hashable, state: ScheduleState) -> None:
+        """ Runs the analysis until no results are ready anymore. Errors are printed, they do not stop later runs. """
+        while True:
+            with self.lock:
+                if not state.ready:
+                    state.running = False
+                    state.thread = None
+                    return
+                results, state.ready = state.ready, []
+                state.runs += 1
+            try:
+                self.run(key, results)
+            except Exception as exception:
+                print(f"Analysis of {key} failed: {exception}")
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """ Waits until the runs started so far have finished. """
+        with self.lock:
+            threads = [state.thread for state in self.states.values() if state.thread is not None]
+        for thread in threads:
+            thread.join(timeout)
+
+    def runs(self, key: Hashable) -> int:
+        """ Amount of runs of a key so far. """
+        state = self.states.get(key)
+        return state.runs if state is not None else 0
@@ -1,6 +1,6 @@
 """Contains a datastructure for anomalies"""
 import pandas as pd
-from database.models import Anomaly, AutonomousSystem, DetectionMethod
+from database.models import DetectionMethod
 
 
 class AnomalyObject:
@@ -55,20 +55,29 @@ class AnomalyObject:
         """
         self.prediction_value = prediction
 
-    def store(self) -> None:
+    def store(self, sink=None) -> None:
         """
-        Stores the anomaly in the database.
+        Stores the anomaly in the database. A list of IP addresses is stored comma separated and an unknown mean
+        increase as 0, the columns can not be empty.
+
+        Parameters:
+                sink (AnomalySink): When given, the anomaly is added to the sink and written with its next flush.
         """
-        asn = AutonomousSystem.objects.all()[0]
-        Anomaly.objects.create(
+        from anomaly_detection_reworked.anomaly_sink import anomaly_sink
+        target = sink if sink is not None else anomaly_sink
+        ip_address = self.ip_address
+        if isinstance(ip_address, (list, tuple, set)):
+            ip_address = ", ".join(str(ip) for ip in ip_address)
+        target.add(
+            self.detection_method.id,
             time=self.time,
-            ip_address=self.ip_address,
-            autonomous_system=asn,
+            ip_address=ip_address if ip_address is not None else "",
             description=self.description,
             measurement_type=self.measurement_type,
-            detection_method_id=self.detection_method.id,
-            mean_increase=self.mean_increase,
+            mean_increase=float(self.mean_increase) if self.mean_increase is not None else 0.0,
             anomaly_score=self.anomaly_score,
             prediction_value=self.prediction_value,
             asn=self.asn
         )
+        if sink is None:
+            target.flush()
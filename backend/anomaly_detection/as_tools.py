@@ -1,75 +1,303 @@
+import functools
+import gzip
+import itertools
+import os
 import subprocess
-import radix
-import pickle
-import numpy as np
-from os.path import exists, getmtime
-from time import time
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .prefix_table import PrefixTable, SnapshotError
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, refreshes are then only serialized within a process.
+    fcntl = None
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ris_snapshot.bin')
+SNAPSHOT_MAX_AGE = 86400  # Seconds, riswhois data older than a day is refreshed.
+WHOIS_TIMEOUT = 300  # Seconds.
+CACHE_SIZE = 16384  # Router IPs, traceroutes keep passing the same routers. About 2 MB.
+REFRESH_INTERVAL = 3600  # Seconds between staleness checks of the background refresher.
+TEST_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'riswhois_dump.gz')
+
+
+def parse_ris_rows(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """
+    Parses riswhois dump lines ("<asn>\\t<prefix>\\t<seen by>") into (asn, prefix) rows.
+    Comments (starting with %), empty lines and AS sets are skipped.
+    """
+    for line in lines:
+        if not line or line[0] == '%':
+            continue
+        columns = line.split('\t')
+        if len(columns) < 2 or not columns[0].isdigit():
+            continue
+        yield int(columns[0]), columns[1].strip()
+
+
+def read_ris_dump(path: str) -> Iterator[str]:
+    """
+    Streams the lines of a riswhois dump file, as saved from 'whois -h riswhois.ripe.net dump' or downloaded from
+    RIS. Gzip compressed files are recognized by their first bytes, whatever their name.
+    """
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    with (gzip.open if compressed else open)(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\r\n')
+
+
+class ParseReport:
+    """
+    Throughput of parsing riswhois data into a prefix table.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.lines = 0
+        self.prefixes = 0
+        self.seconds = 0.0
+
+    @property
+    def lines_per_second(self) -> float:
+        return self.lines / self.seconds if self.seconds else 0.0
+
+    def count_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        for line in lines:
+            self.lines += 1
+            yield line
+
+    def count_prefixes(self, rows: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+        for row in rows:
+            self.prefixes += 1
+            yield row
+
+    def __str__(self) -> str:
+        return f"Parsed {self.lines:,} lines ({self.prefixes:,} prefixes) of {self.source} in {self.seconds:.2f} s, " \
+               f"{self.lines_per_second:,.0f} lines/s."
+
+
+class LookupState:
+    """
+    A prefix table together with the cache of lookups in it. A state is never modified: a refresh creates a new
+    state and replaces the reference, so a reader that holds a state keeps a consistent table and cache.
+    """
+    __slots__ = ('table', 'version', 'names', 'get_as')
+
+    def __init__(self, table: PrefixTable, version: int) -> None:
+        self.table = table
+        self.version = version
+        self.names = {}  # AS number -> str, converting on every lookup cost more than the rest of the lookup.
+        # The LRU cache of functools is implemented in C and thread safe: a hit costs a fraction of a lookup in the
+        # table and a miss adds little to it, an LRU cache written in Python cost more than the lookup itself.
+        self.get_as = functools.lru_cache(maxsize=CACHE_SIZE)(self.lookup)
+
+    def lookup(self, ip: Optional[str]) -> Optional[str]:
+        """ Looks up the AS of an IP in the prefix table, None for unknown prefixes and invalid adresses. """
+        try:
+            number = self.table.lookup(ip)
+        except ValueError:
+            return None
+        asn = self.names.get(number)
+        if asn is None and number is not None:
+            asn = self.names[number] = str(number)
+        return asn
+
+
+_as_look_up = None
+_as_look_up_lock = threading.Lock()
+
+
+def get_as_lookup() -> 'ASLookUp':
+    """
+    Returns the AS lookup service shared by everything in this process, it is created on first use.
+    Other processes on the host map the same snapshot file, so the prefix table is in memory only once.
+    The shared service is kept up to date by a background refresher.
+    """
+    global _as_look_up
+    if _as_look_up is None:
+        with _as_look_up_lock:
+            if _as_look_up is None:
+                _as_look_up = ASLookUp(SNAPSHOT_PATH, refresh_in_background=True)
+    return _as_look_up
 
 
 class ASLookUp:
     """
     Class that uses riswhois data to return the corresponding AS number for an IP adress.
+    The data is kept in a snapshot file, which is only refreshed from riswhois.ripe.net when it is older than
+    max_age. When refreshing fails, the last good snapshot keeps being used.
+    Use get_as_lookup() instead of creating an instance, unless you need a separate snapshot.
+
+    Lookups never wait for a refresh: the table is rebuilt next to the one in use and swapped in with a single
+    assignment. Every swap increases version.
     """
-    FIRST_IP_INDEX = 12
-    LAST_IP_INDEX = -4
-
-    def __init__(self) -> None:
-        # if exists('anomaly_detection/rtree.pickle'):
-        #     day_length = 86400
-        #     modified_time = getmtime('anomaly_detection/rtree.pickle')
-        #     if (time() - modified_time) > day_length:
-        #         self.rtree = radix.Radix()
-        #         self.get_ris
-        #     else:
-        #         with open('anomaly_detection/rtree.pickle', 'rb') as f:
-        #             self.rtree = pickle.load(f)
-        # else:
-        self.rtree = radix.Radix()
-        self.get_ris()
-
-    def get_ris(self) -> None:
+
+    def __init__(self, snapshot_path: str = SNAPSHOT_PATH, max_age: float = SNAPSHOT_MAX_AGE,
+                 refresh_in_background: bool = False, dump_files: Optional[Sequence[str]] = None) -> None:
+        """
+        Parameters:
+                snapshot_path (str): File the prefix table is stored in.
+                max_age (float): Seconds after which the riswhois data is refreshed.
+                refresh_in_background (bool): Start a refresher thread. A stale snapshot is then used while the
+                        refresher replaces it, only a missing snapshot is built before returning.
+                dump_files (list): Riswhois dump files (plain or gzip) to refresh from, instead of
+                        riswhois.ripe.net. For tests, benchmarks and machines without internet access.
+        """
+        self.snapshot_path = snapshot_path
+        self.max_age = max_age
+        self.dump_files = dump_files
+        self.state: Optional[LookupState] = None
+        self.refresh_lock = threading.Lock()
+        self.refresher: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        self.load_snapshot()
+        if self.state is None or (self.is_stale() and not refresh_in_background):
+            self.refresh()
+        if refresh_in_background:
+            self.start_refresher()
+
+    @property
+    def table(self) -> Optional[PrefixTable]:
+        state = self.state
+        return None if state is None else state.table
+
+    @property
+    def cache(self):
+        """ The cached lookup function of the table in use, see functools.lru_cache for cache_info and cache_clear. """
+        state = self.state
+        return None if state is None else state.get_as
+
+    @property
+    def version(self) -> int:
+        """ Number of prefix tables this service has used, 0 before the first one is loaded. """
+        state = self.state
+        return 0 if state is None else state.version
+
+    def load_snapshot(self) -> None:
+        """ (Re)loads the snapshot file, unless it holds the table that is already in use. """
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            table = PrefixTable.load(self.snapshot_path)
+        except SnapshotError as error:
+            print(error)
+            return
+        if self.table is None or table.created != self.table.created:
+            self.set_table(table)
+
+    def set_table(self, table: PrefixTable) -> None:
+        self.state = LookupState(table, self.version + 1)
+
+    def is_stale(self) -> bool:
+        return self.table is None or self.table.age > self.max_age
+
+    def refresh(self) -> None:
         """
-        Connects to riswhois.ripe.net and stores IP adresses in a radix tree.
+        Rebuilds the snapshot from riswhois.ripe.net. Raises an exception only when there is no snapshot to fall
+        back to. Worker processes sharing the snapshot take turns: a process that had to wait uses the snapshot
+        that was just written instead of downloading it again.
         """
-        routing_ip = subprocess.run(['whois', '-h', 'riswhois.ripe.net', 'dump'],
-                                    stdout=subprocess.PIPE).\
-            stdout.decode(
-            'utf-8').split("\n")[self.FIRST_IP_INDEX:self.LAST_IP_INDEX]
+        with self.refresh_lock, open(self.snapshot_path + ".lock", 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.load_snapshot()
+            if not self.is_stale():
+                return
+            try:
+                self.get_ris()
+            except (OSError, subprocess.SubprocessError, ValueError) as error:
+                if self.table is None:
+                    raise
+                print(f"Could not refresh riswhois data ({error}), using the snapshot of "
+                      f"{self.table.age / 3600:.1f} hours old.")
+
+    def start_refresher(self, interval: float = REFRESH_INTERVAL) -> None:
+        """ Starts a daemon thread that refreshes stale data and picks up snapshots written by other processes. """
+        if self.refresher is not None and self.refresher.is_alive():
+            return
+        self.stopped.clear()
+        self.refresher = threading.Thread(target=self.refresh_periodically, args=(interval,),
+                                          name="ris-refresher", daemon=True)
+        self.refresher.start()
 
-        routing_ip.extend(subprocess.run(['whois', '-h', 'riswhois.ripe.net', 'dump6'],
-                          stdout=subprocess.PIPE).
-                          stdout.decode('utf-8').split("\n")[self.FIRST_IP_INDEX:self.LAST_IP_INDEX])
-        self.store_ris(routing_ip)
+    def stop_refresher(self) -> None:
+        self.stopped.set()
+        if self.refresher is not None:
+            self.refresher.join()
+            self.refresher = None
 
-    def store_ris(self, routing_ip: list) -> None:
+    def refresh_periodically(self, interval: float) -> None:
+        while True:
+            try:
+                self.load_snapshot()
+                if self.is_stale():
+                    self.refresh()
+            except Exception as error:  # Keep refreshing, the current table stays in use.
+                print(f"Refreshing riswhois data failed: {error}")
+            if self.stopped.wait(interval):
+                return
+
+    def get_ris(self) -> ParseReport:
+        """
+        Connects to riswhois.ripe.net (or reads the dump files) and stores the IPv4 and IPv6 prefixes in a new
+        snapshot.
+        """
+        if self.dump_files:
+            return self.load_ris_dumps(self.dump_files)
+        routing_ip = []
+        for dump in ('dump', 'dump6'):
+            output = subprocess.run(['whois', '-h', 'riswhois.ripe.net', dump], stdout=subprocess.PIPE,
+                                    timeout=WHOIS_TIMEOUT, check=True).stdout
+            routing_ip.extend(output.decode('utf-8').split("\n"))
+        return self.store_ris(routing_ip, source="riswhois.ripe.net")
+
+    def load_ris_dumps(self, paths: Sequence[str]) -> ParseReport:
         """
-        Takes list of ris info and store in radix tree, then saves to a pickle.
+        Reads riswhois dump files line by line and stores their prefixes in a new snapshot.
         """
-        for row in routing_ip:
-            columns = row.split('\t')
-            rnode = self.rtree.add(columns[1])
-            rnode.data["asn"] = columns[0]
-            rnode.data["seen_by"] = columns[2]
+        lines = itertools.chain.from_iterable(read_ris_dump(path) for path in paths)
+        return self.store_ris(lines, source=", ".join(os.path.basename(path) for path in paths))
 
-        with open('rtree.pickle', 'wb') as f:
-            pickle.dump(self.rtree, f)
+    def store_ris(self, routing_ip: Iterable[str], source: str = "riswhois") -> ParseReport:
+        """
+        Takes ris info lines and stores them in a prefix table, then saves it as snapshot.
+        """
+        report = ParseReport(source)
+        start = time.perf_counter()
+        table = PrefixTable.from_rows(report.count_prefixes(parse_ris_rows(report.count_lines(routing_ip))))
+        report.seconds = time.perf_counter() - start
+        if not (table.asns_v4.any() or table.asns_v6.any()):
+            raise ValueError(f"{source} contains no prefixes.")
+        table.save(self.snapshot_path)
+        self.set_table(table)
+        print(report)
+        return report
 
     def get_as(self, ip: str) -> str:
         """
-        Finds AS for a given IP, returns NaN when AS is not found.
+        Finds AS for a given IP, returns None when AS is not found.
 
         Parameters:
                 ip (str): A valid IP4 or IP6 adress.
 
         Returns:
-                asn (str): corresponding AS number if found in radix tree.
+                asn (str): corresponding AS number if found in the prefix table.
         """
-        try:
-            asn = self.rtree.search_best(ip).data["asn"]
-        except AttributeError:
-            asn = None
-        except TypeError:
-            asn = None
-        except ValueError:
-            asn = None
-        return asn
+        return self.state.get_as(ip)
+
+    def get_as_batch(self, ips: Sequence[str]) -> List[Optional[str]]:
+        """
+        Finds the AS of many IPs at once. IPs that were looked up recently are answered from a cache, the others
+        are looked up one by one: a numpy batch costs more to set up than it saves at the size of a traceroute or a
+        micro-batch (see benchmarks/bench_as_lookup.py).
+
+        Parameters:
+                ips (list): IP4 or IP6 adresses, invalid adresses (or None) are allowed.
+
+        Returns:
+                asns (list): corresponding AS number (str) per IP, None if not found.
+        """
+        get_as = self.state.get_as  # The same table and cache for the whole batch, even when a refresh swaps them.
+        return [get_as(ip) for ip in ips]
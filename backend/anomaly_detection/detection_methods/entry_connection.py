@@ -2,6 +2,8 @@
 Plugin File for the Entry Connection detection method. 
 """
 from http.client import IncompleteRead
+import functools
+import threading
 import time
 import ijson
 import numpy as np
@@ -10,9 +12,11 @@ from urllib.request import urlopen
 from requests.exceptions import ChunkedEncodingError
 from datetime import datetime
 from ripe.atlas.sagan import TracerouteResult
-from adtk.detector import LevelShiftAD
-from adtk.data import validate_series
-from ..as_tools import ASLookUp
+from ..as_tools import get_as_lookup
+from ..level_shift import LevelShiftWindow
+from ..entry_scoring import score_entry_ases
+from ..parallel_analysis import detect_level_shifts_parallel
+from backend.settings import ANALYSIS_SERIAL_MAX_ROWS, ANALYSIS_WORKERS
 from datetime import datetime, timedelta
 from ..monitor_strategy_base import MonitorStrategy
 from ..format import HopFormat, ProbeMeasurement
@@ -23,9 +27,17 @@ from anomaly_detection.anomaly_object import AnomalyObject
 
 
 class DetectionMethod(MonitorStrategy):
-    def __init__(self) -> None:
+    def __init__(self, workers: int = ANALYSIS_WORKERS) -> None:
         self.own_as = None
-        self.as_look_up = ASLookUp()
+        self.as_look_up = get_as_lookup()
+        self.workers = workers
+        self.windows: dict[str, LevelShiftWindow] = {}
+        # The analysis scheduler runs measurements in their own threads: the lock guards the dictionary. A window is
+        # only used by the runs of its measurement, which never overlap.
+        self.windows_lock = threading.Lock()
+        # Large inputs (the first batch of a measurement, or new results of many probes) use worker processes.
+        self.detect_level_shifts = functools.partial(detect_level_shifts_parallel, workers=workers,
+                                                     serial_max_rows=ANALYSIS_SERIAL_MAX_ROWS)
 
     def measurement_type(self) -> str:
         return 'traceroute'
@@ -59,11 +71,10 @@ class DetectionMethod(MonitorStrategy):
                 try:
                     for measurement_data in parser:
                         result = self.preprocess(measurement_data)
-                        result_time = result[0]['created']
-                        
+                        probe_mesh, hops = result
+                        result_time = probe_mesh.created
+
                         total_time = perf_counter()
-                        probe_mesh = ProbeMeasurement(**result[0])
-                        hops = result[1]
                         
                         measurement = MeasurementCollection.objects.get(measurement_id=measurement_id)
 
@@ -73,7 +84,6 @@ class DetectionMethod(MonitorStrategy):
                         
                         start_store = perf_counter()
                         for hop in hops:
-                            hop = HopFormat(**hop)
                             DataManager.store_hops(self, hop, measurementpoint_id)
                         print(f"Save Hop - {perf_counter() - start_store}")
                         print(f"Save total time - {perf_counter() - total_time}")
@@ -88,7 +98,7 @@ class DetectionMethod(MonitorStrategy):
         """store result in mongo_db"""
         collection.insert_one(measurement_result)
 
-    def preprocess(self, single_result_raw: dict) -> dict:
+    def preprocess(self, single_result_raw: dict) -> tuple[ProbeMeasurement, list[HopFormat]]:
         """
         Pre-processes json measurement data to only send out the relevant data.
 
@@ -97,7 +107,8 @@ class DetectionMethod(MonitorStrategy):
                 measurement point.
 
         Returns:
-                clean_result (dict): 
+                clean_result (ProbeMeasurement): The probe, time and entry hop of the measurement point.
+                hops (list): The cleaned hops (HopFormat).
         """
         measurement_result = TracerouteResult(single_result_raw,
                                               on_error=TracerouteResult.ACTION_IGNORE)
@@ -107,15 +118,10 @@ class DetectionMethod(MonitorStrategy):
         entry_rtt, entry_ip, entry_as = self.find_network_entry_hop(
             hops, user_ip)
 
-        return {
-            'probe_id': measurement_result.probe_id,
-            'created': measurement_result.created,
-            'entry_rtt': entry_rtt,
-            'entry_ip': entry_ip,
-            'entry_as': entry_as
-        }, hops
+        return ProbeMeasurement(measurement_result.probe_id, measurement_result.created, entry_rtt, entry_ip,
+                                entry_as), hops
 
-    def clean_hops(self, hops: list) -> list:
+    def clean_hops(self, hops: list) -> list[HopFormat]:
         """
         Takes the raw hops from Sagan Traceroute object, and processes the data.
 
@@ -123,36 +129,31 @@ class DetectionMethod(MonitorStrategy):
                 hops (list): A list with raw hop data.
 
         Returns:
-                cleanend_hops (list): contains dict objects with {hop(id), ip, as, min_rtt}  
+                cleanend_hops (list): contains HopFormat records with hop(id), ip_address, asn and min_rtt
         """
         cleaned_hops = []
         for hop_object in hops:
             if 'error' in hop_object.raw_data:
-                cleaned_hops.append({
-                    'hop': hop_object.raw_data['hop'],
-                    'ip': None,
-                    'min_rtt': None,
-                })
+                cleaned_hops.append(HopFormat(hop_object.raw_data['hop'], None, None, None))
             else:
                 hop_packets = hop_object.raw_data['result']
                 hop_ip = None
-                hop_as = None
                 min_hop_rtt = float('inf')
                 for packet in hop_packets:
                     if 'rtt' in packet:
                         if packet['rtt'] < min_hop_rtt:
                             hop_ip = packet['from']
-                            hop_as = self.as_look_up.get_as(hop_ip)
                             min_hop_rtt = packet['rtt']
                 min_hop_rtt = float(min_hop_rtt)
                 if min_hop_rtt == float('inf'):
                     min_hop_rtt = None
-                cleaned_hops.append({
-                    'hop': hop_object.raw_data['hop'],
-                    'ip': hop_ip,
-                    'asn': hop_as,
-                    'min_rtt': min_hop_rtt,
-                })
+                cleaned_hops.append(HopFormat(hop_object.raw_data['hop'], hop_ip, min_hop_rtt, None))
+        # Only the IP of the fastest packet matters, so all hops are looked up together afterwards.
+        hop_ips = [hop.ip_address for hop in cleaned_hops if hop.ip_address is not None]
+        hop_asns = iter(self.as_look_up.get_as_batch(hop_ips))
+        for hop in cleaned_hops:
+            if hop.ip_address is not None:
+                hop.asn = next(hop_asns)
         return cleaned_hops
 
     def find_network_entry_hop(self, hops: list, user_ip: str):
@@ -173,14 +174,14 @@ class DetectionMethod(MonitorStrategy):
 
         hops.reverse()
         for idx, hop in enumerate(hops):
-            if hop['asn'] != user_as:
-                entry_ip = hop['ip']
-                entry_rtt = hops[idx - 1]['min_rtt']
+            if hop.asn != user_as:
+                entry_ip = hop.ip_address
+                entry_rtt = hops[idx - 1].min_rtt
                 if idx - 1 == -1:
                     entry_rtt = float('inf')
                 break
         if isinstance(entry_ip, str):
-            entry_as = hop['asn']
+            entry_as = hop.asn
         else:
             entry_ip = None
         return entry_rtt, entry_ip, entry_as
@@ -198,32 +199,40 @@ class DetectionMethod(MonitorStrategy):
                 detection results added for all succesfully
                 analyzed time series.
         """
+        df_outlier = self.detect_level_shifts(self.load_measurements(collection), value_column='entry_rtt',
+                                              group_column='probe_id', time_column='created', window=3, c=10.0,
+                                              side='positive')
+        return df_outlier
+
+    def load_measurements(self, collection) -> pd.DataFrame:
+        """
+        Loads the measurements of the last day from the collection.
+        """
         all_measurements = []
 
         qdate = datetime.now() - timedelta(days=1)
         for measurement in collection.find({"created": {"$lt": qdate}}):
             all_measurements.append(measurement)
+        return pd.DataFrame(all_measurements)
 
-        df = pd.DataFrame(all_measurements)
-
-        level_shift = LevelShiftAD(c=10.0, side='positive', window=3)
-        df_outlier = pd.DataFrame()
-
-        for probe_id in df["probe_id"].unique():
-            single_probe = df[df["probe_id"] == probe_id].copy()
-            single_probe.set_index('created', inplace=True)
-            time_series = single_probe['entry_rtt']
-            time_series = validate_series(time_series)
-
-            try:
-                level_anomalies = level_shift.fit_detect(time_series)
-                single_probe["level_shift"] = level_anomalies
-                df_outlier = pd.concat([df_outlier, single_probe])
+    def detect_changes(self, measurement_id: str, results: list) -> list[AnomalyObject]:
+        """
+        Adds new results to the last day of the measurement and filters it again. Only the probes with new
+        results are analyzed again.
 
-            except RuntimeError:
-                pass
+        Parameters:
+                measurement_id (str): The measurement the results belong to.
+                results (list): Preprocessed results (ProbeMeasurement, the first value of preprocess()) since the
+                previous call.
 
-        return df_outlier
+        Returns:
+                anomalies (list): The anomalies in the last day of the measurement.
+        """
+        with self.windows_lock:
+            window = self.windows.get(measurement_id)
+            if window is None:
+                window = self.windows[measurement_id] = LevelShiftWindow(detect=self.detect_level_shifts)
+        return self.filter(window.add(ProbeMeasurement.to_frame(results)))
 
     def filter(self, df_outlier: pd.DataFrame) -> list[AnomalyObject]:
         """
@@ -236,54 +245,23 @@ class DetectionMethod(MonitorStrategy):
                 anomalies (list): A list with all anomalies organized with description, and if the anomalie
                 should be alerted.
         """
-        MIN_ANOMALY_SCORE = 10
-        LOOKBACK = 3
-        anomalies = []
-
-        unique_as_nums = df_outlier['entry_as'].unique()
+        return self.to_anomalies(score_entry_ases(df_outlier))
 
-        for as_num in unique_as_nums:
-            single_as_df = df_outlier[df_outlier['entry_as'] == as_num]
-            probes_in_as = len(single_as_df['probe_id'].unique())
-
-            if probes_in_as > 4:
-                as_anomalies = single_as_df.groupby(pd.Grouper(
-                    freq="20T", closed='right', convention='end'))["level_shift"].agg("sum")
-                try:
-                    as_anomalies.plot()
-                except:
-                    pass
-                score = round(
-                    (as_anomalies[-LOOKBACK] / probes_in_as) * 100, 2)
-                alert_time = as_anomalies.index[-LOOKBACK]
-
-                print(f'Score in {as_num}: {score} at {alert_time}')
-                if score > MIN_ANOMALY_SCORE:
-                    ip_adresses = single_as_df[single_as_df['level_shift'] == True]['entry_ip'].unique(
-                    ).tolist()
-                    unique_probes = single_as_df['probe_id'].unique()
-                    changes_in_rtt = []
-                    for probe_id in unique_probes:
-                        single_probe = single_as_df[single_as_df["probe_id"] == probe_id]
-                        if len(single_probe) > 4:
-                            mean_probe_rtt = single_probe['entry_rtt'][:-
-                                                                       LOOKBACK - 1].median()
-                            current_probe_rtt = single_probe['entry_rtt'][-LOOKBACK]
-                            change_in_rtt = current_probe_rtt - mean_probe_rtt
-                            changes_in_rtt.append(change_in_rtt)
-
-                            mean_value_change = sum(
-                                changes_in_rtt) / len(changes_in_rtt)
-
-                    print(
-                        f'Anomaly at {alert_time.strftime("%d/%m/%Y, %H:%M:%S")} in AS{as_num}. Problem with {as_anomalies[-LOOKBACK]} probes. Percentage of AS: {score}')
-                    anomalies.append(AnomalyObject(
-                        time=alert_time,
-                        ip_address=ip_adresses,
-                        autonomous_system=as_num,
-                        measurement_type='traceroute',
-                        detection_method='entry_connection',
-                        mean_increase=mean_value_change,
-                        anomaly_score=score
-                    ))
+    def to_anomalies(self, alerts: list) -> list[AnomalyObject]:
+        """
+        Turns the alerts of the entry AS scoring into anomaly objects.
+        """
+        anomalies = []
+        for alert in alerts:
+            print(f'Anomaly at {alert["time"].strftime("%d/%m/%Y, %H:%M:%S")} in AS{alert["asn"]}. '
+                  f'Problem with {alert["affected_probes"]} probes. Percentage of AS: {alert["anomaly_score"]}')
+            anomalies.append(AnomalyObject(
+                time=alert['time'],
+                ip_address=alert['ip_address'],
+                asn=alert['asn'],
+                measurement_type='traceroute',
+                detection_method='entry_connection',
+                mean_increase=alert['mean_increase'],
+                anomaly_score=alert['anomaly_score']
+            ))
         return anomalies
@@ -0,0 +1,98 @@
+"""
+Scoring of level shifts per entry AS, for all entry ASes at once.
+
+For every entry AS seen by more than MIN_PROBES probes, the level shifts are summed per 20 minute bucket (buckets
+(t - 20 min, t], like pd.Grouper(freq="20T", closed='right')) and the bucket LOOKBACK buckets from the end is scored:
+the percentage of the probes of the AS with a level shift in that bucket. For alerting ASes the mean increase is the
+mean over their probes (with more than MIN_MEASUREMENTS measurements) of the LOOKBACK-th last round trip time minus
+the median of the round trip times before the last LOOKBACK + 1.
+"""
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+BUCKET = np.int64(20 * 60 * 10 ** 9)  # 20 minutes in nanoseconds.
+MIN_PROBES = 4
+MIN_MEASUREMENTS = 4  # Of a probe, to have a baseline.
+MIN_ANOMALY_SCORE = 10
+LOOKBACK = 3
+
+
+def bucket_labels(times: np.ndarray) -> np.ndarray:
+    """ Returns the start of the 20 minute bucket (t - 20 min, t] of every time, as nanoseconds. """
+    nanoseconds = times.astype('datetime64[ns]').astype(np.int64)
+    return -(-nanoseconds // BUCKET) * BUCKET - BUCKET
+
+
+def score_entry_ases(df_outlier: pd.DataFrame, min_probes: int = MIN_PROBES,
+                     min_anomaly_score: float = MIN_ANOMALY_SCORE, lookback: int = LOOKBACK) -> List[dict]:
+    """
+    Scores every entry AS in one pass of grouped aggregations.
+
+    Parameters:
+            df_outlier (pandas.DataFrame): Output of detect_level_shifts, indexed by time, with probe_id, entry_as,
+            entry_ip, entry_rtt and level_shift columns.
+
+    Returns:
+            alerts (list): A dict per alerting AS (in order of appearance) with time, asn, ip_address (entry IPs
+            with a level shift), affected_probes, anomaly_score and mean_increase (None without probes with enough
+            measurements).
+    """
+    if df_outlier.empty:
+        return []
+    as_codes, as_numbers = pd.factorize(df_outlier['entry_as'])
+    known = as_codes >= 0
+    as_codes = as_codes[known]
+    probe_ids = df_outlier['probe_id'].to_numpy()[known]
+    level_shift = np.nan_to_num(df_outlier['level_shift'].to_numpy(dtype=float)[known])
+    labels = bucket_labels(df_outlier.index.to_numpy()[known])
+    ases = len(as_numbers)
+
+    first_label = np.full(ases, np.iinfo(np.int64).max)
+    last_label = np.full(ases, np.iinfo(np.int64).min)
+    np.minimum.at(first_label, as_codes, labels)
+    np.maximum.at(last_label, as_codes, labels)
+    scored_label = last_label - (lookback - 1) * BUCKET
+    in_scored_bucket = labels == scored_label[as_codes]
+    affected = np.bincount(as_codes, weights=level_shift * in_scored_bucket, minlength=ases)
+    probes = pd.Series(probe_ids).groupby(as_codes).nunique().reindex(range(ases)).to_numpy()
+    scores = np.round(affected / probes * 100, 2)
+    alerting = (probes > min_probes) & (scored_label >= first_label) & (scores > min_anomaly_score)
+    if not alerting.any():
+        return []
+
+    # The details are only needed for the (few) alerting ASes.
+    rows = np.flatnonzero(known)[alerting[as_codes]]
+    details = pd.DataFrame({
+        'as_code': as_codes[alerting[as_codes]],
+        'probe_id': probe_ids[alerting[as_codes]],
+        'entry_ip': df_outlier['entry_ip'].to_numpy()[rows],
+        'entry_rtt': df_outlier['entry_rtt'].to_numpy(dtype=float)[rows],
+        'level_shift': level_shift[alerting[as_codes]],
+    })
+    ip_addresses = details[details['level_shift'] == 1].drop_duplicates(['as_code', 'entry_ip']) \
+        .groupby('as_code', sort=False)['entry_ip'].agg(list)
+
+    probe_groups = details.groupby(['as_code', 'probe_id'], sort=False)
+    details['probe_order'] = probe_groups.ngroup()
+    position = probe_groups.cumcount().to_numpy()
+    size = probe_groups['entry_rtt'].transform('size').to_numpy()
+    baseline = details[position < size - lookback - 1].groupby('probe_order')['entry_rtt'].median()
+    current = details[(position == size - lookback) & (size > MIN_MEASUREMENTS)].sort_values('probe_order')
+    current = current.assign(
+        change=current['entry_rtt'].to_numpy() - baseline.reindex(current['probe_order']).to_numpy())
+    changes = current.groupby('as_code', sort=False)['change'].agg(list)
+
+    alerts = []
+    for as_code in np.flatnonzero(alerting):
+        as_changes = changes.get(as_code, [])
+        alerts.append({
+            'time': pd.Timestamp(scored_label[as_code]),
+            'asn': as_numbers[as_code],
+            'ip_address': ip_addresses.get(as_code, []),
+            'affected_probes': affected[as_code],
+            'anomaly_score': scores[as_code],
+            'mean_increase': sum(as_changes) / len(as_changes) if as_changes else None,
+        })
+    return alerts
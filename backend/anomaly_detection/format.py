@@ -1,15 +1,22 @@
 import datetime
-from database.models import Probe
+import pandas as pd
+
+
+# The records below are made for every streamed result and every hop of it, so they have __slots__ instead of a
+# per-instance __dict__ (see benchmarks/bench_records.py).
 
 class ProbeMeasurement:
+    __slots__ = ('probe_id', 'created', 'entry_rtt', 'entry_ip', 'entry_as')
+
     def __init__(self, probe_id: int, created: datetime.datetime, entry_rtt, entry_ip: str, entry_as):
         self.probe_id = probe_id
         self.created = created
-        self.entry_rtt = None
+        self.entry_rtt = entry_rtt
         self.entry_ip = entry_ip
-        self.entry_as = None
+        self.entry_as = entry_as
 
     def save_to_database(self) -> None:
+        from database.models import Probe
         probe = Probe.objects.create(probe=self.probe_id,
                                     measurement_id=31,
                                     as_number=1103, #dummy data
@@ -17,11 +24,19 @@ class ProbeMeasurement:
         probe.save()
         print(self)
 
+    @staticmethod
+    def to_frame(measurements: list) -> pd.DataFrame:
+        """ A DataFrame with a column per field, built column by column instead of from a dict per measurement. """
+        return pd.DataFrame({field: [getattr(measurement, field) for measurement in measurements]
+                             for field in ProbeMeasurement.__slots__})
+
     def __str__(self):
         return str(self.probe_id) + ' ' + str(self.created)
 
 
 class HopFormat:
+    __slots__ = ('hop', 'ip_address', 'min_rtt', 'asn')
+
     def __init__(self, hop, ip, min_rtt, asn):
         self.hop = hop
         self.ip_address = ip
@@ -38,4 +53,3 @@ class HopFormat:
     #         hop = Hop(**hop)
     #         list.append(hop)
     #     return list
-            
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Level shift detection for many time series at once.
+
+Gives the same results as running ADTK's LevelShiftAD(window, c, side) on every probe separately, but computes the
+rolling medians and the inter-quartile ranges of all probes together with numpy. Per probe (on its series sorted by
+time, duplicate timestamps removed):
+
+    left[t]  = median(value[t - window], ..., value[t - 1])
+    right[t] = median(value[t], ..., value[t + window - 1])
+    diff[t]  = right[t] - left[t]
+
+A point is a level shift when |diff| > Q3 + c * IQR of all |diff| of the probe, and diff has the sign given by side.
+Windows containing a missing or infinite value have no median (like pandas' rolling median), points without both
+medians are NaN. Probes without a single |diff| are left out of the result, like the RuntimeError of ADTK.
+"""
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def rolling_medians(values: np.ndarray, groups: np.ndarray, window: int) -> np.ndarray:
+    """
+    Returns the median of every window values[j:j + window], NaN when the window is shorter, crosses two groups
+    or contains a missing value. values must be sorted by group.
+    """
+    medians = np.full(len(values), np.nan)
+    if len(values) < window:
+        return medians
+    windows = sliding_window_view(values, window)
+    complete = (groups[:len(windows)] == groups[window - 1:]) & ~np.isnan(windows).any(axis=1)
+    medians[:len(windows)][complete] = np.median(windows[complete], axis=1)
+    return medians
+
+
+def level_shifts(values: np.ndarray, groups: np.ndarray, window: int = 3, c: float = 10.0,
+                 side: str = 'positive') -> np.ndarray:
+    """
+    Detects level shifts in the time series of all groups.
+
+    Parameters:
+            values (numpy.ndarray): Values of all series, sorted by group and time.
+            groups (numpy.ndarray): Integer group (probe) of every value.
+            window (int): Amount of values in the windows before and after a point.
+            c (float): Factor of the inter-quartile range above which a shift is anomalous.
+            side (str): 'positive' (only increases), 'negative' (only decreases) or 'both'.
+
+    Returns:
+            level_shift (numpy.ndarray): Per value 1.0 (level shift), 0.0 (no level shift) or NaN (not enough data).
+    """
+    if side not in ('both', 'positive', 'negative'):
+        raise ValueError("Parameter `side` must be 'both', 'positive' or 'negative'.")
+    values = np.where(np.isfinite(values), values, np.nan)
+    medians = rolling_medians(values, groups, window)
+
+    # The right window of a point starts at the point, the left window ends right before it.
+    right = medians
+    left = np.full(len(values), np.nan)
+    left[window:] = medians[:len(values) - window]
+    left[window:][groups[window:] != groups[:len(values) - window]] = np.nan
+    diff = right - left
+    diff_abs = np.abs(diff)
+
+    quartiles = pd.Series(diff_abs).groupby(groups).quantile([0.25, 0.75]).unstack()
+    q1 = quartiles[0.25].reindex(groups).to_numpy()
+    q3 = quartiles[0.75].reindex(groups).to_numpy()
+    with np.errstate(invalid='ignore'):
+        shifted = diff_abs > q3 + c * (q3 - q1)
+        if side == 'positive':
+            shifted &= diff > 0
+        elif side == 'negative':
+            shifted &= diff < 0
+    return np.where(np.isnan(diff), np.nan, shifted.astype(float))
+
+
+def detect_level_shifts(df: pd.DataFrame, value_column: str = 'entry_rtt', group_column: str = 'probe_id',
+                        time_column: str = 'created', window: int = 3, c: float = 10.0,
+                        side: str = 'positive') -> pd.DataFrame:
+    """
+    Adds a 'level_shift' column to a DataFrame of many time series, in the layout the per probe ADTK loop produced:
+    indexed by time, the rows of each probe together (probes in order of appearance, rows in their original order),
+    probes without enough data left out.
+
+    Parameters:
+            df (pandas.DataFrame): One row per measurement, with group, time and value columns.
+
+    Returns:
+            df_outlier (pandas.DataFrame): The analyzed rows with the level_shift column.
+    """
+    if df.empty:
+        return pd.DataFrame()
+    groups, _ = pd.factorize(df[group_column])
+    times = df[time_column].to_numpy()
+    values = pd.to_numeric(df[value_column], errors='coerce').to_numpy(dtype=float)
+
+    # Sort by probe and time, the first of duplicate timestamps is used (like adtk.data.validate_series).
+    order = np.lexsort((times, groups))
+    sorted_groups, sorted_times = groups[order], times[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (sorted_groups[1:] != sorted_groups[:-1]) | (sorted_times[1:] != sorted_times[:-1])
+    unique_rows = order[first]
+    level_shift = level_shifts(values[unique_rows], groups[unique_rows], window, c, side)
+
+    # Every row gets the result of the first row with its probe and timestamp.
+    representative = np.empty(len(order), dtype=np.int64)
+    representative[order] = np.cumsum(first) - 1
+    row_level_shift = level_shift[representative]
+
+    analyzed = np.bincount(groups[unique_rows], weights=~np.isnan(level_shift), minlength=groups.max() + 1) > 0
+    rows = np.argsort(groups, kind='stable')
+    rows = rows[analyzed[groups[rows]]]
+    df_outlier = df.iloc[rows].copy()
+    df_outlier['level_shift'] = row_level_shift[rows]
+    return df_outlier.set_index(time_column)
+
+
+class LevelShiftWindow:
+    """
+    The measurements of the last `span` with their level shifts, updated in micro-batches. Only the probes that got
+    new measurements, or lost measurements that fell out of the window, are detected again; the results of all other
+    probes are kept. `detect` runs the detection, detect_level_shifts or a function with the same arguments and result
+    (see parallel_analysis.py).
+    """
+
+    def __init__(self, span: pd.Timedelta = pd.Timedelta(days=1), value_column: str = 'entry_rtt',
+                 group_column: str = 'probe_id', time_column: str = 'created', window: int = 3, c: float = 10.0,
+                 side: str = 'positive', detect: Callable[..., pd.DataFrame] = detect_level_shifts):
+        self.span = span
+        self.detect = detect
+        self.group_column = group_column
+        self.time_column = time_column
+        self.detect_arguments = dict(value_column=value_column, group_column=group_column, time_column=time_column,
+                                     window=window, c=c, side=side)
+        self.rows = pd.DataFrame()
+        self.df_outlier = pd.DataFrame()
+
+    def add(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds new measurements and drops the ones older than span before the newest.
+
+        Parameters:
+                new_rows (pandas.DataFrame): New measurements, with the columns detect_level_shifts needs.
+
+        Returns:
+                df_outlier (pandas.DataFrame): detect_level_shifts of all measurements in the window (probes that
+                did not change first).
+        """
+        if new_rows.empty:
+            return self.df_outlier
+        rows = pd.concat([self.rows, new_rows], ignore_index=True) if not self.rows.empty \
+            else new_rows.reset_index(drop=True)
+        times = pd.to_datetime(rows[self.time_column])
+        expired = (times < times.max() - self.span).to_numpy()
+        changed = pd.unique(np.concatenate([new_rows[self.group_column].to_numpy(),
+                                            rows[self.group_column].to_numpy()[expired]]))
+        self.rows = rows[~expired].reset_index(drop=True)
+
+        redone = self.detect(self.rows[self.rows[self.group_column].isin(changed)], **self.detect_arguments)
+        kept = self.df_outlier[~self.df_outlier[self.group_column].isin(changed)] if not self.df_outlier.empty \
+            else self.df_outlier
+        parts = [part for part in (kept, redone) if not part.empty]
+        self.df_outlier = pd.concat(parts) if parts else pd.DataFrame()
+        return self.df_outlier
+
+    def __len__(self) -> int:
+        return len(self.rows)
@@ -19,7 +19,7 @@ class MonitorStrategy(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    def preprocess(self, measurement_result) -> dict:
+    def preprocess(self, measurement_result) -> tuple:
         raise NotImplementedError()
 
     @abstractmethod
@@ -33,3 +33,16 @@ class MonitorStrategy(ABC):
     @abstractmethod
     def filter(self, df) -> list:
         raise NotImplementedError()
+
+    def detect(self, collection) -> list:
+        """
+        Analyzes the collection and returns the anomalies, by default analyze() followed by filter().
+        """
+        return self.filter(self.analyze(collection))
+
+    def detect_changes(self, measurement_id, results: list) -> list:
+        """
+        Analyzes the results received since the previous call for the same measurement (see
+        analysis_scheduler.py) and returns the anomalies.
+        """
+        raise NotImplementedError()
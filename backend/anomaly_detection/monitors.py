@@ -7,8 +7,10 @@ from ripe.atlas.cousteau import *
 import multiprocessing
 from .monitor_strategy_base import MonitorStrategy
 from database.models import MeasurementCollection, Anomaly, DetectionMethod, AutonomousSystem, Probe, MeasurementPoint, Hop
-from .format import HopFormat, ProbeMeasurement, HopFormat
+from .format import HopFormat, ProbeMeasurement
 from .requests import ProbeRequest
+from .analysis_scheduler import AnalysisScheduler
+from anomaly_detection_reworked.anomaly_sink import anomaly_sink
 from time import perf_counter
 
 
@@ -32,7 +34,8 @@ class DataManager:
         
         object, created_point = MeasurementPoint.objects.get_or_create(probe=obj,
                                         time=probe_measurement.created,
-                                        round_trip_time_ms=probe_measurement.entry_rtt,
+                                        round_trip_time_ms=probe_measurement.entry_rtt
+                                        if probe_measurement.entry_rtt != float('inf') else None,
                                         hops_total=total_hops)
 
         # print('Probe ' + str(probe_measurement.probe_id) + ' is saved!')
@@ -58,6 +61,8 @@ class Monitor:
 
         self.measurement = MeasurementCollection
         self.strategy = strategy
+        self.scheduler = AnalysisScheduler(self.analyze_results)
+        self.last_anomaly = {}  # (Measurement ID, ASN) -> time of the last stored anomaly.
 
     def __str__(self):
         return f"Monitor for {self.measurement.type} measurement: {self.measurement.measurement_id}"
@@ -68,34 +73,45 @@ class Monitor:
         Function called every time we receive a new result.
         Store the result in the corresponding Mongodb collection.
         """
-        measurement_result = self.strategy.preprocess(args[0])
+        probe_mesh, hops = self.strategy.preprocess(args[0])
         print('Received result')
-        probe_mesh = ProbeMeasurement(**measurement_result[0])
-        hops = measurement_result[1]
         hop_total = len(hops)
         measurementpoint_id =  DataManager.store(self, probe_mesh, self.measurement.id, hop_total)
         for hop in hops:
-            hop = HopFormat(**hop)
             DataManager.store_hops(self, hop, measurementpoint_id)
 
-        return
-        analyzed = self.strategy.analyze(measurement_result)
-        anomalies = self.strategy.filter(analyzed)
+        # Analyzing every result is far too expensive, the scheduler analyzes the new results in batches.
+        self.scheduler.add(self.measurement.measurement_id, probe_mesh, probe_mesh.created)
+
+    def analyze_results(self, measurement_id, results: list):
+        """
+        Called by the scheduler with the results received since the previous run, never twice at the same time.
+        """
+        anomalies = self.new_anomalies(measurement_id, self.strategy.detect_changes(measurement_id, results))
         if len(anomalies) > 0:
+            detection_method = DetectionMethod.objects.filter(type=self.strategy.detection_type()).first()
             for anomaly in anomalies:
-                detection_method = DetectionMethod.objects.get(type=self.measurement.type)
-
-                Anomaly.objects.create(time=anomaly['alert_time'],
-                                       ip_adress='127.0.0.1',  # Dummy data
-                                       asn_settings_id=1234,
-                                       description=anomaly['description'],
-                                       measurement_type=self.measurement.type,
-                                       detection_method_id=detection_method,
-                                       medium_value=0,  # Dummy data
-                                       value=0,  # Dummy data
-                                       anomaly_score=0,  # Dummy data
-                                       preditction_value=False,
-                                       asn_error=1111)  # Dummy data
+                anomaly.detection_method = detection_method
+                if anomaly.prediction_value is None:
+                    anomaly.prediction_value = False  # Not judged by the feedback model yet.
+                anomaly.store(sink=anomaly_sink)
+            anomaly_sink.flush()  # All anomalies of the run in one transaction.
+        db.connection.close()  # Runs in its own thread, do not leak its database connection.
+
+    def new_anomalies(self, measurement_id, anomalies: list) -> list:
+        """
+        Every run scores the whole window, so a run in the same bucket as the previous one finds the same anomalies
+        again. Returns the anomalies that are newer than the last one stored for their measurement and AS.
+        """
+        new = []
+        for anomaly in anomalies:
+            key = (measurement_id, anomaly.asn)
+            last = self.last_anomaly.get(key)
+            if last is not None and anomaly.time <= last:
+                continue
+            self.last_anomaly[key] = anomaly.time
+            new.append(anomaly)
+        return new
 
     def on_error(*args):
         "got in on_error"
@@ -0,0 +1,88 @@
+"""
+Level shift detection (detect_level_shifts) spread over a process pool, for the large inputs of the entry connection
+analysis: the first batch of a measurement, or a batch with new results of many probes, redoes a day of measurements
+of every probe in it.
+
+Level shifts are detected per probe, so the rows are split into partitions of whole probes: consecutive probes (in
+order of appearance) with about as many rows in every partition. Workers get plain numpy arrays, with the probes
+replaced by integer codes, and return the level shifts of the rows they analyzed. The result has the same rows, in the
+same order, as detect_level_shifts of all rows in one process.
+
+The pool starts its workers with the spawn method: the Django process runs the stream and the analysis scheduler in
+threads, and a forked worker would inherit the locks (and database connections) those threads hold.
+"""
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .level_shift import detect_level_shifts
+
+SERIAL_MAX_ROWS = 200_000  # Smaller inputs are analyzed in this process, a pool costs more than it saves.
+PARTITIONS_PER_WORKER = 4  # More partitions than workers, so one large partition does not keep the others waiting.
+
+
+def partition_probes(probe_codes: np.ndarray, partitions: int) -> List[np.ndarray]:
+    """ Splits the row numbers into at most `partitions` groups of consecutive probe codes, balanced by row count.
+        A probe is never split, row numbers stay in their original order. """
+    rows_per_probe = np.bincount(probe_codes)
+    first_row_of_probe = np.cumsum(rows_per_probe) - rows_per_probe
+    partition_of_probe = first_row_of_probe * partitions // len(probe_codes)
+    partition_of_row = partition_of_probe[probe_codes]
+    return [np.flatnonzero(partition_of_row == partition) for partition in np.unique(partition_of_probe)]
+
+
+def detect_partition(arrays: Dict[str, np.ndarray], arguments: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """ Runs in a worker: detects the level shifts of one partition. Returns the row numbers of the analyzed rows,
+        in the order of detect_level_shifts, and their level shifts. """
+    df = pd.DataFrame(arrays)
+    df_outlier = detect_level_shifts(df, value_column='value', group_column='probe_code', time_column='time',
+                                     **arguments)
+    if df_outlier.empty:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return df_outlier['row'].to_numpy(), df_outlier['level_shift'].to_numpy()
+
+
+def detect_level_shifts_parallel(df: pd.DataFrame, workers: Optional[int] = None,
+                                 serial_max_rows: int = SERIAL_MAX_ROWS, value_column: str = 'entry_rtt',
+                                 group_column: str = 'probe_id', time_column: str = 'created', window: int = 3,
+                                 c: float = 10.0, side: str = 'positive') -> pd.DataFrame:
+    """
+    detect_level_shifts in worker processes for large inputs.
+
+    Parameters:
+            df (pandas.DataFrame): One row per measurement, with group, time and value columns.
+            workers (int): Amount of worker processes, None for one per CPU.
+            serial_max_rows (int): Inputs up to this many rows are analyzed in this process.
+
+    Returns:
+            df_outlier (pandas.DataFrame): The same as detect_level_shifts(df).
+    """
+    workers = workers or os.cpu_count() or 1
+    if df.empty or workers <= 1 or len(df) <= serial_max_rows:
+        return detect_level_shifts(df, value_column=value_column, group_column=group_column,
+                                   time_column=time_column, window=window, c=c, side=side)
+
+    probe_codes, _ = pd.factorize(df[group_column])
+    columns = {
+        'probe_code': probe_codes.astype(np.int64),
+        'time': df[time_column].to_numpy(),
+        'value': pd.to_numeric(df[value_column], errors='coerce').to_numpy(dtype=float),
+        'row': np.arange(len(df), dtype=np.int64),
+    }
+    partitions = partition_probes(probe_codes, workers * PARTITIONS_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=min(workers, len(partitions)),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = list(executor.map(detect_partition,
+                                    ({name: values[rows] for name, values in columns.items()} for rows in partitions),
+                                    itertools.repeat(dict(window=window, c=c, side=side))))
+
+    # Partitions hold consecutive probes, so their results in partition order are in the order of all rows at once.
+    rows = np.concatenate([partition_rows for partition_rows, _ in results])
+    df_outlier = df.iloc[rows].copy()
+    df_outlier['level_shift'] = np.concatenate([level_shift for _, level_shift in results])
+    return df_outlier.set_index(time_column)
@@ -0,0 +1,242 @@
+"""
+Longest prefix match table for IP to AS lookups, stored as a versioned binary snapshot.
+
+The routing prefixes (which can be nested) are flattened into sorted, non-overlapping address ranges that each
+carry the origin AS of the most specific prefix covering them. A lookup is a binary search over the range starts.
+The snapshot file contains these arrays as-is, so loading it is a memory map instead of parsing and building a tree.
+Single lookups bisect memoryviews of the arrays, which read Python ints straight from the (shared) memory map: a
+numpy call per address costs more than the whole search. IPv4 searches start from an index of the first range of
+every /16 block, so they only bisect the few ranges inside one block.
+
+IPv6 addresses are keyed on their first 64 bits. Routed IPv6 prefixes are at most /48 in practice, so this does not
+change the outcome of a lookup while it keeps every key in a 64-bit integer.
+
+Snapshot layout (little endian):
+    header:  magic (8 bytes), version (uint32), reserved (uint32), created (float64, unix time),
+             amount of IPv4 ranges (uint64), amount of IPv6 ranges (uint64)
+    arrays:  IPv4 starts (uint32), IPv4 ASNs (uint32), IPv6 starts (uint64), IPv6 ASNs (uint32),
+             every array starts at a multiple of 8 bytes.
+"""
+import mmap
+import os
+import socket
+import struct
+import time
+from bisect import bisect_right
+from typing import Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b"RISPFX\x00\x00"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct("<8sIIdQQ")
+NO_ASN = 0  # Address ranges without a route.
+IPV4_MAX = 2 ** 32 - 1
+IPV6_MAX = 2 ** 64 - 1
+BLOCK_BITS = 16  # IPv4 addresses per block of the search index: 2 ** 16, 65,537 block boundaries (256 kB).
+IPV4_KEY = struct.Struct("!I").unpack
+IPV6_KEY = struct.Struct("!Q").unpack_from  # The first 64 bits.
+
+
+def prefix_range(prefix: str) -> Tuple[int, int, int]:
+    """ Returns the IP version and the first and last lookup key of a prefix such as "193.0.0.0/21".
+        Raises ValueError for invalid prefixes. """
+    address, _, length = prefix.partition('/')
+    try:
+        if ':' in address:
+            version, bits, packed = 6, 128, socket.inet_pton(socket.AF_INET6, address)
+        else:
+            version, bits, packed = 4, 32, socket.inet_pton(socket.AF_INET, address)
+        length = int(length) if length else bits
+    except OSError:
+        raise ValueError(f"{prefix!r} is not a valid prefix.")
+    if not 0 <= length <= bits:
+        raise ValueError(f"{prefix!r} is not a valid prefix.")
+    host_bits = bits - length
+    first = int.from_bytes(packed, 'big') >> host_bits << host_bits
+    last = first | ((1 << host_bits) - 1)
+    if version == 6:
+        return version, first >> 64, last >> 64
+    return version, first, last
+
+
+def searchable(array: np.ndarray) -> Union[memoryview, list]:
+    """ Returns a sequence of the array that bisect can search and whose items are Python ints. A memoryview does not
+        copy the array, only an array in another byte order than the host's is copied into a list. """
+    return memoryview(array) if array.dtype.isnative else array.tolist()
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, damaged or of another version."""
+    pass
+
+
+class PrefixTable:
+
+    def __init__(self, starts_v4: np.ndarray, asns_v4: np.ndarray, starts_v6: np.ndarray, asns_v6: np.ndarray,
+                 created: Optional[float] = None):
+        self.starts_v4 = starts_v4
+        self.asns_v4 = asns_v4
+        self.starts_v6 = starts_v6
+        self.asns_v6 = asns_v6
+        self.created = time.time() if created is None else created
+        self.search_v4 = (searchable(starts_v4), searchable(asns_v4), searchable(self.block_index(starts_v4)))
+        self.search_v6 = (searchable(starts_v6), searchable(asns_v6))
+
+    def __len__(self) -> int:
+        return len(self.starts_v4) + len(self.starts_v6)
+
+    @property
+    def age(self) -> float:
+        """ Seconds since the routing data of this table was retrieved. """
+        return time.time() - self.created
+
+    @staticmethod
+    def from_rows(rows: Iterable[Tuple[int, str]], created: Optional[float] = None) -> 'PrefixTable':
+        """
+        Builds a table from (asn, prefix) rows, for example (1103, "145.0.0.0/8"). Invalid prefixes are skipped.
+        When the same prefix occurs more than once, the last row wins.
+        """
+        prefixes = {4: {}, 6: {}}
+        for asn, prefix in rows:
+            try:
+                version, first, last = prefix_range(prefix)
+            except ValueError:
+                continue
+            prefixes[version][(first, last)] = asn
+        prefixes_v4, prefixes_v6 = prefixes[4], prefixes[6]
+        starts_v4, asns_v4 = PrefixTable.flatten(prefixes_v4, IPV4_MAX)
+        starts_v6, asns_v6 = PrefixTable.flatten(prefixes_v6, IPV6_MAX)
+        return PrefixTable(np.array(starts_v4, dtype=np.uint32), np.array(asns_v4, dtype=np.uint32),
+                           np.array(starts_v6, dtype=np.uint64), np.array(asns_v6, dtype=np.uint32), created)
+
+    @staticmethod
+    def flatten(prefixes: dict, max_address: int) -> Tuple[list, list]:
+        """
+        Turns nested prefixes {(first address, last address): asn} into sorted range starts and the ASN of each range.
+        Prefixes are visited by first address (the widest first), a stack holds the prefixes covering the current
+        address; since prefixes are either nested or disjoint, the top of the stack is always the most specific one.
+        """
+        starts, asns = [0], [NO_ASN]
+
+        def begin_range(start: int, asn: int):
+            if starts[-1] == start:  # A more specific prefix starts at the same address.
+                asns[-1] = asn
+                if len(asns) > 1 and asns[-2] == asn:
+                    starts.pop()
+                    asns.pop()
+            elif asns[-1] != asn:
+                starts.append(start)
+                asns.append(asn)
+
+        stack = []
+        for (first, last), asn in sorted(prefixes.items(), key=lambda item: (item[0][0], -item[0][1])):
+            while stack and stack[-1][0] < first:
+                end, _ = stack.pop()
+                if end < max_address:
+                    begin_range(end + 1, stack[-1][1] if stack else NO_ASN)
+            begin_range(first, asn)
+            stack.append((last, asn))
+        while stack:
+            end, _ = stack.pop()
+            if end < max_address:
+                begin_range(end + 1, stack[-1][1] if stack else NO_ASN)
+        return starts, asns
+
+    @staticmethod
+    def block_index(starts: np.ndarray) -> np.ndarray:
+        """ Returns the position of the first range starting in every /16 block of IPv4 addresses, and the amount of
+            ranges at the end. The range holding an address of block b is then in starts[index[b] - 1:index[b + 1]]. """
+        blocks = np.arange(2 ** (32 - BLOCK_BITS) + 1, dtype=np.uint64) << np.uint64(BLOCK_BITS)
+        return starts.searchsorted(blocks, side='left').astype(np.uint32)
+
+    @staticmethod
+    def address_key(ip: str) -> Tuple[int, int]:
+        """ Returns the IP version and the lookup key of an IP address, raises ValueError for invalid addresses. """
+        try:
+            if ':' in ip:
+                return 6, IPV6_KEY(socket.inet_pton(socket.AF_INET6, ip))[0]
+            return 4, IPV4_KEY(socket.inet_pton(socket.AF_INET, ip))[0]
+        except (OSError, TypeError):
+            raise ValueError(f"{ip!r} is not a valid IP address.")
+
+    def lookup(self, ip: str) -> Optional[int]:
+        """ Returns the origin AS of the most specific prefix containing the IP address, None if there is none.
+            Raises ValueError for invalid IP addresses. """
+        try:
+            if ':' in ip:
+                starts, asns = self.search_v6
+                index = bisect_right(starts, IPV6_KEY(socket.inet_pton(socket.AF_INET6, ip))[0])
+            else:
+                starts, asns, blocks = self.search_v4
+                key = IPV4_KEY(socket.inet_pton(socket.AF_INET, ip))[0]
+                block = key >> BLOCK_BITS
+                index = bisect_right(starts, key, blocks[block], blocks[block + 1])
+        except (OSError, TypeError):
+            raise ValueError(f"{ip!r} is not a valid IP address.")
+        asn = asns[index - 1]  # The first range starts at 0, so index is at least 1.
+        return None if asn == NO_ASN else asn
+
+    def lookup_batch(self, ips: Sequence[str]) -> np.ndarray:
+        """ Looks up many IP addresses at once: the addresses are parsed into integer keys and every key is searched
+            in a single numpy call per address family. Returns the origin AS of every address (uint32), NO_ASN for
+            addresses without a route and for invalid addresses. """
+        positions_v4, keys_v4, positions_v6, keys_v6 = [], [], [], []
+        for position, ip in enumerate(ips):
+            try:
+                version, key = self.address_key(ip)
+            except ValueError:
+                continue
+            if version == 4:
+                positions_v4.append(position)
+                keys_v4.append(key)
+            else:
+                positions_v6.append(position)
+                keys_v6.append(key)
+
+        asns = np.full(len(ips), NO_ASN, dtype=np.uint32)
+        for positions, keys, starts, range_asns in ((positions_v4, keys_v4, self.starts_v4, self.asns_v4),
+                                                    (positions_v6, keys_v6, self.starts_v6, self.asns_v6)):
+            if keys:
+                indexes = starts.searchsorted(np.array(keys, dtype=starts.dtype), side='right') - 1
+                asns[positions] = range_asns[indexes]  # Index 0 always exists: the first range starts at 0.
+        return asns
+
+    def save(self, path: str) -> None:
+        """ Writes the snapshot to a temporary file first and then replaces the old snapshot, so a crash never
+            leaves a half written snapshot behind. """
+        temporary_path = path + ".tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, self.created,
+                                len(self.starts_v4), len(self.starts_v6)))
+            for array, dtype in ((self.starts_v4, '<u4'), (self.asns_v4, '<u4'),
+                                 (self.starts_v6, '<u8'), (self.asns_v6, '<u4')):
+                data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+                f.write(data)
+                f.write(b"\x00" * (-len(data) % 8))
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'PrefixTable':
+        """ Memory maps a snapshot: the arrays are read from disk on demand and shared (read-only) with every other
+            process that maps the same file. """
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as error:  # ValueError: the file is empty.
+            raise SnapshotError(f"Snapshot {path} can not be read: {error}")
+        if len(data) < HEADER.size:
+            raise SnapshotError(f"Snapshot {path} is damaged.")
+        magic, version, _, created, count_v4, count_v6 = HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Snapshot {path} has an unknown format (version {version}).")
+
+        arrays = []
+        offset = HEADER.size
+        for count, dtype in ((count_v4, '<u4'), (count_v4, '<u4'), (count_v6, '<u8'), (count_v6, '<u4')):
+            size = count * np.dtype(dtype).itemsize
+            if offset + size > len(data):
+                raise SnapshotError(f"Snapshot {path} is damaged.")
+            arrays.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+            offset += size + (-size % 8)
+        return PrefixTable(*arrays, created=created)
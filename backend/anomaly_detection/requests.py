@@ -1,6 +1,6 @@
-import requests
+from ripe_interface.paginator import paginate
 
-API_URL = "https://atlas.ripe.net/api/v2/anchors"
+API_URL = "https://atlas.ripe.net/api/v2/anchors/"
 
 class ProbeRequest:
 
@@ -10,14 +10,10 @@ class ProbeRequest:
 
     def get_probe_location(self, probe_id):
         if len(self.data) == 0:
-            for i in range(12):
-                i += 1
-                try: 
-                    response = requests.get(API_URL + f"?page={i}").json()
-                    for res in response['results']:
-                        self.data.append(res)
-                except:
-                    pass
+            try:
+                self.data.extend(paginate(API_URL, fields="probe,city,country,as_v4"))
+            except:
+                pass
         else:
             pass
         for item in self.data:
@@ -1,5 +1,16 @@
 import os
+import functools
 import importlib
+import gzip
+import ipaddress
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+import radix
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from django.test import TestCase
@@ -7,7 +18,20 @@ from django.contrib.auth.models import User
 from database.models import Anomaly, Setting
 from database.models import DetectionMethod as DetecionMethodModel
 from anomaly_detection.anomaly_object import AnomalyObject
+from anomaly_detection import as_tools
+from anomaly_detection.as_tools import TEST_DUMP, ASLookUp, get_as_lookup, parse_ris_rows, read_ris_dump
+from anomaly_detection.entry_scoring import score_entry_ases
+from anomaly_detection.analysis_scheduler import AnalysisScheduler
+from anomaly_detection.format import ProbeMeasurement
+from anomaly_detection.monitors import Monitor
+from anomaly_detection.level_shift import LevelShiftWindow, detect_level_shifts
+from anomaly_detection import parallel_analysis
+from anomaly_detection.parallel_analysis import detect_level_shifts_parallel, partition_probes
+from anomaly_detection.prefix_table import NO_ASN, PrefixTable, SnapshotError
+from anomaly_detection.detection_methods import entry_connection
+from ripe.atlas.sagan import TracerouteResult
 from anomaly_detection_reworked.detection_method import DetectionMethod
+from benchmarks.bench_level_shift import adtk_level_shifts
 from anomaly_detection_reworked.detection_methods.entry_point_delay import EntryPointDelay
 from ripe_interface.api import set_autonomous_system_setting
 from ripe_interface.api_schemas import ASNumber
@@ -68,3 +92,523 @@ class TestAnomalyObject(TestCase):
         self.anomaly_1.store()
         assert len(Anomaly.objects.all()) == 1
 
+
+RIS_DUMP = """% This is the RIPE NCC RIS whois dump
+% primary-key: prefix
+
+1103\t145.0.0.0/8\t200
+1104\t145.100.0.0/16\t150
+1105\t145.100.4.0/24\t100
+{1,2}\t10.0.0.0/8\t10
+3333\t193.0.0.0/21\t300
+3333\t2001:67c:2e8::/48\t250
+"""
+
+
+class TestPrefixTable(TestCase):
+    """Test module for the prefix table and its snapshots."""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.directory.name, "ris_snapshot.bin")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_longest_prefix_match(self):
+        """
+        Compare lookups of random nested prefixes with a brute force longest prefix match.
+        """
+        generator = random.Random(42)
+        prefixes = {}
+        for asn in range(1, 400):
+            length = generator.randint(8, 28)
+            network = ipaddress.ip_network((generator.getrandbits(8) << 24 | generator.getrandbits(24), length),
+                                           strict=False)
+            prefixes[network] = asn
+        table = PrefixTable.from_rows((asn, str(network)) for network, asn in prefixes.items())
+        for network in list(prefixes)[:100]:
+            for number in (int(network.network_address), int(network.broadcast_address),
+                           min(int(network.broadcast_address) + 1, 2 ** 32 - 1)):
+                address = ipaddress.ip_address(number)
+                covering = [n for n in prefixes if address in n]
+                expected = prefixes[max(covering, key=lambda n: n.prefixlen)] if covering else None
+                self.assertEqual(table.lookup(str(address)), expected)
+        addresses = [str(ipaddress.ip_address(generator.getrandbits(32))) for _ in range(2000)]
+        self.assertEqual([table.lookup(ip) or NO_ASN for ip in addresses], table.lookup_batch(addresses).tolist())
+
+    def test_snapshot(self):
+        """
+        A saved snapshot loads (memory mapped) with the same lookups, damaged or missing snapshots are refused.
+        """
+        with patch('subprocess.run') as run:
+            run.return_value.stdout = RIS_DUMP.encode('utf-8')
+            as_look_up = ASLookUp(snapshot_path=self.snapshot_path)
+        loaded = PrefixTable.load(self.snapshot_path)
+        for ip, asn in (("145.1.1.1", 1103), ("145.100.3.1", 1104), ("145.100.4.9", 1105), ("10.1.1.1", None),
+                        ("193.0.7.255", 3333), ("193.0.8.0", None), ("2001:67c:2e8:22::c100:68b", 3333),
+                        ("2001:67c:2e9::1", None)):
+            self.assertEqual(loaded.lookup(ip), asn)
+            self.assertEqual(as_look_up.get_as(ip), None if asn is None else str(asn))
+        self.assertEqual(as_look_up.get_as("not an ip"), None)
+        self.assertEqual(as_look_up.get_as(None), None)
+
+        with open(self.snapshot_path, 'r+b') as f:
+            f.truncate(20)
+        with self.assertRaises(SnapshotError):
+            PrefixTable.load(self.snapshot_path)
+        with self.assertRaises(SnapshotError):
+            PrefixTable.load(self.snapshot_path + ".missing")
+
+    def test_staleness(self):
+        """
+        A fresh snapshot is used as is, a stale snapshot is refreshed, and when refreshing fails the stale
+        snapshot is used.
+        """
+        PrefixTable.from_rows(parse_ris_rows(RIS_DUMP.split("\n")), created=0).save(self.snapshot_path)
+        with patch('subprocess.run') as run:
+            ASLookUp(snapshot_path=self.snapshot_path, max_age=float('inf'))
+            run.assert_not_called()
+
+        with patch('subprocess.run', side_effect=subprocess.TimeoutExpired('whois', 300)):
+            as_look_up = ASLookUp(snapshot_path=self.snapshot_path)
+        self.assertEqual(as_look_up.get_as("145.100.4.9"), "1105")
+
+        with patch('subprocess.run') as run:
+            run.return_value.stdout = RIS_DUMP.replace("1105", "1106").encode('utf-8')
+            as_look_up = ASLookUp(snapshot_path=self.snapshot_path)
+        self.assertEqual(as_look_up.get_as("145.100.4.9"), "1106")
+        self.assertLess(PrefixTable.load(self.snapshot_path).age, 60)
+
+        os.remove(self.snapshot_path)
+        with patch('subprocess.run', side_effect=FileNotFoundError("whois")):
+            with self.assertRaises(FileNotFoundError):
+                ASLookUp(snapshot_path=self.snapshot_path)
+
+    def test_batch_lookup(self):
+        """
+        A batch lookup gives the same answers as single lookups and as a numpy batch, and caches them.
+        """
+        PrefixTable.from_rows(parse_ris_rows(RIS_DUMP.split("\n"))).save(self.snapshot_path)
+        as_look_up = ASLookUp(snapshot_path=self.snapshot_path)
+        ips = ["145.100.4.9", "2001:67c:2e8::1", "145.1.1.1", None, "10.0.0.1", "garbage", "145.100.4.9", "::1"]
+        expected = ["1105", "3333", "1103", None, None, None, "1105", None]
+        self.assertEqual(as_look_up.get_as_batch(ips), expected)
+        self.assertEqual(as_look_up.cache.cache_info().currsize, 7)
+        self.assertEqual(as_look_up.get_as_batch(ips), expected)
+        self.assertEqual([as_look_up.get_as(ip) for ip in ips], expected)
+        self.assertEqual(as_look_up.get_as_batch([]), [])
+        self.assertEqual([None if asn == NO_ASN else str(asn) for asn in as_look_up.table.lookup_batch(ips)], expected)
+
+    def test_clean_hops(self):
+        """
+        Hops get the AS of their fastest reply, hops without replies or with errors get no AS.
+        """
+        PrefixTable.from_rows(parse_ris_rows(RIS_DUMP.split("\n"))).save(self.snapshot_path)
+        detection_method = entry_connection.DetectionMethod.__new__(entry_connection.DetectionMethod)
+        detection_method.as_look_up = ASLookUp(snapshot_path=self.snapshot_path)
+        traceroute = TracerouteResult({
+            "af": 4, "dst_addr": "193.0.0.1", "from": "145.1.1.1", "msm_id": 5001, "prb_id": 6001, "fw": 5020,
+            "timestamp": 1652100000, "type": "traceroute", "result": [
+                {"hop": 1, "result": [{"from": "145.1.1.1", "rtt": 2.0}, {"from": "145.100.4.9", "rtt": 1.0}]},
+                {"hop": 2, "result": [{"x": "*"}, {"x": "*"}]},
+                {"hop": 3, "error": "Network is unreachable"},
+                {"hop": 4, "result": [{"from": "193.0.0.1", "rtt": 5.5}]}]
+        }, on_error=TracerouteResult.ACTION_IGNORE)
+        hops = detection_method.clean_hops(traceroute.hops)
+        self.assertEqual([(hop.ip_address, hop.asn, hop.min_rtt) for hop in hops],
+                         [("145.100.4.9", "1105", 1.0), (None, None, None), (None, None, None),
+                          ("193.0.0.1", "3333", 5.5)])
+
+    def test_load_ris_dumps(self):
+        """
+        Plain and gzip compressed dump files give the same table, which agrees with a radix tree of the dump.
+        """
+        plain_dump = os.path.join(self.directory.name, "riswhois_dump.txt")
+        with open(plain_dump, 'wb') as f:
+            f.write(gzip.decompress(open(TEST_DUMP, 'rb').read()))
+        rows = list(parse_ris_rows(read_ris_dump(TEST_DUMP)))
+        self.assertEqual(rows, list(parse_ris_rows(read_ris_dump(plain_dump))))
+        self.assertNotIn("10.0.0.0/8", [prefix for _, prefix in rows])  # Announced by an AS set, skipped.
+
+        as_look_up = ASLookUp(snapshot_path=self.snapshot_path, dump_files=[plain_dump])
+        report = as_look_up.load_ris_dumps([TEST_DUMP])
+        self.assertEqual((report.lines, report.prefixes), (20005, 20000))
+        self.assertGreater(report.lines_per_second, 0)
+        self.assertEqual(as_look_up.version, 2)
+
+        tree = radix.Radix()
+        for asn, prefix in rows:
+            tree.add(prefix).data["asn"] = str(asn)
+        generator = random.Random(7)
+        ips = []
+        for _, prefix in generator.sample(rows, 500):
+            network = ipaddress.ip_network(prefix)
+            ips.append(str(network.network_address + generator.randrange(min(network.num_addresses, 2 ** 32))))
+        expected = [None if tree.search_best(ip) is None else tree.search_best(ip).data["asn"] for ip in ips]
+        self.assertEqual(as_look_up.get_as_batch(ips), expected)
+
+        with open(plain_dump, 'w') as f:
+            f.write("% Nothing here\n")
+        with self.assertRaises(ValueError):
+            as_look_up.load_ris_dumps([plain_dump])
+        self.assertEqual(as_look_up.version, 2)
+
+    def test_refreshed_by_other_process(self):
+        """
+        When another process refreshed the snapshot in the meantime, refreshing uses that snapshot.
+        """
+        PrefixTable.from_rows(parse_ris_rows(RIS_DUMP.split("\n")), created=0).save(self.snapshot_path)
+        with patch('subprocess.run', side_effect=FileNotFoundError("whois")):
+            as_look_up = ASLookUp(snapshot_path=self.snapshot_path)
+        self.assertTrue(as_look_up.is_stale())
+
+        PrefixTable.from_rows(parse_ris_rows(RIS_DUMP.replace("1105", "1106").split("\n"))).save(self.snapshot_path)
+        with patch('subprocess.run') as run:
+            as_look_up.refresh()
+            run.assert_not_called()
+        self.assertEqual(as_look_up.get_as("145.100.4.9"), "1106")
+
+    def test_background_refresh(self):
+        """
+        A stale snapshot is used right away while the refresher builds a new table, which is then swapped in.
+        Readers holding the old state are not affected.
+        """
+        PrefixTable.from_rows(parse_ris_rows(RIS_DUMP.split("\n")), created=0).save(self.snapshot_path)
+        whois_called = threading.Event()
+        release_whois = threading.Event()
+
+        def slow_whois(*args, **kwargs):
+            whois_called.set()
+            release_whois.wait(5)
+            return subprocess.CompletedProcess(args, 0, stdout=RIS_DUMP.replace("1105", "1106").encode('utf-8'))
+
+        with patch('subprocess.run', side_effect=slow_whois):
+            as_look_up = ASLookUp(snapshot_path=self.snapshot_path, refresh_in_background=True)
+            self.assertTrue(whois_called.wait(5))
+            old_state = as_look_up.state
+            self.assertEqual(as_look_up.version, 1)
+            self.assertEqual(as_look_up.get_as("145.100.4.9"), "1105")
+
+            release_whois.set()
+            deadline = time.time() + 5
+            while as_look_up.version == 1 and time.time() < deadline:
+                time.sleep(0.01)
+            as_look_up.stop_refresher()
+        self.assertEqual(as_look_up.version, 2)
+        self.assertEqual(as_look_up.get_as("145.100.4.9"), "1106")
+        self.assertEqual(old_state.table.lookup("145.100.4.9"), 1105)
+        self.assertFalse(as_look_up.is_stale())
+
+    def test_shared_lookup(self):
+        """
+        Every caller (and thread) in the process gets the same lookup service.
+        """
+        PrefixTable.from_rows(parse_ris_rows(RIS_DUMP.split("\n"))).save(self.snapshot_path)
+        results = []
+        with patch.object(as_tools, '_as_look_up', None), patch.object(as_tools, 'SNAPSHOT_PATH', self.snapshot_path):
+            threads = [threading.Thread(target=lambda: results.append(get_as_lookup())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        results[0].stop_refresher()
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(results[0].get_as("193.0.0.1"), "3333")
+
+
+class TestLevelShift(TestCase):
+    """Test module for the level shift detection of all probes at once."""
+
+    @staticmethod
+    def measurements(seed: int, probes: int = 30) -> pd.DataFrame:
+        """
+        Shuffled measurements of probes with irregular intervals, level shifts, missing and infinite round trip
+        times, duplicate timestamps and probes with too few measurements.
+        """
+        generator = np.random.default_rng(seed)
+        rows = []
+        for probe_id in range(probes):
+            amount = generator.integers(1, 50)
+            created = pd.Timestamp("2022-05-01") + pd.to_timedelta(
+                np.sort(generator.choice(1000, amount, replace=False)) * 5, unit="min")
+            entry_rtt = generator.uniform(1, 50) + generator.normal(0, 1, amount)
+            entry_rtt[generator.integers(0, amount):] += generator.uniform(0, 200)
+            entry_rtt[generator.random(amount) < 0.05] = np.nan
+            entry_rtt[generator.random(amount) < 0.05] = np.inf
+            for time, rtt in zip(created, entry_rtt):
+                rows.append({"probe_id": probe_id, "created": time, "entry_rtt": rtt, "entry_as": probe_id % 3})
+                if generator.random() < 0.05:
+                    rows.append({"probe_id": probe_id, "created": time, "entry_rtt": rtt + 1, "entry_as": 0})
+        return pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    def test_same_as_adtk(self):
+        """
+        Check that the vectorized detection gives the same rows, order and results as ADTK.
+        """
+        detections = 0
+        for seed in range(10):
+            df = self.measurements(seed)
+            expected = adtk_level_shifts(df)
+            df_outlier = detect_level_shifts(df)
+            self.assertTrue(df_outlier.index.equals(expected.index))
+            self.assertEqual(df_outlier['probe_id'].tolist(), expected['probe_id'].tolist())
+            np.testing.assert_array_equal(df_outlier['level_shift'].to_numpy(),
+                                          expected['level_shift'].astype(float).to_numpy())
+            detections += int(np.nansum(df_outlier['level_shift']))
+        self.assertGreater(detections, 0)
+
+    def test_empty(self):
+        self.assertTrue(detect_level_shifts(pd.DataFrame()).empty)
+
+
+class TestEntryScoring(TestCase):
+    """Test module for the scoring of level shifts per entry AS."""
+
+    @staticmethod
+    def loop_scores(df_outlier: pd.DataFrame) -> list:
+        """
+        The per AS and per probe loop of the entry connection filter before it was vectorized.
+        """
+        alerts = []
+        for as_num in df_outlier['entry_as'].unique():
+            single_as_df = df_outlier[df_outlier['entry_as'] == as_num]
+            probes_in_as = len(single_as_df['probe_id'].unique())
+            if probes_in_as > 4:
+                as_anomalies = single_as_df.groupby(pd.Grouper(
+                    freq="20T", closed='right', convention='end'))["level_shift"].agg("sum")
+                if len(as_anomalies) < 3:
+                    continue
+                score = round((as_anomalies[-3] / probes_in_as) * 100, 2)
+                if score > 10:
+                    changes_in_rtt = []
+                    for probe_id in single_as_df['probe_id'].unique():
+                        single_probe = single_as_df[single_as_df["probe_id"] == probe_id]
+                        if len(single_probe) > 4:
+                            changes_in_rtt.append(single_probe['entry_rtt'][-3] -
+                                                  single_probe['entry_rtt'][:-4].median())
+                    alerts.append({
+                        'time': as_anomalies.index[-3],
+                        'asn': as_num,
+                        'ip_address': single_as_df[single_as_df['level_shift'] == True]['entry_ip'].unique().tolist(),
+                        'affected_probes': as_anomalies[-3],
+                        'anomaly_score': score,
+                        'mean_increase': sum(changes_in_rtt) / len(changes_in_rtt) if changes_in_rtt else None,
+                    })
+        return alerts
+
+    @staticmethod
+    def measurements(seed: int, probes: int = 60) -> pd.DataFrame:
+        """
+        Probes measuring every 5 minutes with gaps, most of them in one of four entry ASes (some unknown), and a
+        level shift near the end for some of them.
+        """
+        generator = np.random.default_rng(seed)
+        rows = []
+        for probe_id in range(probes):
+            steps = np.flatnonzero(generator.random(100) < generator.uniform(0.05, 1))
+            created = pd.Timestamp("2022-05-01 00:03") + pd.to_timedelta(steps * 5 + generator.integers(0, 3),
+                                                                         unit="min")
+            entry_rtt = generator.uniform(1, 50) + generator.normal(0, 1, len(steps))
+            if generator.random() < 0.6:
+                entry_rtt[steps >= 100 - generator.integers(6, 14)] += 100
+            entry_rtt[generator.random(len(steps)) < 0.03] = np.nan
+            for time, rtt in zip(created, entry_rtt):
+                rows.append({"probe_id": probe_id, "created": time, "entry_rtt": rtt,
+                             "entry_ip": f"10.0.{probe_id % 4}.{generator.integers(0, 3)}",
+                             "entry_as": [None, 1103, 3333, 1200, 1300][probe_id % 5]})
+        return pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    def test_same_as_loop(self):
+        """
+        Check that the grouped aggregations give the same alerts as the loops.
+        """
+        alerts = 0
+        for seed in range(10):
+            df_outlier = detect_level_shifts(self.measurements(seed))
+            expected = self.loop_scores(df_outlier)
+            scores = score_entry_ases(df_outlier)
+            self.assertEqual([alert.keys() for alert in scores], [alert.keys() for alert in expected])
+            for alert, expected_alert in zip(scores, expected):
+                mean_increase, expected_mean_increase = alert.pop('mean_increase'), expected_alert.pop('mean_increase')
+                self.assertEqual(alert, expected_alert)
+                if expected_mean_increase is None or np.isnan(expected_mean_increase):
+                    self.assertEqual(mean_increase is None, expected_mean_increase is None)
+                else:
+                    self.assertEqual(mean_increase, expected_mean_increase)
+            alerts += len(expected)
+        self.assertGreater(alerts, 0)
+
+    def test_filter(self):
+        """
+        The entry connection filter turns the alerts into anomaly objects.
+        """
+        detection_method = entry_connection.DetectionMethod.__new__(entry_connection.DetectionMethod)
+        df_outlier = detect_level_shifts(self.measurements(0))
+        anomalies = detection_method.filter(df_outlier)
+        self.assertEqual([anomaly.asn for anomaly in anomalies],
+                         [alert['asn'] for alert in score_entry_ases(df_outlier)])
+        self.assertEqual(detection_method.filter(pd.DataFrame()), [])
+
+
+class TestParallelAnalysis(TestCase):
+    """Test module for the level shift detection in worker processes."""
+
+    def setUp(self) -> None:
+        self.df = TestEntryScoring.measurements(0, probes=100)
+        generator = np.random.default_rng(0)
+        self.df = self.df.iloc[generator.permutation(len(self.df))]  # Probes in no particular order.
+
+    def test_same_as_serial(self):
+        """
+        Check that the worker processes give the same level shifts, in the same order, as a single process, also
+        inside a level shift window.
+        """
+        expected = detect_level_shifts(self.df)
+        df_outlier = detect_level_shifts_parallel(self.df, workers=2, serial_max_rows=0)
+        self.assertGreater(expected['level_shift'].sum(), 0)
+        pd.testing.assert_frame_equal(df_outlier, expected)
+
+        window = LevelShiftWindow(detect=functools.partial(detect_level_shifts_parallel, workers=2,
+                                                           serial_max_rows=0))
+        pd.testing.assert_frame_equal(window.add(self.df), expected)
+
+    def test_partitions(self):
+        """
+        Probes are never split over partitions, and every partition holds the probes after those of the previous one.
+        """
+        probe_codes, _ = pd.factorize(self.df['probe_id'])
+        partitions = partition_probes(probe_codes, 8)
+        self.assertEqual(len(partitions), 8)
+        self.assertEqual(sorted(np.concatenate(partitions).tolist()), list(range(len(self.df))))
+        last = -1
+        for rows in partitions:
+            self.assertTrue((np.diff(rows) > 0).all())
+            self.assertGreater(probe_codes[rows].min(), last)
+            last = probe_codes[rows].max()
+        self.assertEqual(len(partition_probes(probe_codes, 1000)), 100)
+
+    def test_serial_fallback(self):
+        """
+        Small inputs do not start worker processes.
+        """
+        with patch.object(parallel_analysis, 'ProcessPoolExecutor') as executor:
+            df_outlier = detect_level_shifts_parallel(self.df, workers=4)
+            self.assertTrue(detect_level_shifts_parallel(pd.DataFrame(), workers=4, serial_max_rows=0).empty)
+        executor.assert_not_called()
+        pd.testing.assert_frame_equal(df_outlier, detect_level_shifts(self.df))
+
+
+class TestAnalysisScheduler(TestCase):
+    """Test module for the analysis of streamed results in micro-batches."""
+
+    def test_cadence(self):
+        """
+        The results of a 20 minute bucket are analyzed with the first result in a new bucket, all waiting results
+        when there are too many. A run gets the results of its measurement that no previous run got.
+        """
+        batches = []
+        scheduler = AnalysisScheduler(lambda key, results: batches.append((key, results)), max_pending=10,
+                                      run_in_background=False)
+        start = datetime(2022, 5, 1, 0, 0)
+        for minute in range(0, 60, 5):  # Buckets (0, 20], (20, 40] and (40, 60].
+            scheduler.add(1, minute, start + pd.Timedelta(minutes=minute))
+        self.assertEqual(batches, [(1, [0]), (1, [5, 10, 15, 20]), (1, [25, 30, 35, 40])])
+
+        batches.clear()
+        for result in range(12):
+            scheduler.add(2, result, start)
+        self.assertEqual(batches, [(2, list(range(10)))])
+        self.assertTrue(scheduler.flush(2))
+        self.assertFalse(scheduler.flush(2))
+        self.assertEqual(batches[-1], (2, [10, 11]))
+        self.assertTrue(scheduler.flush(1))
+        self.assertEqual(batches[-1], (1, [45, 50, 55]))
+        self.assertEqual(scheduler.runs(1), 4)
+
+    def test_no_overlap(self):
+        """
+        Runs of the same measurement never overlap, results arriving during a run go to the next run.
+        """
+        running, most_running = [0], [0]
+        batches = []
+        release = threading.Event()
+
+        def run(key, results):
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+            release.wait(5)
+            batches.append(results)
+            running[0] -= 1
+
+        scheduler = AnalysisScheduler(run, max_pending=0)
+        start = datetime(2022, 5, 1, 0, 0)
+        scheduler.add(1, 'a', start)
+        self.assertTrue(scheduler.add(1, 'b', start + pd.Timedelta(minutes=30)))
+        self.assertFalse(scheduler.add(1, 'c', start + pd.Timedelta(minutes=50)))
+        self.assertFalse(scheduler.add(1, 'd', start + pd.Timedelta(minutes=70)))
+        release.set()
+        scheduler.wait(5)
+        self.assertEqual(most_running[0], 1)
+        self.assertEqual(batches, [['a'], ['b', 'c']])
+
+    def test_repeated_runs(self):
+        """
+        Every run scores the whole window, the anomalies a previous run found are not stored again. The IP addresses
+        of an anomaly are stored as text, an unknown mean increase as 0.
+        """
+        detection_method = DetecionMethodModel.objects.create(type="Entry Delay Detector", description="")
+        strategy = MagicMock()
+        strategy.detection_type.return_value = "Entry Delay Detector"
+        bucket = pd.Timestamp(2022, 5, 1, 0, 20)
+
+        def anomaly(time, asn):
+            return AnomalyObject(time=time, ip_address=["145.100.4.1", "145.100.4.2"], asn=asn,
+                                 measurement_type='traceroute', detection_method=detection_method,
+                                 mean_increase=None, anomaly_score=50.0)
+
+        strategy.detect_changes.side_effect = [[anomaly(bucket, 1105)], [anomaly(bucket, 1105), anomaly(bucket, 1104)],
+                                               [anomaly(bucket + pd.Timedelta(minutes=20), 1105)]]
+        monitor = Monitor(MagicMock(), strategy)
+        sink = MagicMock()
+        with patch('anomaly_detection.monitors.anomaly_sink', sink), patch('anomaly_detection.monitors.db'):
+            for _ in range(3):
+                monitor.analyze_results(1, [])
+        stored = [call.kwargs for call in sink.add.call_args_list]
+        self.assertEqual([(fields['asn'], fields['time']) for fields in stored],
+                         [(1105, bucket), (1104, bucket), (1105, bucket + pd.Timedelta(minutes=20))])
+        self.assertEqual(stored[0]['ip_address'], "145.100.4.1, 145.100.4.2")
+        self.assertEqual(stored[0]['mean_increase'], 0.0)
+        self.assertEqual(sink.flush.call_count, 3)
+
+    def test_level_shift_window(self):
+        """
+        Adding measurements in batches gives the level shifts of all measurements in the window.
+        """
+        df = TestEntryScoring.measurements(0).sort_values('created', kind='stable')
+        for span in (pd.Timedelta(days=1), pd.Timedelta(hours=4)):
+            window = LevelShiftWindow(span=span)
+            for _, batch in df.groupby(pd.Grouper(key='created', freq='20T', closed='right')):
+                df_outlier = window.add(batch)
+            expected = detect_level_shifts(df[df['created'] >= df['created'].max() - span])
+            self.assertEqual(len(window), (df['created'] >= df['created'].max() - span).sum())
+            df_outlier = df_outlier.reset_index().sort_values(['probe_id', 'created'])
+            expected = expected.reset_index().sort_values(['probe_id', 'created'])
+            np.testing.assert_array_equal(df_outlier['probe_id'], expected['probe_id'])
+            np.testing.assert_array_equal(df_outlier['level_shift'], expected['level_shift'])
+            self.assertEqual(len(score_entry_ases(df_outlier.set_index('created'))),
+                             len(score_entry_ases(expected.set_index('created'))))
+
+    def test_records_to_frame(self):
+        """
+        Preprocessed measurements (ProbeMeasurement records) give the same frame, and so the same level shifts, as
+        the rows they were made of.
+        """
+        df = TestEntryScoring.measurements(1).sort_values('created', kind='stable')
+        records = [ProbeMeasurement(*row) for row in
+                   df[['probe_id', 'created', 'entry_rtt', 'entry_ip', 'entry_as']].itertuples(index=False)]
+        frame = ProbeMeasurement.to_frame(records)
+        pd.testing.assert_frame_equal(frame, df[list(ProbeMeasurement.__slots__)].reset_index(drop=True))
+        self.assertFalse(hasattr(records[0], '__dict__'))
+        self.assertEqual(len(LevelShiftWindow().add(frame)), len(detect_level_shifts(df)))
@@ -1,8 +1,11 @@
 from pydoc import describe
+import atexit
 import threading
 from typing import Type
 
+from anomaly_detection_reworked.anomaly_suppression import anomaly_suppression
 from anomaly_detection_reworked.detection_method import DetectionMethod
+from anomaly_detection_reworked.detector_state import detector_states
 from anomaly_detection_reworked.measurement_result_stream import MeasurementResultStream
 from anomaly_detection_reworked.measurement_type import MeasurementType
 
@@ -27,12 +30,17 @@ class AnomalyDetection:
         self.methods.pop(method.__class__.__name__)
 
     def start(self):
-        """ Starts the anomaly detection and connects to the Streaming API. """
-        thread = threading.Thread(target=MeasurementResultStream,
-                                  args=(self.methods.values(),), daemon=True)
-        thread.start()
+        """ Starts the anomaly detection and connects to the Streaming API.
+            The detection methods restore their state first, then the stream backfills the results they missed.
+            The anomaly suppression index is warmed with the recent anomalies before anything is detected. """
+        print(f"Loaded {anomaly_suppression.warm()} recent anomalies into the suppression index.")
         for detection_method in self.methods.values():
             detection_method.on_startup_event()
+        methods = list(self.methods.values())
+        atexit.register(detector_states.save_all, methods)  # Waits for the batch in progress, see detector_state.py.
+        thread = threading.Thread(target=MeasurementResultStream,
+                                  args=(methods, detector_states.gap_start()), daemon=True)
+        thread.start()
 
     # def add_detection_methods_to_db(self) -> None:
     #     for method in self.methods:
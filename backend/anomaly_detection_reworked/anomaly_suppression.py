@@ -0,0 +1,121 @@
+"""
+Shared in-memory index of recent anomalies, so detection methods do not query the database to avoid duplicates.
+
+An anomaly is identified by (detection method, target, description), where the target is what the anomaly is about
+(an IP address, an AS). After an anomaly is claimed, the same anomaly is suppressed for the TTL of its detection
+method and description: DEFAULT_TTL unless set_ttl() gave another window, None meaning forever. At startup the index is
+warmed with the anomalies in the database that are still within their window, after that claim() and is_suppressed()
+are dictionary lookups. Detection methods whose targets are not stored with the anomaly (a country, a measurement)
+keep their entries in their state snapshot instead, see entries() and restore().
+"""
+import datetime
+import threading
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from backend.settings import ANOMALY_SUPPRESSION_TTL
+
+Key = Tuple[str, Hashable, str]  # (Detection method, target, description).
+FOREVER = float('inf')
+
+
+def timestamp(moment) -> float:
+    """ Seconds since the epoch of a datetime (or of a timestamp, returned as it is). """
+    return moment.timestamp() if isinstance(moment, datetime.datetime) else float(moment)
+
+
+class AnomalySuppression:
+
+    def __init__(self, default_ttl: Optional[float] = ANOMALY_SUPPRESSION_TTL):
+        """
+        Parameters:
+                default_ttl (float): Seconds an anomaly is suppressed unless set_ttl() says otherwise, None is forever.
+        """
+        self.default_ttl = default_ttl
+        self.ttls: Dict[Tuple[str, str], Optional[float]] = {}
+        self.expiry: Dict[Key, float] = {}  # Key -> time (seconds since the epoch) its suppression ends.
+        self.lock = threading.Lock()
+        self.next_prune = 1024
+
+    def __len__(self) -> int:
+        return len(self.expiry)
+
+    def set_ttl(self, detection_method: str, description: str, ttl: Optional[float]) -> None:
+        """ Suppresses the anomalies of a detection method with this description for ttl seconds (None: forever). """
+        self.ttls[(detection_method, description)] = ttl
+
+    def ttl(self, detection_method: str, description: str) -> Optional[float]:
+        return self.ttls.get((detection_method, description), self.default_ttl)
+
+    def is_suppressed(self, detection_method: str, target: Hashable, description: str,
+                      now: Optional[float] = None) -> bool:
+        """ Returns True when the same anomaly was claimed (or stored) within its window. """
+        expiry = self.expiry.get((detection_method, target, description))
+        return expiry is not None and (time.time() if now is None else now) < expiry
+
+    def claim(self, detection_method: str, target: Hashable, description: str, moment=None) -> bool:
+        """
+        Returns True, and suppresses the anomaly from now on, when it is not suppressed yet: the caller stores it.
+        Returns False for a duplicate. moment is the time of the anomaly (datetime or seconds since the epoch),
+        now by default.
+        """
+        moment = time.time() if moment is None else timestamp(moment)
+        with self.lock:
+            if self.is_suppressed(detection_method, target, description, now=moment):
+                return False
+            self.record(detection_method, target, description, moment)
+            if len(self.expiry) >= self.next_prune:
+                self.prune(moment)
+            return True
+
+    def record(self, detection_method: str, target: Hashable, description: str, moment) -> None:
+        """ Suppresses an anomaly that happened at moment (datetime or seconds since the epoch). """
+        ttl = self.ttl(detection_method, description)
+        key = (detection_method, target, description)
+        expiry = FOREVER if ttl is None else timestamp(moment) + ttl
+        self.expiry[key] = max(expiry, self.expiry.get(key, expiry))
+
+    def entries(self, detection_method: str) -> Dict[Tuple[Hashable, str], float]:
+        """ The suppressed anomalies of a detection method: (target, description) -> end of the suppression. """
+        with self.lock:
+            return {(target, description): expiry for (method, target, description), expiry in self.expiry.items()
+                    if method == detection_method}
+
+    def restore(self, detection_method: str, entries: Dict[Tuple[Hashable, str], float]) -> None:
+        """ Suppresses the anomalies returned by entries(), for example after a restart. """
+        with self.lock:
+            for (target, description), expiry in entries.items():
+                key = (detection_method, target, description)
+                self.expiry[key] = max(expiry, self.expiry.get(key, expiry))
+
+    def prune(self, now: Optional[float] = None) -> None:
+        """ Forgets the anomalies whose window has passed. """
+        now = time.time() if now is None else now
+        self.expiry = {key: expiry for key, expiry in self.expiry.items() if expiry > now}
+        self.next_prune = max(1024, 2 * len(self.expiry))
+
+    def warm(self) -> int:
+        """ Records the anomalies in the database that are still within their window, in one query. Returns the
+            amount of anomalies read. """
+        from django.db.models import Q
+        from database.models import Anomaly
+        windows = [ttl for ttl in [self.default_ttl, *self.ttls.values()] if ttl is not None]
+        query = Q(time__gte=datetime.datetime.fromtimestamp(time.time() - max(windows, default=0),
+                                                            tz=datetime.timezone.utc))
+        for (detection_method, description), ttl in self.ttls.items():
+            if ttl is None:
+                query |= Q(detection_method__type=detection_method, description=description)
+        if self.default_ttl is None:
+            query = Q()
+        rows = Anomaly.objects.filter(query).values_list('detection_method__type', 'ip_address', 'description',
+                                                         'time')
+        count = 0
+        with self.lock:
+            for detection_method, target, description, moment in rows.iterator():
+                self.record(detection_method, target, description, moment)
+                count += 1
+            self.prune()
+        return count
+
+
+anomaly_suppression = AnomalySuppression()
@@ -0,0 +1,132 @@
+"""
+asyncio client for the RIPE Atlas Streaming API.
+
+The Streaming API is a websocket that sends JSON arrays of the form ["<message type>", <payload>]. After connecting we
+send one ["atlas_subscribe", {...}] message per measurement (or probe), all subscriptions share one connection.
+Data messages (results, probe status changes, ...) are not decoded here: they are collected into batches of raw
+strings and handed to an async consumer, so the consumer decides what (and whether) to decode. An exception raised
+by the consumer is logged and the batch is dropped, the connection stays up.
+"""
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+import websockets
+
+from anomaly_detection_reworked.event_logger import EventLogger
+
+STREAM_URL = "wss://atlas-stream.ripe.net/stream/"
+CLIENT_NAME = "ripe-alerts"
+DATA_MESSAGES = {"atlas_result", "atlas_metadata", "atlas_probestatus"}
+MAX_RECONNECT_DELAY = 60  # Seconds.
+
+log = logging.getLogger(__name__)
+
+
+def message_type(raw: str) -> str:
+    """ Returns the message type of a raw Streaming API message without decoding the payload.
+        For example 'atlas_result' for '["atlas_result", {"msm_id": 1001, ...}]'. """
+    start = raw.find('"') + 1
+    return raw[start:raw.find('"', start)]
+
+
+class AsyncAtlasStream:
+
+    def __init__(self, consumer: Callable[[List[str]], Awaitable[None]], url: str = STREAM_URL,
+                 batch_size: int = 500, batch_interval: float = 0.5, logger: Optional[EventLogger] = None):
+        """
+        Parameters:
+                consumer (coroutine function): Called with a list of raw data messages (str), one batch at a time.
+                url (str): URL of the Streaming API.
+                batch_size (int): A batch is handed to the consumer once it contains this many messages...
+                batch_interval (float): ...or once its oldest message is this many seconds old.
+                logger (EventLogger): Receives connection events.
+        """
+        self.consumer = consumer
+        self.url = url + "?client=" + CLIENT_NAME
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.logger = logger or EventLogger()
+        self.subscriptions: List[dict] = []
+        self.websocket = None
+        self.connected = asyncio.Event()  # Set while connected, once the subscriptions are sent.
+        self.closed = False
+
+    def subscribe(self, stream_type: str = "result", **parameters) -> None:
+        """ Subscribes to a stream, for example subscribe("result", msm=1001) or subscribe("probestatus", prb=6001).
+            Subscriptions are (re)sent every time the connection is (re)established. """
+        subscription = {"streamType": stream_type, **parameters}
+        self.subscriptions.append(subscription)
+        if self.websocket is not None:
+            asyncio.ensure_future(self.send_subscription(self.websocket, subscription))
+
+    async def run(self) -> None:
+        """ Connects to the Streaming API and hands batches to the consumer until close() is called.
+            The connection is re-established (with back-off) whenever it drops. """
+        reconnect_delay = 1
+        while not self.closed:
+            try:
+                async with websockets.connect(self.url, max_size=None) as websocket:
+                    self.websocket = websocket
+                    self.logger.on_connect()
+                    reconnect_delay = 1
+                    for subscription in self.subscriptions:
+                        await self.send_subscription(websocket, subscription)
+                    self.connected.set()
+                    await self.read(websocket)
+            except (websockets.ConnectionClosed, OSError, asyncio.TimeoutError) as error:
+                self.logger.on_disconnect(error)
+            finally:
+                self.websocket = None
+                self.connected.clear()
+            if not self.closed:
+                await asyncio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, MAX_RECONNECT_DELAY)
+                self.logger.on_reconnect()
+
+    async def read(self, websocket) -> None:
+        loop = asyncio.get_running_loop()
+        batch: List[str] = []
+        deadline = 0.0
+        try:
+            while not self.closed:
+                timeout = max(0.0, deadline - loop.time()) if batch else None
+                try:
+                    raw = await asyncio.wait_for(websocket.recv(), timeout)
+                except asyncio.TimeoutError:
+                    batch = await self.flush(batch)
+                    continue
+                if isinstance(raw, bytes):
+                    raw = raw.decode('utf-8')
+                kind = message_type(raw)
+                if kind in DATA_MESSAGES:
+                    if not batch:
+                        deadline = loop.time() + self.batch_interval
+                    batch.append(raw)
+                    if len(batch) >= self.batch_size:
+                        batch = await self.flush(batch)
+                elif kind == "atlas_error":
+                    self.logger.on_atlas_error(raw)
+                elif kind == "atlas_unsubscribed":
+                    self.logger.on_atlas_unsubscribe(raw)
+        finally:
+            await self.flush(batch)  # Do not lose the messages received right before a disconnect.
+
+    async def flush(self, batch: List[str]) -> List[str]:
+        if batch:
+            try:
+                await self.consumer(batch)
+            except Exception:
+                # A bug in a detection method must not end the stream (or be mistaken for a lost connection).
+                log.exception("The consumer failed on a batch of %d Streaming API messages.", len(batch))
+        return []
+
+    async def close(self) -> None:
+        self.closed = True
+        if self.websocket is not None:
+            await self.websocket.close()
+
+    @staticmethod
+    async def send_subscription(websocket, subscription: dict) -> None:
+        await websocket.send(json.dumps(["atlas_subscribe", subscription]))
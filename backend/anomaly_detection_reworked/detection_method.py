@@ -2,6 +2,7 @@ import enum
 
 
 from abc import ABC, abstractmethod
+from typing import Optional
 
 from anomaly_detection_reworked.measurement_type import MeasurementType
 
@@ -9,6 +10,13 @@ from anomaly_detection_reworked.measurement_type import MeasurementType
 class DetectionMethod(ABC):
     """ Interface for creating an algorithm to find anomalies in the data from RIPE ATLAS Streaming API. """
 
+    # Attributes holding the in-memory state (baselines, histories) that is kept across restarts,
+    # see anomaly_detection_reworked/detector_state.py.
+    state_attributes: tuple = ()
+    # Shared suppression index (anomaly_suppression.py) the detection method claims its anomalies in. With state
+    # attributes, its entries of the detection method are part of the state too.
+    suppression = None
+
     @abstractmethod
     def describe(self) -> dict:
         """
@@ -25,10 +33,55 @@ class DetectionMethod(ABC):
         """
         raise NotImplementedError()
 
+    def accepts(self, envelope) -> bool:
+        """
+        Method that will be called before on_result_response() with the routing fields of the result
+        (envelope: ResultEnvelope with msm_id, prb_id, timestamp and type). Return False to skip the result,
+        results that no detection method accepts are never decoded.
+        """
+        return True
+
+    def on_stream_created(self, stream):
+        """
+        Method that will be called once the stream (MeasurementResultStream) is set up, before it connects.
+        Detection methods that want more than the results of their measurements can keep it to subscribe later,
+        for example with stream.subscribe_probes().
+        """
+
+    def on_probe_status_response(self, data: dict):
+        """
+        Method that will be called for every connection or disconnection event of the probes the detection method
+        subscribed to (see MeasurementResultStream.subscribe_probes()).
+        Data: dictionary with prb_id, event ("connect" or "disconnect") and timestamp.
+        """
+
+    def get_state(self) -> Optional[dict]:
+        """
+        Method that returns the in-memory state of the detection method so it can be written to a snapshot,
+        None if the detection method has no state.
+        """
+        if not self.state_attributes:
+            return None
+        state = {name: getattr(self, name) for name in self.state_attributes}
+        if self.suppression is not None:
+            state['suppressed'] = self.suppression.entries(self.detection_method_name)
+        return state
+
+    def set_state(self, state: dict):
+        """
+        Method that restores the state returned by get_state(). Attributes missing from the state are left as they are.
+        """
+        for name in self.state_attributes:
+            if name in state:
+                setattr(self, name, state[name])
+        if self.suppression is not None and 'suppressed' in state:
+            self.suppression.restore(self.detection_method_name, state['suppressed'])
+
     @abstractmethod
     def on_startup_event(self):
         """
-        Method that will be called once the detection method has been loaded.
+        Method that will be called once the detection method has been loaded, before the first result arrives.
+        Detection methods with state restore it here (detector_states.restore(self)).
         """
         raise NotImplementedError()
 
@@ -1,29 +1,52 @@
 import datetime
 import enum
 import threading
-from typing import List
+import time
+from typing import Dict, List, Optional, Set, Tuple
 from django.utils import timezone
 import dateutil.parser
-import requests
 
+from anomaly_detection_reworked.anomaly_sink import AnomalySink, anomaly_sink
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression, anomaly_suppression
 from anomaly_detection_reworked.detection_method import DetectionMethod
 from anomaly_detection_reworked.measurement_type import MeasurementType
+from backend.settings import ANCHOR_POLL_INTERVAL, ANCHOR_RECONCILE_INTERVAL, ANCHOR_STATUS_EVENTS
+from ripe_interface.paginator import paginate
+from ripe_interface.ripe_client import ripe_client
 
 
 class AnchorDown(DetectionMethod):
     """
     Anchor Down Detection Method (algorithm) used to find anomalies.
-    It checks every 15 seconds if the Anchor/Probe went offline .
+    It checks every 30 seconds if the Anchor/Probe went offline. The anchors are compared with the previous check by
+    probe ID, only anchors whose status changed to one of STATUS_MESSAGES are alerted, unless the shared suppression
+    index (anomaly_suppression.py) has seen the same anomaly: offline anchors for 24 hours, the others forever.
+    With status_events the anchors are also subscribed to on the Streaming API: their connection and disconnection
+    events are applied within seconds, and the probes API is only checked every ANCHOR_RECONCILE_INTERVAL seconds to
+    catch up on events missed while the stream was disconnected.
     """
 
-    def __init__(self):
+    def __init__(self, status_events: bool = ANCHOR_STATUS_EVENTS, suppression: Optional[AnomalySuppression] = None,
+                 sink: Optional[AnomalySink] = None):
         self.detection_method_name = "Anchor Down"
         self.detection_method_id = None
-        self.probes = None
+        self.probes: Optional[Dict[int, MetaProbe]] = None  # Probe ID -> anchor, as of the previous check.
         self.measurement_ids: List[int] = []
         self.autonomous_system_number: int = 0
         self.analyzer_started: bool = False
-        self.interval = 30
+        self.interval = ANCHOR_POLL_INTERVAL
+        self.reconcile_interval = ANCHOR_RECONCILE_INTERVAL
+        self.status_events = status_events
+        self.stream = None  # MeasurementResultStream, set when status_events is used.
+        self.lock = threading.Lock()  # Checks run in the analyzer thread, events in the stream thread.
+        self.cycles: int = 0
+        self.cycle_seconds: Optional[float] = None  # Duration of the last check (requests and queries).
+        self.events: int = 0
+        self.suppression = suppression if suppression is not None else anomaly_suppression
+        self.sink = sink if sink is not None else anomaly_sink
+        self.suppression.set_ttl(self.detection_method_name, OFFLINE_MESSAGE, OFFLINE_SUPPRESSION)
+        for message in PERMANENT_MESSAGES:
+            self.suppression.set_ttl(self.detection_method_name, message, None)
 
     def on_result_response(self, data: dict):
         """ Method that will be called every time we receive a new result from the RIPE Streaming API.
@@ -34,38 +57,89 @@ class AnchorDown(DetectionMethod):
             self.autonomous_system_number = self.get_autonomous_system_number(measurement_id=measurement_id)
             self.start_analyzer()
 
+    def accepts(self, envelope) -> bool:
+        """ Only the first result is needed (to find the Autonomous System Number), skip the rest undecoded. """
+        return not self.analyzer_started and envelope.msm_id not in self.measurement_ids
+
+    def on_stream_created(self, stream):
+        """ Keep the stream to subscribe to the connection events of the anchors once they are known. """
+        if self.status_events:
+            self.stream = stream
+
+    @property
+    def check_interval(self) -> int:
+        """ Seconds between checks of the probes API, only a reconciliation when connection events are followed. """
+        return self.reconcile_interval if self.stream is not None else self.interval
+
     def analyzer(self, autonomous_system_number: int, event: threading.Event):
         """ The Analyzer Method analyzes all incoming data to conclude if there was an anomaly or not.
-            This Method is called every (self.interval) seconds. """
-        while not event.is_set():
-            event.wait(self.interval)
-            if self.probes is None:
-                self.probes = self.get_probes_metadata(self.autonomous_system_number)
+            This Method checks right away (to know the anchors) and then every (self.check_interval) seconds until
+            the event is set. A failed check is retried at the next interval. """
+        while True:
+            try:
+                self.check(self.get_probes_metadata(autonomous_system_number))
+            except Exception as exception:
+                print(f"Anchor Down check failed: {exception}")
+            if event.wait(self.check_interval):
                 return
-            else:
-                old_probes = self.probes
-                new_probes = self.get_probes_metadata(self.autonomous_system_number)
-                for (old_probe, new_probe) in zip(old_probes, new_probes):
-                    assert isinstance(old_probe, MetaProbe)
-                    assert isinstance(new_probe, MetaProbe)
-                    if new_probe.status.name == ConnectionStatus.DISCONNECTED:
-                        # If there isn't already an Anomaly containing the probe address past 24 hours. Don't show.
-                        if not self.has_anomaly(msg="Anchor is offline.", ip_addresses=new_probe.address_v4):
-                            self.create_anomaly(msg="Anchor is offline.", ip_addresses=new_probe.address_v4)
-                    elif new_probe.status.name == ConnectionStatus.NEVER_CONNECTED:
-                        # To prevent duplicates messages.
-                        if not self.has_anomaly(msg="Anchor never connected.", ip_addresses=new_probe.address_v4):
-                            self.create_anomaly(msg="Anchor never connected.", ip_addresses=new_probe.address_v4)
-                    elif new_probe.status.name == ConnectionStatus.ABANDONED:
-                        # To prevent duplicates messages.
-                        if not self.has_anomaly(msg="Anchor has been abandoned.", ip_addresses=new_probe.address_v4):
-                            self.create_anomaly(msg="Anchor has been abandoned.", ip_addresses=new_probe.address_v4)
-                self.probes = new_probes
+
+    def check(self, meta_probes: List['MetaProbe']) -> List[Tuple[str, str]]:
+        """ Compares the anchors with the previous check and creates an anomaly for every anchor that went offline,
+            never connected or was abandoned since, unless it already has one. Returns the (message, IP address)
+            pairs of the new anomalies. """
+        start = time.perf_counter()
+        probes = {probe.id: probe for probe in meta_probes}
+        with self.lock:
+            previous = self.probes or {}  # After a restart every anchor with a bad status is a transition.
+            transitions = []
+            for probe_id, probe in probes.items():
+                message = STATUS_MESSAGES.get(probe.status.name)
+                old_probe = previous.get(probe_id)
+                if message is not None and (old_probe is None or old_probe.status.name != probe.status.name):
+                    transitions.append((message, probe.address_v4 or probe.address_v6))
+            alerts = self.alert(transitions)
+            self.probes = probes
+        if self.stream is not None:
+            self.stream.subscribe_probes(self, probes)
+        self.cycles += 1
+        self.cycle_seconds = time.perf_counter() - start
+        return alerts
+
+    def on_probe_status_response(self, data: dict):
+        """ Method that will be called for every connection or disconnection event of our anchors. The status of the
+            anchor is updated right away, a disconnection is alerted like a check would. Events older than the
+            status from the probes API are ignored. """
+        status = EVENT_STATUS.get(data.get('event'))
+        with self.lock:
+            probe = self.probes.get(data.get('prb_id')) if self.probes else None
+            if status is None or probe is None:
+                return
+            since = datetime.datetime.fromtimestamp(data['timestamp'], tz=datetime.timezone.utc) \
+                if data.get('timestamp') is not None else None
+            if since is not None and probe.status.since is not None and since < probe.status.since:
+                return
+            self.events += 1
+            old_status, probe.status.name, probe.status.since = probe.status.name, status, since
+            message = STATUS_MESSAGES.get(status)
+            if message is not None and old_status != status:
+                self.alert([(message, probe.address_v4 or probe.address_v6)])
+
+    def alert(self, transitions: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """ Creates an anomaly for every (message, IP address) pair that is not suppressed, without queries for the
+            pairs that are. """
+        alerts = [(message, ip_address) for message, ip_address in dict.fromkeys(transitions)
+                  if self.suppression.claim(self.detection_method_name, ip_address, message)]
+        for message, ip_address in alerts:
+            self.create_anomaly(msg=message, ip_addresses=ip_address)
+        if alerts:
+            self.sink.flush()
+        return alerts
 
     def start_analyzer(self):
         """ To start the analyzer and have it called in an interval, we'll need a thread. In our case,
             running one instance is enough. """
         if not self.analyzer_started:
+            self.analyzer_started = True
             event = threading.Event()
             thread = threading.Thread(target=self.analyzer, args=(self.autonomous_system_number, event), daemon=True)
             thread.start()
@@ -92,53 +166,31 @@ class AnchorDown(DetectionMethod):
             "Description": "The detector checks if the anchors of the user have suddenly gone down."
         }
 
-    def has_anomaly(self, msg: str, ip_addresses: str) -> bool:
-        """ Every N seconds, we check if the Anchor went offline. To prevent duplicate messages, we first check if
-            there already exists an anomaly like it in the database. And return it to the user. """
-        from database.models import Anomaly
-        if msg == "Anchor has been abandoned." or msg == "Anchor never connected.":
-            return Anomaly.objects.filter(description=msg, ip_address=ip_addresses).exists()
-        elif msg == "Anchor is offline.":
-            past_24_hours = timezone.now() - datetime.timedelta(days=1)
-            return Anomaly.objects.filter(description=msg,
-                                          ip_address=ip_addresses, time__gte=past_24_hours).exists()
-
     def create_anomaly(self, msg: str, ip_addresses: str):
-        """ This method is used to create anomalies to save to the database. """
-        from database.models import Setting, AutonomousSystem, Anomaly, MeasurementType
-        from database.models import DetectionMethod as DetectionMethodDB
-        time = timezone.now()
-        prediction_value = False
-        setting = Setting.get_user_settings('admin')
-        method = DetectionMethodDB.objects.get(type=self.detection_method_name)
-        Anomaly.objects.create(time=time, ip_address=ip_addresses,
-                               autonomous_system=AutonomousSystem.objects.get(setting_id=setting.id),
-                               description=msg,
-                               measurement_type=MeasurementType.PING,
-                               detection_method=method,
-                               mean_increase=0,
-                               anomaly_score=4.0, prediction_value=prediction_value,
-                               asn=self.autonomous_system_number)
+        """ This method is used to create anomalies to save to the database, written with the next flush of the
+            anomaly sink. """
+        from database.models import MeasurementType
+        self.sink.add(self.detection_method_name, time=timezone.now(), ip_address=ip_addresses,
+                      description=msg,
+                      measurement_type=MeasurementType.PING,
+                      mean_increase=0,
+                      anomaly_score=4.0, prediction_value=False,
+                      asn=self.autonomous_system_number)
 
     @staticmethod
     def get_autonomous_system_number(measurement_id: int) -> int:
         """ Returns the Autonomous System Number (ASN) based of the Measurement ID
             by doing a GET Request to RIPE ATLAS. """
         uri = 'https://atlas.ripe.net/api/v2/measurements/' + str(measurement_id) + "/"
-        response = requests.get(uri).json()
+        response = ripe_client.get_json(uri)
         return int(response.get('target_asn'))
 
     @staticmethod
     def get_probes_metadata(target_asn: int):
-        """ Makes a GET request to RIPE ATLAS to get the latest info of our Anchor. """
+        """ Makes GET requests to RIPE ATLAS to get the latest info of our Anchors, following all pages. """
         uri = 'https://atlas.ripe.net/api/v2/probes/'
         params = {"asn_v4": target_asn, "is_anchor": True}
-        response = requests.get(uri, params=params).json()
-        results = response.get('results')
-        meta_probes: List[MetaProbe] = []
-        for x in results:
-            meta_anchor = MetaProbe(**x)
-            meta_probes.append(meta_anchor)
+        meta_probes: List[MetaProbe] = [MetaProbe(**x) for x in paginate(uri, params)]
         return meta_probes
 
 
@@ -162,25 +214,41 @@ class ConnectionStatus(enum.Enum):
 
 
 class Status:
+    __slots__ = ('id', 'name', 'since')
 
     def __init__(self, id, name, since):
         """ A parsed JSON object containing
             id: The connection status ID for this probe (integer [0-3]),
             name: The connection status as String [Never Connected, Connected, Disconnected, Abandoned],
-            since: The datetime of the last change in connection status."""
+            since: The datetime of the last change in connection status, None when it never connected."""
         self.id = id
         self.name = ConnectionStatus.convert(name)
-        self.since = dateutil.parser.isoparse(since)
+        self.since = dateutil.parser.isoparse(since) if since is not None else None
+
+
+OFFLINE_MESSAGE = "Anchor is offline."
+OFFLINE_SUPPRESSION = 24 * 60 * 60  # Seconds an offline anchor is not alerted again.
+PERMANENT_MESSAGES = ("Anchor never connected.", "Anchor has been abandoned.")
+EVENT_STATUS = {"connect": ConnectionStatus.CONNECTED, "disconnect": ConnectionStatus.DISCONNECTED}
+STATUS_MESSAGES = {
+    ConnectionStatus.DISCONNECTED: OFFLINE_MESSAGE,
+    ConnectionStatus.NEVER_CONNECTED: PERMANENT_MESSAGES[0],
+    ConnectionStatus.ABANDONED: PERMANENT_MESSAGES[1],
+}
 
 
 class MetaProbe:
+    __slots__ = ('address_v4', 'address_v6', 'asn_v4', 'asn_v6', 'country_code', 'description', 'first_connected',
+                 'geometry', 'id', 'is_anchor', 'is_public', 'last_connected', 'prefix_v4', 'prefix_v6', 'status',
+                 'status_since', 'tags', 'total_uptime', 'type')
 
     def __init__(self, address_v4, address_v6, asn_v4, asn_v6, country_code, description, first_connected, id, is_anchor
                  , is_public, last_connected, prefix_v6, prefix_v4, geometry, status, status_since, tags, total_uptime,
-                 type):
+                 type, **other_fields):
         """
         RIPE Atlas Probes Resource. Note: An Anchor is also a Probe. Probes however are not always Anchors.
         For more: https://beta-docs.atlas.ripe.net/apis/metadata-reference/#probes
+        Fields the API added later are ignored. Anchors that never connected have no connection times (None).
         """
         self.address_v4 = address_v4
         self.address_v6 = address_v6
@@ -193,11 +261,11 @@ class MetaProbe:
         self.id = id
         self.is_anchor = is_anchor
         self.is_public = is_public
-        self.last_connected = datetime.datetime.fromtimestamp(last_connected)
+        self.last_connected = datetime.datetime.fromtimestamp(last_connected) if last_connected is not None else None
         self.prefix_v4 = prefix_v4
         self.prefix_v6 = prefix_v6
         self.status = Status(**status)
-        self.status_since = datetime.datetime.fromtimestamp(status_since)
+        self.status_since = datetime.datetime.fromtimestamp(status_since) if status_since is not None else None
         self.tags = tags
         self.total_uptime = total_uptime
         self.type = type
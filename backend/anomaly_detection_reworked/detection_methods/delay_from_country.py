@@ -1,18 +1,119 @@
+import datetime
+from typing import Dict, Optional, Tuple
+
+from anomaly_detection_reworked.anomaly_sink import anomaly_sink
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression, anomaly_suppression
 from anomaly_detection_reworked.detection_method import DetectionMethod
+from anomaly_detection_reworked.detector_state import detector_states
 from anomaly_detection_reworked.measurement_type import MeasurementType
+from anomaly_detection_reworked.probe_countries import ProbeCountryIndex
+from anomaly_detection_reworked.quantile_sketch import BucketedSketch, ShiftRule
+
+BUCKET = 20 * 60  # Seconds per time bucket.
+STATISTICS = ('min', 'avg')  # Round trip times of a ping result that are followed.
+# The p50 or p90 of a bucket has to be more than 10 ms and 50% above the baseline, which mostly reflects the last 20
+# buckets (it loses 5% of its weight per bucket).
+SHIFT_RULE = ShiftRule(quantiles=(0.5, 0.9), decay=0.95, min_samples=20, min_baseline_samples=100, min_increase=10.0,
+                       relative_increase=0.5)
+SHIFTED = "Round trip time went up."  # Suppression description of a shift of a country and statistic.
+SUPPRESSION_TTL = 6 * 60 * 60  # Seconds a shifted country and statistic is not alerted again.
 
 
 class DelayFromCountry(DetectionMethod):
     """
-    This Detection Method (algorithm) has not been finished. However, all methods work as supposed to.
+    Delay from Country Detection Method (algorithm) used to find anomalies. The probe of every ping result is mapped
+    to its country with a cached index (ProbeCountryIndex), and the min and avg round trip times are added to a
+    sketch per country, statistic and time bucket. When a bucket is complete it is compared with a decaying baseline
+    of the earlier buckets (BucketedSketch). Per result this is a dictionary lookup and two sketch updates.
+    A shift is alerted once per country and statistic: the following shifted buckets are suppressed for
+    SUPPRESSION_TTL in the shared suppression index.
     """
+    state_attributes = ('delays',)
+
+    def __init__(self, bucket: int = BUCKET, probe_countries: Optional[ProbeCountryIndex] = None,
+                 suppression: Optional[AnomalySuppression] = None):
+        self.detection_method_name = "Delay from Country"
+        self.detection_method_id = None
+        self.bucket_seconds = bucket
+        self.probe_countries = probe_countries if probe_countries is not None else ProbeCountryIndex()
+        self.rule = SHIFT_RULE
+        self.delays: Dict[Tuple[str, str], BucketedSketch] = {}  # (country, statistic) -> sketches.
+        self.suppression = suppression if suppression is not None else anomaly_suppression
+        self.suppression.set_ttl(self.detection_method_name, SHIFTED, SUPPRESSION_TTL)
 
     def on_result_response(self, data: dict):
-        pass
+        """ Method that will be called every time we receive a new result from the RIPE Streaming API.
+            Adds the round trip times of the ping to the sketches of the country of the probe. """
+        country = self.probe_countries.get(data['prb_id'])
+        if country is None:
+            return
+        bucket = data['timestamp'] // self.bucket_seconds
+        for statistic in STATISTICS:
+            rtt = data.get(statistic)
+            if rtt is not None and rtt >= 0:  # Pings without replies have -1.
+                self.add(country, statistic, bucket, rtt)
+
+    def add(self, country: str, statistic: str, bucket: int, rtt: float) -> Optional[dict]:
+        """ Adds a round trip time. Returns the alert of the previous bucket when a new bucket starts and the
+            previous one moved away from the baseline (and the shift is not suppressed), otherwise None. """
+        delay = self.delays.get((country, statistic))
+        if delay is None:
+            delay = self.delays[(country, statistic)] = BucketedSketch(bucket)
+        previous_bucket = delay.bucket
+        shift = delay.add(bucket, rtt, self.rule)
+        if shift is None:
+            return None
+        moment = datetime.datetime.fromtimestamp((previous_bucket + 1) * self.bucket_seconds, tz=datetime.timezone.utc)
+        if not self.suppression.claim(self.detection_method_name, (country, statistic), SHIFTED, moment):
+            return None
+        q, baseline, current = shift
+        alert = {
+            'time': moment,
+            'country': country,
+            'statistic': statistic,
+            'quantile': q,
+            'baseline': baseline,
+            'current': current,
+            'mean_increase': current - baseline,
+            'anomaly_score': round((current - baseline) / baseline * 100, 2),
+        }
+        self.create_anomaly(alert)
+        return alert
+
+    def get_state(self) -> Optional[dict]:
+        """ The sketches, and the probe country index so results are not skipped while it is filled again. """
+        state = super().get_state()
+        state['probe_countries'] = dict(self.probe_countries.countries)
+        return state
+
+    def set_state(self, state: dict):
+        super().set_state(state)
+        self.probe_countries.update(state.get('probe_countries', {}))
 
     def on_startup_event(self):
-        from database.models import MeasurementCollection  # CRUD functions are fully supported!
-        measurement_collections_count = MeasurementCollection.objects.all().count()
+        """ Method that will be called once the detection method has been loaded. Create a Delay from Country
+            Detection Method in the database and warm the probe country index with the stored probes. """
+        from database.models import DetectionMethod as DetectionMethodDB
+        detection_method, _ = DetectionMethodDB.objects.get_or_create(type=self.detection_method_name,
+                                                                      defaults={"description":
+                                                                                self.describe["Description"]})
+        self.detection_method_id = detection_method.id
+        self.probe_countries.load_from_database()
+        detector_states.restore(self)
+
+    def create_anomaly(self, alert: dict):
+        """ This method is used to save an alert to the database, written with the next flush of the anomaly sink. """
+        from database.models import MeasurementType
+        description = "P" + str(round(alert['quantile'] * 100)) + " " + alert['statistic'] + " round trip time from " \
+            + alert['country'] + " went from " + str(round(alert['baseline'], 1)) + " ms to " + \
+            str(round(alert['current'], 1)) + " ms."
+        print(f"Anomaly at {alert['time']}: {description}")
+        anomaly_sink.add(self.detection_method_name, time=alert['time'], ip_address="",
+                         description=description,
+                         measurement_type=MeasurementType.PING,
+                         mean_increase=alert['mean_increase'],
+                         anomaly_score=alert['anomaly_score'], prediction_value=False,
+                         asn=None)
 
     @property
     def get_measurement_type(self) -> MeasurementType:
@@ -1,17 +1,150 @@
+import datetime
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from anomaly_detection.as_tools import ASLookUp, get_as_lookup
+from anomaly_detection_reworked.anomaly_sink import anomaly_sink
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression, anomaly_suppression
 from anomaly_detection_reworked.detection_method import DetectionMethod
+from anomaly_detection_reworked.detector_state import detector_states
 from anomaly_detection_reworked.measurement_type import MeasurementType
+from anomaly_detection_reworked.probe_rtt_history import ProbeRttHistory
+from anomaly_detection_reworked.traceroute import NO_AS, entry_hop, fastest_replies, resolve_asns
+
+AGREEMENT_WINDOW = 20 * 60  # Seconds, level shifts of probes this close together count as one event.
+MIN_PROBES = 4  # An entry AS needs more probes than this before it is scored.
+MIN_ANOMALY_SCORE = 10  # Percentage of the probes of an entry AS that have to agree.
+SERIES_TTL = 24 * 60 * 60  # Seconds, series without results this long are forgotten, with their history.
+SWEEP_INTERVAL = 60 * 60  # Seconds between looking for such series.
+SHIFTED = "Round trip time went up."  # Suppression description of an entry AS, suppressed for the agreement window.
+Series = Tuple[int, int]  # (Measurement ID, probe ID).
 
 
 class EntryPointDelay(DetectionMethod):
     """
-    This Detection Method (algorithm) has not been finished. However, all methods work as supposed to.
+    Entry Point Delay Detection Method (algorithm) used to find anomalies, the streaming version of the entry
+    connection detector. Every traceroute gives the hop where the path enters our AS (the AS of the destination) and
+    the round trip time just behind it. A bounded history per series (ProbeRttHistory) flags level shifts up of that
+    round trip time, and an entry AS is alerted when more than MIN_ANOMALY_SCORE percent of its series shifted within
+    AGREEMENT_WINDOW, once per AGREEMENT_WINDOW (claimed in the shared suppression index). Series without results in
+    the last AGREEMENT_WINDOW are not counted, series without results for SERIES_TTL are forgotten. A series is one
+    probe in one measurement: a probe measures several anchors, over IPv4 and IPv6, with a baseline each, so like the
+    legacy per-measurement analysis its round trip times are never mixed. Per message this only touches a few arrays
+    and dictionaries, the database is only used to store alerts.
     """
+    state_attributes = ('history', 'probe_entry_as', 'as_probes', 'shifts', 'next_sweep')
+
+    def __init__(self, window: int = 3, c: float = 10.0, agreement_window: int = AGREEMENT_WINDOW,
+                 as_look_up: Optional[ASLookUp] = None, suppression: Optional[AnomalySuppression] = None):
+        self.detection_method_name = "Entry Point Delay"
+        self.detection_method_id = None
+        self.as_look_up = as_look_up
+        self.agreement_window = agreement_window
+        self.history = ProbeRttHistory(window=window, c=c)
+        self.probe_entry_as: Dict[Series, int] = {}
+        self.as_probes: Dict[int, Dict[Series, int]] = defaultdict(dict)  # Entry AS -> series -> last result.
+        # Per entry AS the recent level shifts: series -> (timestamp, increase, entry IP).
+        self.shifts: Dict[int, Dict[Series, Tuple[int, float, str]]] = defaultdict(dict)
+        self.next_sweep = 0
+        self.suppression = suppression if suppression is not None else anomaly_suppression
+        self.suppression.set_ttl(self.detection_method_name, SHIFTED, agreement_window)
 
     def on_result_response(self, data: dict):
-        pass
+        """ Method that will be called every time we receive a new result from the RIPE Streaming API.
+            Finds the entry hop of the traceroute and adds its round trip time to the history of the probe in this
+            measurement. """
+        replies = fastest_replies(data)
+        asns = resolve_asns([data.get('dst_addr')] + [ip for ip, _ in replies], self.as_look_up)
+        own_as = asns[0]
+        if own_as == NO_AS:
+            return
+        entry = entry_hop(replies, asns[1:], own_as)
+        if entry is not None:
+            ip, entry_as, rtt = entry
+            self.add(data['msm_id'], data['prb_id'], data['timestamp'], ip, entry_as, rtt)
+
+    def add(self, measurement_id: int, probe_id: int, timestamp: int, entry_ip: str, entry_as: int,
+            rtt: float) -> Optional[dict]:
+        """
+        Adds the entry hop of one traceroute of a probe in a measurement.
+
+        Returns:
+                alert (dict): time, asn, ip_address, affected_probes, anomaly_score and mean_increase when the entry
+                AS is alerted, otherwise None.
+        """
+        if timestamp >= self.next_sweep:
+            self.expire(timestamp)
+        series = (measurement_id, probe_id)
+        previous_as = self.probe_entry_as.get(series)
+        if previous_as != entry_as:
+            if previous_as is not None:
+                del self.as_probes[previous_as][series]
+                self.shifts[previous_as].pop(series, None)
+            self.probe_entry_as[series] = entry_as
+        self.as_probes[entry_as][series] = timestamp
+
+        if not self.history.update(series, rtt):
+            return None
+        shifts = self.shifts[entry_as]
+        shifts[series] = (timestamp, float(self.history.last_diff[self.history.rows[series]]), entry_ip)
+        for old in [old for old, shift in shifts.items() if shift[0] <= timestamp - self.agreement_window]:
+            del shifts[old]
+
+        probes = sum(last_seen > timestamp - self.agreement_window for last_seen in self.as_probes[entry_as].values())
+        score = round(len(shifts) / probes * 100, 2)
+        if probes <= MIN_PROBES or score <= MIN_ANOMALY_SCORE or \
+                not self.suppression.claim(self.detection_method_name, entry_as, SHIFTED, timestamp):
+            return None
+        alert = {
+            'time': datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc),
+            'asn': entry_as,
+            'ip_address': sorted({ip for _, _, ip in shifts.values()}),
+            'affected_probes': len(shifts),
+            'anomaly_score': score,
+            'mean_increase': sum(increase for _, increase, _ in shifts.values()) / len(shifts),
+        }
+        self.create_anomaly(alert)
+        return alert
+
+    def expire(self, now: int) -> None:
+        """ Forgets the series without results for SERIES_TTL seconds. """
+        idle = [(series, entry_as) for entry_as, probes in self.as_probes.items()
+                for series, last_seen in probes.items() if last_seen <= now - SERIES_TTL]
+        for series, entry_as in idle:
+            del self.as_probes[entry_as][series]
+            del self.probe_entry_as[series]
+            self.shifts[entry_as].pop(series, None)
+        for entry_as in [entry_as for entry_as, probes in self.as_probes.items() if not probes]:
+            del self.as_probes[entry_as]
+            self.shifts.pop(entry_as, None)
+        if idle:
+            self.history.remove(series for series, _ in idle)
+        self.next_sweep = now + SWEEP_INTERVAL
 
     def on_startup_event(self):
-        pass
+        """ Method that will be called once the detection method has been loaded.
+            Create an Entry Point Delay Detection Method in the database and load the AS lookup. """
+        from database.models import DetectionMethod as DetectionMethodDB
+        detection_method, _ = DetectionMethodDB.objects.get_or_create(type=self.detection_method_name,
+                                                                      defaults={"description":
+                                                                                self.describe["description"]})
+        self.detection_method_id = detection_method.id
+        if self.as_look_up is None:
+            self.as_look_up = get_as_lookup()
+        detector_states.restore(self)
+
+    def create_anomaly(self, alert: dict):
+        """ This method is used to save an alert to the database, written with the next flush of the anomaly sink. """
+        from database.models import MeasurementType
+        print(f"Anomaly at {alert['time']} in AS{alert['asn']}. Problem with {alert['affected_probes']} probes. "
+              f"Percentage of AS: {alert['anomaly_score']}")
+        anomaly_sink.add(self.detection_method_name, time=alert['time'],
+                         ip_address=", ".join(alert['ip_address']),
+                         description="Increased round trip time behind entry AS" + str(alert['asn']) + ".",
+                         measurement_type=MeasurementType.TRACEROUTE,
+                         mean_increase=alert['mean_increase'],
+                         anomaly_score=alert['anomaly_score'], prediction_value=False,
+                         asn=alert['asn'])
 
     @property
     def get_measurement_type(self) -> MeasurementType:
@@ -1,17 +1,133 @@
+import datetime
+import time
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from anomaly_detection.as_tools import ASLookUp, get_as_lookup
+from anomaly_detection_reworked.anomaly_sink import anomaly_sink
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression, anomaly_suppression
 from anomaly_detection_reworked.detection_method import DetectionMethod
+from anomaly_detection_reworked.detector_state import detector_states
 from anomaly_detection_reworked.measurement_type import MeasurementType
+from anomaly_detection_reworked.quantile_sketch import BucketedSketch, ShiftRule
+from anomaly_detection_reworked.traceroute import NO_AS, fastest_replies, resolve_asns
+
+BUCKET = 20 * 60  # Seconds per time bucket.
+# The p50 or p90 of a bucket has to be more than 10 ms and 50% above the baseline, which mostly reflects the last 20
+# buckets (it loses 5% of its weight per bucket).
+SHIFT_RULE = ShiftRule(quantiles=(0.5, 0.9), decay=0.95, min_samples=20, min_baseline_samples=100, min_increase=10.0,
+                       relative_increase=0.5)
+SHIFTED = "Round trip time went up."  # Suppression description of a shift of a neighbour.
+SUPPRESSION_TTL = 6 * 60 * 60  # Seconds a shifted neighbour is not alerted again.
+NEIGHBOURS_RETRY = 3600  # Seconds before loading the neighbours is retried after a failure.
 
 
 class NeighborNetworkDelay(DetectionMethod):
     """
-    This Detection Method (algorithm) has not been finished. However, all methods work as supposed to.
+    Neighbor Network Delay Detection Method (algorithm) used to find anomalies. The neighbours of our AS are loaded
+    from RIPEstat once. The round trip times of all traceroute hops inside a neighbour AS are counted in a quantile
+    sketch per neighbour and time bucket; when a bucket is complete its median and 90th percentile are compared with
+    a decaying baseline sketch of the earlier buckets (BucketedSketch), then the bucket is merged into the baseline
+    unless it shifted. A shift is alerted once per neighbour: the following shifted buckets are suppressed for
+    SUPPRESSION_TTL in the shared suppression index. Memory is two sketches per neighbour, however many probes report.
     """
+    state_attributes = ('delays',)
+
+    def __init__(self, bucket: int = BUCKET, as_look_up: Optional[ASLookUp] = None,
+                 suppression: Optional[AnomalySuppression] = None):
+        self.detection_method_name = "Neighbor Network Delay"
+        self.detection_method_id = None
+        self.as_look_up = as_look_up
+        self.bucket_seconds = bucket
+        self.neighbour_sets: Dict[int, Tuple[FrozenSet[int], float]] = {}  # Own AS -> (neighbours, loaded at).
+        self.rule = SHIFT_RULE
+        self.delays: Dict[int, BucketedSketch] = {}
+        self.suppression = suppression if suppression is not None else anomaly_suppression
+        self.suppression.set_ttl(self.detection_method_name, SHIFTED, SUPPRESSION_TTL)
+
+    def neighbours(self, own_as: int) -> FrozenSet[int]:
+        """ Returns the neighbours of our AS, loaded from RIPEstat the first time (and retried after failures). """
+        cached = self.neighbour_sets.get(own_as)
+        if cached is not None and (cached[0] or time.monotonic() - cached[1] < NEIGHBOURS_RETRY):
+            return cached[0]
+        from ripe_interface.ripe_requests import RipeRequests
+        try:
+            neighbours = frozenset(RipeRequests.get_neighbours(own_as))
+        except Exception as exception:
+            print(f"Could not load the neighbours of AS{own_as}: {exception}")
+            neighbours = frozenset()
+        self.neighbour_sets[own_as] = (neighbours, time.monotonic())
+        return neighbours
 
     def on_result_response(self, data: dict):
-        pass
+        """ Method that will be called every time we receive a new result from the RIPE Streaming API.
+            Adds the round trip times of the hops inside neighbour ASes to their sketches. """
+        replies = fastest_replies(data)
+        if not replies:
+            return
+        asns = resolve_asns([data.get('dst_addr')] + [ip for ip, _ in replies], self.as_look_up)
+        if asns[0] == NO_AS:
+            return
+        neighbours = self.neighbours(asns[0])
+        bucket = data['timestamp'] // self.bucket_seconds
+        for (ip, rtt), asn in zip(replies, asns[1:]):
+            if rtt is not None and asn in neighbours:
+                self.add(asn, bucket, rtt)
+
+    def add(self, asn: int, bucket: int, rtt: float) -> Optional[dict]:
+        """ Adds a hop round trip time. Returns the alert of the previous bucket when a new bucket starts and the
+            previous one moved away from the baseline (and the shift is not suppressed), otherwise None. """
+        delay = self.delays.get(asn)
+        if delay is None:
+            delay = self.delays[asn] = BucketedSketch(bucket)
+        previous_bucket = delay.bucket
+        shift = delay.add(bucket, rtt, self.rule)
+        if shift is None:
+            return None
+        moment = datetime.datetime.fromtimestamp((previous_bucket + 1) * self.bucket_seconds, tz=datetime.timezone.utc)
+        if not self.suppression.claim(self.detection_method_name, asn, SHIFTED, moment):
+            return None
+        q, baseline, current = shift
+        alert = {
+            'time': moment,
+            'asn': asn,
+            'quantile': q,
+            'baseline': baseline,
+            'current': current,
+            'mean_increase': current - baseline,
+            'anomaly_score': round((current - baseline) / baseline * 100, 2),
+        }
+        self.create_anomaly(alert)
+        return alert
 
     def on_startup_event(self):
-        pass
+        """ Method that will be called once the detection method has been loaded. Create a Neighbor Network Delay
+            Detection Method in the database, load the AS lookup and the neighbours of the configured AS. """
+        from database.models import AutonomousSystem, Setting
+        from database.models import DetectionMethod as DetectionMethodDB
+        detection_method, _ = DetectionMethodDB.objects.get_or_create(type=self.detection_method_name,
+                                                                      defaults={"description":
+                                                                                self.describe["Description"]})
+        self.detection_method_id = detection_method.id
+        if self.as_look_up is None:
+            self.as_look_up = get_as_lookup()
+        setting = Setting.get_user_settings('admin')
+        autonomous_system = AutonomousSystem.objects.filter(setting=setting).first() if setting else None
+        if autonomous_system is not None:
+            self.neighbours(autonomous_system.number)
+        detector_states.restore(self)
+
+    def create_anomaly(self, alert: dict):
+        """ This method is used to save an alert to the database, written with the next flush of the anomaly sink. """
+        from database.models import MeasurementType
+        description = "P" + str(round(alert['quantile'] * 100)) + " round trip time inside AS" + str(alert['asn']) + \
+            " went from " + str(round(alert['baseline'], 1)) + " ms to " + str(round(alert['current'], 1)) + " ms."
+        print(f"Anomaly at {alert['time']}: {description}")
+        anomaly_sink.add(self.detection_method_name, time=alert['time'], ip_address="",
+                         description=description,
+                         measurement_type=MeasurementType.TRACEROUTE,
+                         mean_increase=alert['mean_increase'],
+                         anomaly_score=alert['anomaly_score'], prediction_value=False,
+                         asn=alert['asn'])
 
     @property
     def get_measurement_type(self) -> MeasurementType:
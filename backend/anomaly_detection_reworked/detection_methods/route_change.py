@@ -1,17 +1,122 @@
+import datetime
+from collections import Counter, defaultdict
+from typing import Dict, Optional, Tuple
+
+from anomaly_detection.as_tools import ASLookUp, get_as_lookup
+from anomaly_detection_reworked.anomaly_sink import anomaly_sink
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression, anomaly_suppression
 from anomaly_detection_reworked.detection_method import DetectionMethod
+from anomaly_detection_reworked.detector_state import detector_states
 from anomaly_detection_reworked.measurement_type import MeasurementType
+from anomaly_detection_reworked.path_fingerprints import FingerprintTable, as_path, fingerprint, ip_path
+from anomaly_detection_reworked.traceroute import NO_AS, fastest_replies, resolve_asns
+
+AGREEMENT_WINDOW = 20 * 60  # Seconds, new paths of probes this close together count as one route change.
+MIN_PROBES = 4  # A measurement needs more probes than this before it is scored.
+MIN_ANOMALY_SCORE = 10  # Percentage of the probes of a measurement that have to agree.
+PATH_KINDS = {'as': "New AS path", 'ip': "New router path"}
+CHANGED = "Route changed."  # Suppression description of a measurement and path kind, for the agreement window.
 
 
 class RouteChange(DetectionMethod):
     """
-    This Detection Method (algorithm) has not been finished. However, all methods work as supposed to.
+    Route Change Detection Method (algorithm) used to find anomalies. Every traceroute is turned into a fingerprint
+    of its AS path and of its IP path, and every probe keeps a bounded table of its recent fingerprints per
+    measurement (FingerprintTable), as the paths to other anchors and over IPv4 and IPv6 are different. A path that
+    is not in the baseline of its probe is new; when more than MIN_ANOMALY_SCORE percent of the probes with results
+    of a measurement took a new path within AGREEMENT_WINDOW, the route change is alerted, once per AGREEMENT_WINDOW
+    (claimed in the shared suppression index). Probes without results in the last AGREEMENT_WINDOW are not counted.
     """
+    state_attributes = ('tables', 'measurement_probes', 'new_paths')
+
+    def __init__(self, agreement_window: int = AGREEMENT_WINDOW, as_look_up: Optional[ASLookUp] = None,
+                 suppression: Optional[AnomalySuppression] = None):
+        self.detection_method_name = "Route Change"
+        self.detection_method_id = None
+        self.as_look_up = as_look_up
+        self.agreement_window = agreement_window
+        self.tables = {kind: FingerprintTable() for kind in PATH_KINDS}
+        self.measurement_probes: Dict[int, Dict[int, int]] = defaultdict(dict)  # Measurement -> probe -> last result.
+        # Per (measurement, path kind) the recent new paths: probe -> (timestamp, AS before our AS).
+        self.new_paths: Dict[Tuple[int, str], Dict[int, Tuple[int, int]]] = defaultdict(dict)
+        self.suppression = suppression if suppression is not None else anomaly_suppression
+        self.suppression.set_ttl(self.detection_method_name, CHANGED, agreement_window)
 
     def on_result_response(self, data: dict):
-        pass
+        """ Method that will be called every time we receive a new result from the RIPE Streaming API.
+            Fingerprints the paths of the traceroute and checks them against the baseline of the probe. """
+        replies = fastest_replies(data)
+        if not replies:
+            return
+        asns = resolve_asns([data.get('dst_addr')] + [ip for ip, _ in replies], self.as_look_up)
+        path = as_path(asns[1:])
+        neighbour = next((asn for asn in reversed(path) if asn != asns[0]), NO_AS)
+        fingerprints = {'as': fingerprint(path), 'ip': fingerprint(ip_path(replies))}
+        for kind, path_fingerprint in fingerprints.items():
+            self.add(data['msm_id'], data['prb_id'], data['timestamp'], kind, path_fingerprint, neighbour)
+
+    def add(self, measurement_id: int, probe_id: int, timestamp: int, kind: str, path_fingerprint: int,
+            neighbour: int) -> Optional[dict]:
+        """
+        Adds the fingerprint of one path.
+
+        Returns:
+                alert (dict): time, measurement_id, kind, asn (most common neighbour AS on the new paths),
+                affected_probes and anomaly_score when the route change is alerted, otherwise None.
+        """
+        self.measurement_probes[measurement_id][probe_id] = timestamp
+        if not self.tables[kind].observe((measurement_id, probe_id), path_fingerprint):
+            return None
+        key = (measurement_id, kind)
+        new_paths = self.new_paths[key]
+        new_paths[probe_id] = (timestamp, neighbour)
+        for probe in [probe for probe, new_path in new_paths.items() if new_path[0] <= timestamp - self.agreement_window]:
+            del new_paths[probe]
+
+        recent_probes = self.measurement_probes[measurement_id]
+        for probe in [probe for probe, last_seen in recent_probes.items()
+                      if last_seen <= timestamp - self.agreement_window]:
+            del recent_probes[probe]
+        probes = len(recent_probes)
+        score = round(len(new_paths) / probes * 100, 2)
+        if probes <= MIN_PROBES or score <= MIN_ANOMALY_SCORE or \
+                not self.suppression.claim(self.detection_method_name, key, CHANGED, timestamp):
+            return None
+        alert = {
+            'time': datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc),
+            'measurement_id': measurement_id,
+            'kind': kind,
+            'asn': Counter(neighbour for _, neighbour in new_paths.values()).most_common(1)[0][0],
+            'affected_probes': len(new_paths),
+            'anomaly_score': score,
+        }
+        self.create_anomaly(alert)
+        return alert
 
     def on_startup_event(self):
-        pass
+        """ Method that will be called once the detection method has been loaded.
+            Create a Route Change Detection Method in the database and load the AS lookup. """
+        from database.models import DetectionMethod as DetectionMethodDB
+        detection_method, _ = DetectionMethodDB.objects.get_or_create(type=self.detection_method_name,
+                                                                      defaults={"description":
+                                                                                self.describe["Description"]})
+        self.detection_method_id = detection_method.id
+        if self.as_look_up is None:
+            self.as_look_up = get_as_lookup()
+        detector_states.restore(self)
+
+    def create_anomaly(self, alert: dict):
+        """ This method is used to save an alert to the database, written with the next flush of the anomaly sink. """
+        from database.models import MeasurementType
+        description = PATH_KINDS[alert['kind']] + " for " + str(alert['affected_probes']) + " probes of measurement " \
+            + str(alert['measurement_id']) + "."
+        print(f"Anomaly at {alert['time']}: {description}")
+        anomaly_sink.add(self.detection_method_name, time=alert['time'], ip_address="",
+                         description=description,
+                         measurement_type=MeasurementType.TRACEROUTE,
+                         mean_increase=0,
+                         anomaly_score=alert['anomaly_score'], prediction_value=False,
+                         asn=alert['asn'] or None)
 
     @property
     def get_measurement_type(self) -> MeasurementType:
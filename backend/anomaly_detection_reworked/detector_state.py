@@ -0,0 +1,130 @@
+"""
+Snapshots of the in-memory state of detection methods, so a restart does not throw their baselines away.
+
+Every detection method with state (see DetectionMethod.get_state) gets its own file <directory>/<class name>.state:
+a fixed header (magic, format version, time of the snapshot) followed by the pickled state. The state consists of
+numpy arrays, sketches and dictionaries; arrays are stored without their unused capacity. Files are written next to
+the old snapshot and then swapped in, so a crash never leaves a half written snapshot. Snapshots of another format
+version, of another detection method or damaged snapshots are ignored: the detection method then starts empty.
+
+A snapshot is only consistent when no result is fed to the detection methods while it is written. The thread that
+feeds them holds `lock` while it does, and saving takes the same lock, so a snapshot requested from another thread
+(at shutdown) is written between two batches.
+
+The files are written and read by this application only, do not restore snapshots from untrusted sources.
+"""
+import os
+import pickle
+import struct
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from backend.settings import DETECTOR_STATE_DIRECTORY, DETECTOR_STATE_INTERVAL
+
+STATE_MAGIC = b"RADSTATE"
+STATE_VERSION = 5  # 2: the entry point delay history is kept per (measurement, probe), 3: so are route fingerprints,
+# 4: route change keeps the time of the last result of every probe, 5: so does entry point delay.
+HEADER = struct.Struct("<8sId")  # Magic, format version, time of the snapshot (seconds since the epoch).
+
+
+class StateError(Exception):
+    """ Raised when a state snapshot can not be used. """
+
+
+class DetectorStateStore:
+
+    def __init__(self, directory: str = DETECTOR_STATE_DIRECTORY, interval: float = DETECTOR_STATE_INTERVAL):
+        """
+        Parameters:
+                directory (str): Directory of the snapshot files, created when needed.
+                interval (float): Seconds between scheduled snapshots (see save_due).
+        """
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.RLock()  # Held while results are fed to the detection methods and while saving.
+        self.last_save = time.monotonic()
+        self.restored: Dict[str, float] = {}  # Class name -> time of the restored snapshot.
+
+    def path(self, method) -> str:
+        return os.path.join(self.directory, method.__class__.__name__ + ".state")
+
+    def save(self, method, now: Optional[float] = None) -> bool:
+        """ Writes the state of a detection method. Returns False when it has no state. """
+        state = method.get_state()
+        if state is None:
+            return False
+        path = self.path(method)
+        os.makedirs(self.directory, exist_ok=True)
+        payload = pickle.dumps({'method': method.__class__.__name__, 'state': state}, protocol=pickle.HIGHEST_PROTOCOL)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(HEADER.pack(STATE_MAGIC, STATE_VERSION, time.time() if now is None else now))
+            f.write(payload)
+        os.replace(temporary_path, path)
+        return True
+
+    def save_all(self, methods: Iterable) -> None:
+        """ Writes the state of all detection methods, for example at shutdown. Waits until the results being fed
+            are processed. Errors are printed, one detection method failing does not stop the others. """
+        with self.lock:
+            for method in methods:
+                try:
+                    self.save(method)
+                except Exception as exception:
+                    print(f"Could not save the state of {method.__class__.__name__}: {exception}")
+            self.last_save = time.monotonic()
+
+    def save_due(self, methods: Iterable) -> bool:
+        """ Writes the state of all detection methods when the interval has passed. Called between batches by the
+            thread that feeds the detection methods. """
+        if time.monotonic() - self.last_save < self.interval:
+            return False
+        self.save_all(methods)
+        return True
+
+    def load(self, method) -> (float, dict):
+        """ Returns the time and the state of the snapshot of a detection method, raises StateError when there is
+            no usable snapshot. """
+        path = self.path(method)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as error:
+            raise StateError(f"State {path} can not be read: {error}")
+        if len(data) < HEADER.size:
+            raise StateError(f"State {path} is damaged.")
+        magic, version, saved = HEADER.unpack_from(data)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise StateError(f"State {path} has an unknown format (version {version}).")
+        try:
+            snapshot = pickle.loads(data[HEADER.size:])
+        except Exception as error:
+            raise StateError(f"State {path} is damaged: {error}")
+        if not isinstance(snapshot, dict) or snapshot.get('method') != method.__class__.__name__:
+            raise StateError(f"State {path} belongs to another detection method.")
+        return saved, snapshot['state']
+
+    def restore(self, method) -> Optional[float]:
+        """ Restores the state of a detection method from its snapshot. Returns the time of the snapshot, None when
+            there was nothing to restore. """
+        if method.get_state() is None:
+            return None
+        try:
+            saved, state = self.load(method)
+        except StateError as error:
+            if os.path.exists(self.path(method)):
+                print(error)
+            return None
+        method.set_state(state)
+        self.restored[method.__class__.__name__] = saved
+        print(f"Restored the state of {method.__class__.__name__} from {time.ctime(saved)}.")
+        return saved
+
+    def gap_start(self) -> Optional[float]:
+        """ Time of the oldest restored snapshot: results since then have not been seen by every detection method.
+            None when nothing was restored. """
+        return min(self.restored.values()) if self.restored else None
+
+
+detector_states = DetectorStateStore()
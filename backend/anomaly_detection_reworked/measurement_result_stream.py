@@ -1,21 +1,42 @@
-from typing import List
-
-from ripe.atlas.cousteau import AtlasStream
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
+from anomaly_detection_reworked.anomaly_sink import anomaly_sink
+from anomaly_detection_reworked.atlas_stream import AsyncAtlasStream, message_type
 from anomaly_detection_reworked.detection_method import DetectionMethod
+from anomaly_detection_reworked.detector_state import detector_states
 from anomaly_detection_reworked.event_logger import EventLogger
 from anomaly_detection_reworked.measurement_type import MeasurementType
+from anomaly_detection_reworked.result_envelope import ResultEnvelope
+from backend.settings import DETECTOR_BACKFILL_CHUNK, DETECTOR_BACKFILL_MAX
+
+CONNECT_TIMEOUT = 30  # Seconds the backfill waits for the Streaming API connection, it backfills up to the connection.
+BACKFILL_OVERLAP = 600  # Seconds, results this recent may arrive both from the backfill and from the stream.
+
+log = logging.getLogger(__name__)
 
 
 class MeasurementResultStream:
 
-    def __init__(self, detection_methods: List[DetectionMethod]):
+    def __init__(self, detection_methods: List[DetectionMethod], backfill_since: Optional[float] = None):
         """
         Initialize this instance before connecting to the RIPE ATLAS Streaming API.
         First, retrieve measurements IDs from database.
         Second, pre-generate Detection Method data for later use.
-        Third, bind functions to the event logger and lastly connect to the Streaming API.
+        Third, subscribe to all measurements and lastly connect to the Streaming API.
+        backfill_since: time (seconds since the epoch) of the restored detector state, the results since then are
+        requested once the stream is connected (at most DETECTOR_BACKFILL_MAX seconds).
         """
+        self.backfill_since = backfill_since
+        self.held_back: Optional[List[List[str]]] = None  # Batches received while backfilling.
+        self.probe_status_methods: Dict[int, List[DetectionMethod]] = {}  # Probe ID -> subscribed detection methods.
+        self.subscriptions_lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         self.measurement_id_to_measurement_type: dict[int, MeasurementType] = {}  # Int represents a Measurement ID.
         self.measurement_type_to_detection_method: dict[MeasurementType, List[DetectionMethod]] = {}
         self.detection_methods = detection_methods
@@ -39,31 +60,164 @@ class MeasurementResultStream:
                     methods_list.append(method)
                 self.measurement_type_to_detection_method[msm_type] = methods_list
 
-        self.stream = AtlasStream()
         self.logger = EventLogger()
-        self.stream.connect()
-        # Bind functions we want to run with every result message received
-        self.stream.socketIO.on("connect", self.logger.on_connect)
-        self.stream.socketIO.on("disconnect", self.logger.on_disconnect)
-        self.stream.socketIO.on("reconnect", self.logger.on_reconnect)
-        self.stream.socketIO.on("error", self.logger.on_error)
-        self.stream.socketIO.on("close", self.logger.on_close)
-        self.stream.socketIO.on("connect_error", self.logger.on_connect_error)
-        self.stream.socketIO.on("atlas_error", self.logger.on_atlas_error)
-        self.stream.socketIO.on("atlas_unsubscribed", self.logger.on_atlas_unsubscribe)
-        self.stream.bind_channel("atlas_result", self.on_result_response)
+        self.stream = AsyncAtlasStream(consumer=self.on_result_batch, logger=self.logger)
+        # All measurements are subscribed to on one connection.
+        for measurement_id in self.measurement_ids:
+            self.stream.subscribe(stream_type="result", msm=measurement_id)
+        for method in self.detection_methods:
+            method.on_stream_created(self)
         try:
-            # Start the stream, and add one measurement ID (we can't start with multiple IDs)
-            stream_parameters = {"msm": self.measurement_ids[0]}
-            self.stream.start_stream(stream_type="result", **stream_parameters)
-            # Subscribe to stream with other IDs, and skip the first one.
-            for measurement_id in self.measurement_ids[1:]:
-                stream_parameters = {"msm": measurement_id}
-                self.stream.subscribe(stream_type="result", **stream_parameters)
-
-            self.stream.timeout(seconds=None)  # Run forever
+            asyncio.run(self.run())  # Run forever
         except KeyboardInterrupt:
             self.logger.on_disconnect(None)
+            detector_states.save_all(self.detection_methods)
+
+    async def run(self):
+        """
+        Coroutine that runs the stream. Other coroutines (backfill, HTTP requests) can share its event loop.
+        When backfilling, the stream connects first and the batches it receives are held back until the backfill
+        (up to the moment of connecting) is done, so no result falls between the two.
+        """
+        self.loop = asyncio.get_running_loop()
+        if self.backfill_since is None:
+            await self.stream.run()
+            return
+        self.held_back = []
+        stream = asyncio.ensure_future(self.stream.run())
+        try:
+            await asyncio.wait_for(self.stream.connected.wait(), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Not connected to the Streaming API after %s seconds, backfilling up to now.",
+                        CONNECT_TIMEOUT)
+        recent = set()
+        await self.loop.run_in_executor(None, self.backfill, self.backfill_since, time.time(), recent)
+        while self.held_back:
+            await self.loop.run_in_executor(None, self.process_batch, self.held_back.pop(0), recent)
+        self.held_back = None
+        await stream
+
+    def subscribe_probes(self, method: DetectionMethod, probe_ids: Iterable[int]):
+        """
+        Subscribes a detection method to the connection and disconnection events of probes, they are passed to its
+        on_probe_status_response(). Can be called from any thread; probes are only subscribed to once.
+        """
+        new_probe_ids = []
+        with self.subscriptions_lock:
+            for probe_id in probe_ids:
+                methods = self.probe_status_methods.setdefault(probe_id, [])
+                if not methods:
+                    new_probe_ids.append(probe_id)
+                if method not in methods:
+                    methods.append(method)
+        for probe_id in new_probe_ids:
+            subscribe = functools.partial(self.stream.subscribe, stream_type="probestatus", prb=probe_id)
+            if self.loop is None:  # Not connected yet, subscriptions are sent when the connection is made.
+                subscribe()
+            else:
+                self.loop.call_soon_threadsafe(subscribe)
+
+    def backfill(self, start: float, stop: float, recent: Optional[Set[Tuple]] = None) -> int:
+        """
+        Feeds the results between start and stop (seconds since the epoch) from the measurement results API to the
+        detection methods, oldest first. Only the gap since the restored state is requested, at most
+        DETECTOR_BACKFILL_MAX seconds, and DETECTOR_BACKFILL_CHUNK seconds of all measurements at a time so a long
+        gap is never held in memory at once. The (msm_id, prb_id, timestamp) of results in the last
+        BACKFILL_OVERLAP seconds are added to recent. Returns the amount of results.
+        """
+        from ripe_interface.ripe_client import ripe_client
+        from ripe_interface.ripe_requests import MEASUREMENTS_URL
+        start, stop = int(max(start, stop - DETECTOR_BACKFILL_MAX)), int(stop)
+        measurement_ids = [measurement_id for measurement_id in self.measurement_ids
+                           if self.get_corresponding_detection_methods(measurement_id)]
+        count = 0
+        for chunk_start in range(start, stop + 1, DETECTOR_BACKFILL_CHUNK):
+            chunk_stop = min(chunk_start + DETECTOR_BACKFILL_CHUNK - 1, stop)  # Start and stop are both included.
+            results = []
+            for measurement_id in measurement_ids:
+                params = {"start": chunk_start, "stop": chunk_stop}
+                try:
+                    page = ripe_client.get_json(MEASUREMENTS_URL + str(measurement_id) + "/results/", params)
+                except Exception as exception:
+                    print(f"Could not backfill measurement {measurement_id}: {exception}")
+                    continue
+                results.extend(result for result in page if isinstance(result, dict))
+            results.sort(key=lambda result: result.get('timestamp') or 0)
+            with detector_states.lock:
+                for result in results:
+                    try:
+                        self.on_envelope(ResultEnvelope.wrap(result))
+                    except Exception:
+                        log.exception("Could not process backfilled result %.200s", result)
+                anomaly_sink.flush()
+            if recent is not None:
+                recent.update((result.get('msm_id'), result.get('prb_id'), result.get('timestamp'))
+                              for result in results if (result.get('timestamp') or 0) >= stop - BACKFILL_OVERLAP)
+            count += len(results)
+        print(f"Backfilled {count} results since {time.ctime(start)}.")
+        return count
+
+    async def on_result_batch(self, batch: List[str]):
+        """
+        Method that will be called with every batch of raw result messages.
+        The detection methods are not coroutines, so the batch is processed outside the event loop.
+        """
+        if self.held_back is not None:  # Backfilling, see run().
+            self.held_back.append(batch)
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.process_batch, batch)
+
+    def process_batch(self, batch: List[str], skip: Optional[Set[Tuple]] = None):
+        """
+        Feeds a batch of raw messages to the detection methods. Results whose (msm_id, prb_id, timestamp) are in
+        skip were already fed by the backfill.
+        """
+        with detector_states.lock:
+            for raw in batch:
+                kind = message_type(raw)
+                try:
+                    if kind == "atlas_result":
+                        envelope = ResultEnvelope.scan(raw)
+                        if skip and (envelope.msm_id, envelope.prb_id, envelope.timestamp) in skip:
+                            continue
+                        self.on_envelope(envelope)
+                    elif kind == "atlas_probestatus":
+                        self.on_probe_status(raw)
+                except Exception:  # A malformed message (or detection method bug) does not cost the rest of the batch.
+                    log.exception("Could not process Streaming API message %.200s", raw)
+            anomaly_sink.flush()  # The anomalies of the whole batch in one transaction.
+            # Between batches no detection method is running, so the snapshot is consistent.
+            detector_states.save_due(self.detection_methods)
+
+    def on_raw_result(self, raw: str):
+        """
+        Method that will be called every time we receive a new raw result (["atlas_result", {...}]).
+        Only the routing fields are read to find the detection methods that want the result,
+        the result is decoded only if there is at least one.
+        """
+        self.on_envelope(ResultEnvelope.scan(raw))
+
+    def on_envelope(self, envelope: ResultEnvelope):
+        """
+        Method that passes a result to the detection methods that accept it, decoding it first if needed.
+        """
+        detection_methods = [method for method in self.get_corresponding_detection_methods(envelope.msm_id)
+                             if method.accepts(envelope)]
+        if not detection_methods:
+            return
+        result = envelope.decode()
+        for method in detection_methods:
+            method.on_result_response(result)
+
+    def on_probe_status(self, raw: str):
+        """
+        Method that will be called every time we receive a probe connection or disconnection event
+        (["atlas_probestatus", {"prb_id": ..., "event": "connect" or "disconnect", "timestamp": ...}]).
+        """
+        data = json.loads(raw)[1]
+        for method in self.probe_status_methods.get(data.get('prb_id'), ()):
+            method.on_probe_status_response(data)
 
     def on_result_response(self, *args):
         """
@@ -85,6 +239,8 @@ class MeasurementResultStream:
         Since the detection methods and measurement IDs won't change at this point, I precalculated
         all the detection methods by MeasurementType in a dictionary, so I won't need a for-loop.
         """
-        measurement_type: MeasurementType = self.measurement_id_to_measurement_type[measurement_id]
+        measurement_type: MeasurementType = self.measurement_id_to_measurement_type.get(measurement_id)
+        if measurement_type is None:  # Not one of our measurements.
+            return []
         methods: List[DetectionMethod] = self.measurement_type_to_detection_method[measurement_type]
         return methods
@@ -0,0 +1,112 @@
+"""
+Fingerprints of traceroute paths and a bounded table of the recent fingerprints of every probe.
+
+A path (the AS path, or the IP address of every responding hop) is reduced to a stable 64 bit hash, so comparing paths is one
+integer comparison and a probe's table holds integers instead of lists. Every probe gets a row of `slots`
+(fingerprint, count) pairs in numpy arrays. A fingerprint seen min_seen times is part of the baseline of the probe.
+The counts are halved every age_every observations so old paths fade out, and a new path takes the slot with the
+lowest count.
+"""
+import hashlib
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from anomaly_detection_reworked.traceroute import NO_AS
+
+MIN_CAPACITY = 16
+ARRAYS = ('fingerprints', 'counts', 'observations')
+
+
+def fingerprint(path: Iterable) -> int:
+    """ Stable (across processes) 64 bit hash of a path of AS numbers or IP addresses. """
+    return int.from_bytes(hashlib.blake2b(",".join(map(str, path)).encode(), digest_size=8).digest(), 'little')
+
+
+def as_path(asns: List[int]) -> Tuple[int, ...]:
+    """ The AS path of the hops: unknown ASes left out, repeated ASes once. """
+    path = []
+    for asn in asns:
+        if asn != NO_AS and (not path or path[-1] != asn):
+            path.append(asn)
+    return tuple(path)
+
+
+def ip_path(replies: List[Tuple[Optional[str], Optional[float]]]) -> Tuple[str, ...]:
+    """ The IP path of the hops, hops without replies left out: a router that does not answer every traceroute is
+        not a route change. """
+    return tuple(ip for ip, _ in replies if ip)
+
+
+class FingerprintTable:
+
+    def __init__(self, slots: int = 8, min_seen: int = 3, warmup: int = 10, age_every: int = 64,
+                 capacity: int = 1024):
+        """
+        Parameters:
+                slots (int): Amount of different fingerprints kept per probe.
+                min_seen (int): Times a fingerprint has to be seen (after aging) to be in the baseline.
+                warmup (int): Observations of a probe before its new fingerprints are reported.
+                age_every (int): The counts of a probe are halved every this many observations.
+                capacity (int): Initial amount of probe rows.
+        """
+        self.min_seen = min_seen
+        self.warmup = warmup
+        self.age_every = age_every
+        self.rows: Dict[Hashable, int] = {}
+        self.fingerprints = np.zeros((capacity, slots), dtype=np.uint64)
+        self.counts = np.zeros((capacity, slots), dtype=np.uint32)
+        self.observations = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def row(self, probe: Hashable) -> int:
+        row = self.rows.get(probe)
+        if row is None:
+            row = self.rows[probe] = len(self.rows)
+            if row == len(self.observations):
+                extra = len(self.observations) or MIN_CAPACITY  # Doubles, also after an empty snapshot.
+                for name in ARRAYS:
+                    old = getattr(self, name)
+                    setattr(self, name, np.concatenate([old, np.zeros((extra,) + old.shape[1:], dtype=old.dtype)]))
+        return row
+
+    def __getstate__(self) -> dict:
+        """ Pickles the rows in use only, without the spare capacity. """
+        state = self.__dict__.copy()
+        for name in ARRAYS:
+            state[name] = state[name][:len(self.rows)].copy()
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+
+    def observe(self, probe: Hashable, path_fingerprint: int) -> bool:
+        """
+        Counts a fingerprint for a probe. Returns True when the probe is past its warmup and the fingerprint was
+        not in its baseline.
+        """
+        row = self.row(probe)
+        fingerprints, counts = self.fingerprints[row], self.counts[row]
+        matches = np.flatnonzero((fingerprints == np.uint64(path_fingerprint)) & (counts > 0))
+        if len(matches):
+            slot = matches[0]
+            novel = counts[slot] < self.min_seen
+        else:
+            slot = np.argmin(counts)
+            fingerprints[slot] = path_fingerprint
+            counts[slot] = 0
+            novel = True
+        counts[slot] += 1
+        self.observations[row] += 1
+        if self.observations[row] % self.age_every == 0:
+            counts >>= 1
+        return bool(novel) and self.observations[row] > self.warmup
+
+    def baseline(self, probe: Hashable) -> List[int]:
+        """ The fingerprints in the baseline of a probe. """
+        row = self.rows.get(probe)
+        if row is None:
+            return []
+        return [int(f) for f, count in zip(self.fingerprints[row], self.counts[row]) if count >= self.min_seen]
@@ -0,0 +1,85 @@
+"""
+Cached index of the country of every RIPE Atlas probe.
+
+get() is a dictionary lookup. Probes that are not in the index yet are collected and resolved together in the
+background (one paginated /probes/?id__in=... request per FETCH_BATCH probes), so the stream never waits for the
+RIPE Atlas API; results of those probes are skipped until their country is known. The index can be warmed from the
+probes stored in the database.
+"""
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set
+
+FETCH_BATCH = 500  # Probes per request, the largest page size RIPE Atlas accepts.
+FETCH_INTERVAL = 60  # Seconds, unknown probes are resolved at least this often.
+UNKNOWN = ""  # Country of probes RIPE Atlas does not know (or has no country for).
+
+
+class ProbeCountryIndex:
+
+    def __init__(self, fetch_in_background: bool = True):
+        self.countries: Dict[int, str] = {}
+        self.missing: Set[int] = set()
+        self.fetch_in_background = fetch_in_background
+        self.fetching = False
+        self.last_fetch = 0.0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.countries)
+
+    def get(self, probe_id: int) -> Optional[str]:
+        """ Returns the country code of a probe, None while it is being resolved and for probes without country. """
+        country = self.countries.get(probe_id)
+        if country is not None:
+            return country or None
+        with self.lock:
+            self.missing.add(probe_id)
+            due = not self.fetching and (len(self.missing) >= FETCH_BATCH or
+                                         time.monotonic() - self.last_fetch >= FETCH_INTERVAL)
+            if due:
+                self.fetching = True
+        if due:
+            if self.fetch_in_background:
+                threading.Thread(target=self.fetch_missing, daemon=True, name="probe-countries").start()
+            else:
+                self.fetch_missing()
+        return None
+
+    def update(self, countries: Dict[int, Optional[str]]) -> None:
+        """ Adds (probe ID, country code) pairs, for example from the database or a probe metadata response. """
+        self.countries.update({probe_id: country or UNKNOWN for probe_id, country in countries.items()})
+
+    def load_from_database(self) -> None:
+        """ Warms the index with the probes stored by the legacy monitors. """
+        from database.models import Probe
+        self.update({probe: country for probe, country in
+                     Probe.objects.exclude(country=None).values_list('probe', 'country')})
+
+    def fetch_missing(self) -> None:
+        """ Resolves the collected probes with the RIPE Atlas probes API. Failures are retried later. """
+        with self.lock:
+            probe_ids, self.missing = sorted(self.missing), set()
+        try:
+            for start in range(0, len(probe_ids), FETCH_BATCH):
+                self.update(self.fetch(probe_ids[start:start + FETCH_BATCH]))
+        except Exception as exception:
+            print(f"Could not load the countries of {len(probe_ids)} probes: {exception}")
+            with self.lock:
+                self.missing.update(probe_id for probe_id in probe_ids if probe_id not in self.countries)
+        finally:
+            with self.lock:
+                self.fetching = False
+                self.last_fetch = time.monotonic()
+
+    @staticmethod
+    def fetch(probe_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """ Requests the countries of the probes, probes RIPE Atlas does not return get no country. """
+        from ripe_interface.paginator import paginate
+        from ripe_interface.ripe_requests import PROBES_URL
+        probe_ids = list(probe_ids)
+        countries: Dict[int, Optional[str]] = dict.fromkeys(probe_ids)
+        params = {"id__in": ",".join(map(str, probe_ids))}
+        for probe in paginate(PROBES_URL, params, fields="id,country_code"):
+            countries[probe['id']] = probe.get('country_code')
+        return countries
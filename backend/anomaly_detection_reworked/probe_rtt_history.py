@@ -0,0 +1,114 @@
+"""
+Bounded round trip time history of many probes in a few numpy arrays.
+
+This is the streaming level shift detector of the reworked detection methods: every new round trip time is judged
+right away, with constant work, instead of re-fitting a day of measurements.
+
+Every probe gets a row: a ring of its last 2 * window round trip times and a ring of its last `diffs` absolute
+differences between the medians of the left and the right window. The level shift test is the one of LevelShiftAD:
+the right window lies more than Q3 + c * IQR of the recent differences above the left window. Memory per probe is
+fixed, (2 * window + diffs) floats, and the arrays double in size when probes are added. Removing probes moves the
+rows of the others up.
+Pickles (state snapshots) hold the rows in use only.
+"""
+from typing import Dict, Hashable, Iterable, Optional
+
+import numpy as np
+
+MIN_CAPACITY = 16
+ARRAYS = {'rtts': np.nan, 'rtt_counts': 0, 'diffs': np.nan, 'diff_counts': 0, 'last_diff': np.nan}  # Name -> fill.
+
+
+class ProbeRttHistory:
+
+    def __init__(self, window: int = 3, c: float = 10.0, diffs: int = 64, min_samples: int = 30,
+                 capacity: int = 1024):
+        """
+        Parameters:
+                window (int): Amount of values in the windows before and after a point.
+                c (float): Factor of the inter-quartile range above which an increase is a level shift.
+                diffs (int): Amount of recent differences the quartiles are computed of.
+                min_samples (int): Amount of differences needed before the quartiles are trusted.
+                capacity (int): Initial amount of probe rows.
+        """
+        self.window = window
+        self.c = c
+        self.min_samples = min(min_samples, diffs)
+        self.rows: Dict[Hashable, int] = {}
+        self.rtts = np.full((capacity, 2 * window), np.nan)
+        self.rtt_counts = np.zeros(capacity, dtype=np.int64)
+        self.diffs = np.full((capacity, diffs), np.nan)
+        self.diff_counts = np.zeros(capacity, dtype=np.int64)
+        self.last_diff = np.full(capacity, np.nan)
+        # Position of the oldest value for every possible ring start, so a ring is read in order with one take.
+        self.chronological = (np.arange(2 * window)[None, :] + np.arange(2 * window)[:, None]) % (2 * window)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def row(self, probe: Hashable) -> int:
+        """ Returns the row of a probe, adding it (and growing the arrays) when it is new. """
+        row = self.rows.get(probe)
+        if row is None:
+            row = self.rows[probe] = len(self.rows)
+            if row == len(self.rtt_counts):
+                self.grow()
+        return row
+
+    def __getstate__(self) -> dict:
+        """ Pickles the rows in use only, without the spare capacity. """
+        state = self.__dict__.copy()
+        for name in ARRAYS:
+            state[name] = state[name][:len(self.rows)].copy()
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+
+    def grow(self) -> None:
+        capacity = 2 * len(self.rtt_counts) or MIN_CAPACITY  # Also after an empty snapshot.
+        for name, fill in ARRAYS.items():
+            old = getattr(self, name)
+            new = np.full((capacity,) + old.shape[1:], fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def remove(self, probes: Iterable[Hashable]) -> None:
+        """ Forgets the history of probes, the remaining rows are moved up in their order. """
+        for probe in probes:
+            self.rows.pop(probe, None)
+        kept = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        for name, fill in ARRAYS.items():
+            old = getattr(self, name)
+            new = np.full_like(old, fill)
+            new[:len(kept)] = old[kept]
+            setattr(self, name, new)
+        self.rows = {probe: row for row, probe in enumerate(self.rows)}
+
+    def update(self, probe: Hashable, rtt: Optional[float]) -> bool:
+        """
+        Adds the next round trip time of a probe. Missing and infinite values make the windows holding them
+        incomplete. Returns True when the right window is a level shift up from the left window; the difference of
+        the medians is then in last_diff.
+        """
+        row = self.row(probe)
+        size = 2 * self.window
+        count = self.rtt_counts[row]
+        self.rtts[row, count % size] = rtt if rtt is not None else np.nan
+        self.rtt_counts[row] = count + 1
+        self.last_diff[row] = np.nan
+        if count + 1 < size:
+            return False
+        values = self.rtts[row, self.chronological[(count + 1) % size]]
+        if not np.isfinite(values).all():
+            return False
+
+        diff = float(np.median(values[self.window:]) - np.median(values[:self.window]))
+        self.last_diff[row] = diff
+        diff_count = self.diff_counts[row]
+        self.diffs[row, diff_count % self.diffs.shape[1]] = abs(diff)
+        self.diff_counts[row] = diff_count + 1
+        if diff_count + 1 < self.min_samples or diff <= 0:
+            return False
+        q1, q3 = np.percentile(self.diffs[row, :min(diff_count + 1, self.diffs.shape[1])], [25, 75])
+        return abs(diff) > q3 + self.c * (q3 - q1)
@@ -0,0 +1,138 @@
+"""
+Mergeable quantile sketch with a fixed relative error and fixed memory.
+
+Values are counted in logarithmic bins (like DDSketch): bin i holds the values in (gamma^(i-1), gamma^i] with
+gamma = (1 + accuracy) / (1 - accuracy), so every quantile is returned within `accuracy` (relative) of a value of the
+right rank. The bins cover [min_value, max_value], values outside are counted in the first or last bin. Adding a
+value is one logarithm, two sketches with the same parameters are merged by adding their counts, and the counts can
+be scaled to let old data fade out. Memory does not depend on the amount of values: about 800 floats for round trip
+times between 0.01 ms and 100 s at 1% accuracy.
+
+BucketedSketch keeps a sketch of the current time bucket next to a decaying baseline sketch of the earlier buckets,
+and tests every complete bucket against the baseline with a ShiftRule. Shifted buckets are left out of the baseline,
+otherwise a lasting shift soon becomes the baseline; once the baseline has decayed below min_baseline_samples the
+buckets are merged again, so the baseline follows a shift that does not go away.
+"""
+import math
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class QuantileSketch:
+    __slots__ = ('accuracy', 'min_value', 'max_value', 'log_gamma', 'offset', 'counts', 'count')
+
+    def __init__(self, accuracy: float = 0.01, min_value: float = 0.01, max_value: float = 100_000.0):
+        self.accuracy = accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.offset = math.ceil(math.log(min_value) / self.log_gamma)
+        self.counts = np.zeros(math.ceil(math.log(max_value) / self.log_gamma) - self.offset + 1)
+        self.count = 0.0
+
+    def empty_copy(self) -> 'QuantileSketch':
+        """ A new, empty sketch with the same parameters (so it can be merged with this one). """
+        return QuantileSketch(self.accuracy, self.min_value, self.max_value)
+
+    def add(self, value: Optional[float], weight: float = 1.0) -> None:
+        """ Counts a value, missing, infinite and negative values are ignored. """
+        if value is None or not 0 <= value < math.inf:
+            return
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = min(math.ceil(math.log(value) / self.log_gamma) - self.offset, len(self.counts) - 1)
+        self.counts[index] += weight
+        self.count += weight
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """ Adds the counts of another sketch with the same parameters. """
+        if len(other.counts) != len(self.counts) or other.log_gamma != self.log_gamma:
+            raise ValueError("Only sketches with the same parameters can be merged.")
+        self.counts += other.counts
+        self.count += other.count
+
+    def scale(self, factor: float) -> None:
+        """ Multiplies all counts, for example to let old data fade out. """
+        self.counts *= factor
+        self.count *= factor
+
+    def quantile(self, q: float) -> Optional[float]:
+        """ Returns the q-quantile (0 <= q <= 1), None for an empty sketch. """
+        if self.count <= 0:
+            return None
+        rank = max(q * self.count, np.finfo(float).tiny)  # The 0-quantile is the first bin with values.
+        index = int(np.searchsorted(np.cumsum(self.counts), rank, side='left'))
+        index = min(index, len(self.counts) - 1)
+        if index == 0:
+            return self.min_value
+        return 2 * math.exp((index + self.offset) * self.log_gamma) / (1 + math.exp(self.log_gamma))
+
+    def __len__(self) -> int:
+        return int(round(self.count))
+
+
+class ShiftRule:
+    """ When a complete bucket counts as an increase, shared by all BucketedSketches of a detection method. """
+    __slots__ = ('quantiles', 'decay', 'min_samples', 'min_baseline_samples', 'min_increase', 'relative_increase')
+
+    def __init__(self, quantiles: Sequence[float] = (0.5, 0.9), decay: float = 0.95, min_samples: int = 20,
+                 min_baseline_samples: int = 100, min_increase: float = 10.0, relative_increase: float = 0.5):
+        """
+        Parameters:
+                quantiles (list): Quantiles that are compared.
+                decay (float): Weight of the baseline per bucket that passes.
+                min_samples (int): Values needed in a bucket before it is compared.
+                min_baseline_samples (int): Values (after decay) needed in the baseline.
+                min_increase (float): A quantile has to move up by more than this, and
+                relative_increase (float): by more than this part of the baseline.
+        """
+        self.quantiles = tuple(quantiles)
+        self.decay = decay
+        self.min_samples = min_samples
+        self.min_baseline_samples = min_baseline_samples
+        self.min_increase = min_increase
+        self.relative_increase = relative_increase
+
+    def test(self, current: QuantileSketch, baseline: QuantileSketch) -> Optional[Tuple[float, float, float]]:
+        """ Returns (quantile, baseline value, current value) of the largest relative increase, None without one. """
+        if current.count < self.min_samples or baseline.count < self.min_baseline_samples:
+            return None
+        shift = None
+        for q in self.quantiles:
+            baseline_value, current_value = baseline.quantile(q), current.quantile(q)
+            increase = current_value - baseline_value
+            if increase > self.min_increase and increase > self.relative_increase * baseline_value and \
+                    (shift is None or current_value / baseline_value > shift[2] / shift[1]):
+                shift = (q, baseline_value, current_value)
+        return shift
+
+
+class BucketedSketch:
+    """ The values of the current time bucket and a decaying baseline of the earlier buckets. """
+    __slots__ = ('bucket', 'current', 'baseline')
+
+    def __init__(self, bucket: int):
+        self.bucket = bucket
+        self.current = QuantileSketch()
+        self.baseline = QuantileSketch()
+
+    def add(self, bucket: int, value: Optional[float], rule: ShiftRule) -> Optional[Tuple[float, float, float]]:
+        """
+        Adds a value of a bucket, values of earlier buckets count for the current one. When the value starts a new
+        bucket, the previous bucket is tested against the baseline and merged into it, unless it shifted.
+
+        Returns:
+                shift (tuple): rule.test() of the previous bucket when this value completed it, otherwise None.
+        """
+        shift = None
+        if bucket > self.bucket:
+            shift = rule.test(self.current, self.baseline)
+            self.baseline.scale(rule.decay ** (bucket - self.bucket))
+            if shift is None:
+                self.baseline.merge(self.current)
+            self.current = self.current.empty_copy()
+            self.bucket = bucket
+        self.current.add(value)
+        return shift
@@ -0,0 +1,87 @@
+"""
+Lazily decoded Streaming API results.
+
+A result message is only useful to the detection methods subscribed to its measurement, and some detection methods
+only want a few results. ResultEnvelope reads the routing fields (msm_id, prb_id, timestamp and type) from the raw
+message with a cheap scan, the full JSON parse happens the first time decode() is called. Results nobody wants are
+never decoded.
+
+The same field names are also used inside the nested 'result' list (ICMP extension objects of traceroute hops have a
+'type', for example), and RIPE serializes 'result' before some top level fields. So the scan keeps track of the
+nesting depth, counting brackets between matches with str.count, and only takes fields of the result object itself.
+"""
+import json
+import re
+from typing import Optional
+
+ROUTING_FIELDS = re.compile(r'"(msm_id|prb_id|timestamp|type)"\s*:\s*(?:(-?\d+)|"([^"]*)")')
+
+
+def nesting(raw: str, start: int, stop: int) -> int:
+    """ Change of the nesting depth between two positions of a JSON string. """
+    return raw.count('{', start, stop) + raw.count('[', start, stop) - raw.count('}', start, stop) - \
+        raw.count(']', start, stop)
+
+
+class ResultEnvelope:
+    __slots__ = ('raw', 'msm_id', 'prb_id', 'timestamp', 'type', '_result')
+
+    def __init__(self, raw: str, msm_id: Optional[int] = None, prb_id: Optional[int] = None,
+                 timestamp: Optional[int] = None, type: Optional[str] = None):
+        self.raw = raw
+        self.msm_id = msm_id
+        self.prb_id = prb_id
+        self.timestamp = timestamp
+        self.type = type
+        self._result = None
+
+    def __str__(self) -> str:
+        return "Result (msm_id: " + str(self.msm_id) + " | prb_id: " + str(self.prb_id) + \
+               " | timestamp: " + str(self.timestamp) + " | type: " + str(self.type) + ")"
+
+    @staticmethod
+    def scan(raw: str) -> 'ResultEnvelope':
+        """ Reads the routing fields of a raw result, either a result object or a Streaming API message
+            ["atlas_result", {...}]. Only fields at the depth of the result object count, nested fields with the
+            same name are skipped. When a field is not found (or brackets inside strings threw the depth off), the
+            message is decoded instead. """
+        envelope = ResultEnvelope(raw)
+        top = 2 if raw.lstrip().startswith('[') else 1  # Depth of the fields of the result object.
+        depth, position = 0, 0
+        missing = 4
+        for match in ROUTING_FIELDS.finditer(raw):
+            depth += nesting(raw, position, match.start())
+            position = match.start()
+            field, number, text = match.groups()
+            if depth != top or getattr(envelope, field) is not None:
+                continue
+            setattr(envelope, field, int(number) if number is not None else text)
+            missing -= 1
+            if missing == 0:
+                break
+        if missing:  # Unexpected layout, fall back to decoding the whole message.
+            result = envelope.decode()
+            envelope.msm_id = result.get('msm_id')
+            envelope.prb_id = result.get('prb_id')
+            envelope.timestamp = result.get('timestamp')
+            envelope.type = result.get('type')
+        return envelope
+
+    @staticmethod
+    def wrap(result: dict) -> 'ResultEnvelope':
+        """ Envelope of an already decoded result, for example from the measurement results API. """
+        envelope = ResultEnvelope(None, result.get('msm_id'), result.get('prb_id'), result.get('timestamp'),
+                                  result.get('type'))
+        envelope._result = result
+        return envelope
+
+    def decode(self) -> dict:
+        """ Returns the fully decoded result. It is only parsed once, every caller gets the same dictionary. """
+        if self._result is None:
+            message = json.loads(self.raw)
+            self._result = message[1] if isinstance(message, list) else message
+        return self._result
+
+    @property
+    def is_decoded(self) -> bool:
+        return self._result is not None
@@ -0,0 +1,60 @@
+"""
+Helpers to read traceroute results of the Streaming API without building intermediate objects.
+
+A hop of a raw result is {"hop": 3, "result": [{"from": ip, "rtt": 1.2, ...}, {"x": "*"}, ...]} or
+{"hop": 3, "error": "..."}. Per hop only the reply with the lowest round trip time is used.
+"""
+from typing import List, Optional, Tuple
+
+from anomaly_detection.as_tools import ASLookUp, get_as_lookup
+
+NO_AS = 0
+
+
+def fastest_replies(result: dict) -> List[Tuple[Optional[str], Optional[float]]]:
+    """ Returns (ip, rtt) of the fastest reply of every hop, (None, None) for hops without replies. """
+    replies = []
+    for hop in result.get('result') or ():
+        ip, rtt = None, None
+        for packet in hop.get('result') or ():
+            packet_rtt = packet.get('rtt')
+            if packet_rtt is not None and (rtt is None or packet_rtt < rtt):
+                ip, rtt = packet.get('from'), packet_rtt
+        replies.append((ip, rtt))
+    return replies
+
+
+def resolve_asns(ips: List[Optional[str]], as_look_up: Optional[ASLookUp] = None) -> List[int]:
+    """ Returns the AS number of every IP in one lookup batch, NO_AS for missing IPs and unknown prefixes. """
+    as_look_up = as_look_up or get_as_lookup()
+    asns = as_look_up.get_as_batch([ip for ip in ips if ip is not None])
+    resolved = iter(asns)
+    return [NO_AS if ip is None else int(next(resolved) or NO_AS) for ip in ips]
+
+
+def entry_hop(replies: List[Tuple[Optional[str], Optional[float]]], asns: List[int],
+              own_as: int) -> Optional[Tuple[str, int, float]]:
+    """
+    Finds where the path enters our AS: walking back from the destination, the first responding hop outside our AS.
+    Hops of unknown ASes (private and unannounced addresses) are skipped, they are not an entry AS.
+
+    Parameters:
+            replies (list): (ip, rtt) per hop, see fastest_replies().
+            asns (list): AS number per hop, see resolve_asns().
+            own_as (int): Our AS number.
+
+    Returns:
+            entry (tuple): (ip, asn) of the last hop before our AS and the round trip time of the first hop inside
+            it, None when the path does not reach our AS or never leaves it.
+    """
+    inside_rtt = None
+    for (ip, rtt), asn in zip(reversed(replies), reversed(asns)):
+        if ip is None or asn == NO_AS:
+            continue
+        if asn == own_as:
+            inside_rtt = rtt
+        elif inside_rtt is None:
+            return None
+        else:
+            return ip, asn, inside_rtt
+    return None
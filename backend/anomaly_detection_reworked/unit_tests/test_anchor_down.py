@@ -0,0 +1,102 @@
+import json
+import threading
+from unittest.mock import MagicMock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression
+from anomaly_detection_reworked.detection_methods.anchor_down import AnchorDown, ConnectionStatus, MetaProbe
+from anomaly_detection_reworked.measurement_result_stream import MeasurementResultStream
+from database.models import Anomaly, AutonomousSystem, Setting
+
+
+def anchor(probe_id: int, status: str) -> MetaProbe:
+    """ An anchor of the probes API with the given connection status. """
+    return MetaProbe(address_v4=f"193.0.0.{probe_id}", address_v6=None, asn_v4=3333, asn_v6=None, country_code="NL",
+                     description=f"nl-ams-as3333-{probe_id}", first_connected=1600000000, id=probe_id,
+                     is_anchor=True, is_public=True, last_connected=1651363200, prefix_v6=None,
+                     prefix_v4="193.0.0.0/21", geometry=None,
+                     status={'id': 1, 'name': status, 'since': "2022-05-01T00:00:00Z"}, status_since=1651363200,
+                     tags=[], total_uptime=1000, type="Probe")
+
+
+class TestAnchorDown(TestCase):
+    """ Test module for the Anchor Down detection method. """
+
+    def setUp(self):
+        User.objects.create_user(username='admin', password='admin')
+        AutonomousSystem.objects.create(setting=Setting.get_user_settings('admin'), number=3333, name="RIPE NCC")
+        self.detection_method = AnchorDown(status_events=False, suppression=AnomalySuppression())
+        self.detection_method.on_startup_event()
+
+    def check(self, statuses: dict) -> list:
+        return self.detection_method.check([anchor(probe_id, status) for probe_id, status in statuses.items()])
+
+    def test_transitions(self):
+        """ Anchors are matched by probe ID, only changes to a bad status are alerted. """
+        self.assertEqual(self.check({1: "Connected", 2: "Disconnected"}), [("Anchor is offline.", "193.0.0.2")])
+        self.assertEqual(self.check({2: "Disconnected", 1: "Connected"}), [])  # Other order, nothing changed.
+        self.assertEqual(self.check({3: "Never Connected", 2: "Disconnected", 1: "Disconnected"}),
+                         [("Anchor never connected.", "193.0.0.3"), ("Anchor is offline.", "193.0.0.1")])
+        self.assertEqual(Anomaly.objects.count(), 3)
+        self.assertEqual(self.detection_method.cycles, 3)
+        self.assertIsNotNone(self.detection_method.cycle_seconds)
+
+    def test_never_connected(self):
+        """ An anchor that never connected has no connection times, fields unknown to MetaProbe are ignored. """
+        probe = MetaProbe(address_v4="193.0.0.9", address_v6=None, asn_v4=3333, asn_v6=None, country_code="NL",
+                          description="nl-ams-as3333-9", first_connected=None, id=9, is_anchor=True, is_public=True,
+                          last_connected=None, prefix_v6=None, prefix_v4="193.0.0.0/21", geometry=None,
+                          status={'id': 0, 'name': "Never Connected", 'since': None}, status_since=None, tags=[],
+                          total_uptime=0, type="Probe", firmware_version=5080)
+        self.assertIsNone(probe.last_connected)
+        self.assertIsNone(probe.status.since)
+        self.assertEqual(self.detection_method.check([probe]), [("Anchor never connected.", "193.0.0.9")])
+
+    def test_suppression(self):
+        """ After a restart, anchors that already have an anomaly are not alerted again, without queries. """
+        self.check({1: "Disconnected", 2: "Abandoned"})
+        suppression = AnomalySuppression()
+        restarted = AnchorDown(status_events=False, suppression=suppression)
+        with self.assertNumQueries(1):
+            self.assertEqual(suppression.warm(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(restarted.check([anchor(1, "Disconnected"), anchor(2, "Abandoned")]), [])
+        Anomaly.objects.filter(description="Anchor is offline.").update(time="2022-05-01T00:00:00Z")
+        suppression = AnomalySuppression()
+        restarted = AnchorDown(status_events=False, suppression=suppression)
+        suppression.warm()
+        self.assertEqual(restarted.check([anchor(1, "Disconnected"), anchor(2, "Abandoned")]),
+                         [("Anchor is offline.", "193.0.0.1")])  # Offline anomalies are suppressed for a day.
+
+    def test_status_events(self):
+        """ Connection events of the anchors are subscribed to after the first check and applied right away. """
+        stream = MeasurementResultStream.__new__(MeasurementResultStream)  # Do not connect to the Streaming API.
+        stream.probe_status_methods, stream.subscriptions_lock, stream.loop = {}, threading.Lock(), None
+        stream.stream, stream.detection_methods = MagicMock(), []
+        detection_method = AnchorDown(status_events=True, suppression=AnomalySuppression())
+        detection_method.on_stream_created(stream)
+        self.assertEqual(detection_method.check_interval, detection_method.reconcile_interval)
+
+        self.assertEqual(detection_method.check([anchor(1, "Connected"), anchor(2, "Connected")]), [])
+        self.assertEqual([call.kwargs for call in stream.stream.subscribe.call_args_list],
+                         [{'stream_type': "probestatus", 'prb': 1}, {'stream_type': "probestatus", 'prb': 2}])
+        detection_method.check([anchor(1, "Connected"), anchor(2, "Connected")])
+        self.assertEqual(stream.stream.subscribe.call_count, 2)  # Subscribed once.
+
+        def event(probe_id: int, kind: str, timestamp: int) -> str:
+            return json.dumps(["atlas_probestatus", {"prb_id": probe_id, "asn": 3333, "prefix": "193.0.0.0/21",
+                                                     "event": kind, "controller": "ctr-ams01",
+                                                     "timestamp": timestamp}])
+
+        stream.process_batch([event(2, "disconnect", 1651366800), event(7, "disconnect", 1651366800)])
+        self.assertEqual(list(Anomaly.objects.values_list('description', 'ip_address')),
+                         [("Anchor is offline.", "193.0.0.2")])
+        self.assertEqual(detection_method.probes[2].status.name, ConnectionStatus.DISCONNECTED)
+        stream.process_batch([event(1, "disconnect", 1651359600)])  # Older than the status of the anchor.
+        self.assertEqual(detection_method.probes[1].status.name, ConnectionStatus.CONNECTED)
+        stream.process_batch([event(2, "connect", 1651366900)])
+        self.assertEqual(detection_method.events, 2)
+        self.assertEqual(detection_method.check([anchor(1, "Connected"), anchor(2, "Connected")]), [])
+        self.assertEqual(Anomaly.objects.count(), 1)
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import OperationalError
+from django.test import TestCase
+from django.utils import timezone
+
+from anomaly_detection_reworked.anomaly_sink import AnomalySink
+from database.models import Anomaly, AutonomousSystem, DetectionMethod, MeasurementType, Setting
+
+
+class TestAnomalySink(TestCase):
+    """ Test module for the buffered anomaly writer. """
+
+    def setUp(self):
+        User.objects.create_user(username='admin', password='admin')
+        self.autonomous_system = AutonomousSystem.objects.create(setting=Setting.get_user_settings('admin'),
+                                                                 number=3333, name="RIPE NCC")
+        for name in ("Route Change", "Anchor Down"):
+            DetectionMethod.objects.create(type=name, description=name)
+
+    def add(self, sink: AnomalySink, detection_method: str, index: int):
+        sink.add(detection_method, time=timezone.now(), ip_address=f"193.0.0.{index % 250}",
+                 description="Anchor is offline.", measurement_type=MeasurementType.PING, mean_increase=0,
+                 anomaly_score=4.0, prediction_value=False, asn=3333)
+
+    def test_batches(self):
+        """ The ids are looked up once, anomalies are written together in one transaction. """
+        sink = AnomalySink(batch_size=1000, cache_ids=True)
+        with self.assertNumQueries(3):  # The detection methods and the autonomous system.
+            for index in range(90):
+                self.add(sink, ["Route Change", "Anchor Down"][index % 2], index)
+        self.assertEqual(len(sink), 90)
+        with self.assertNumQueries(3):  # Savepoint, one INSERT (SQLite splits larger batches) and release.
+            self.assertEqual(sink.flush(), 90)
+        self.assertEqual(Anomaly.objects.filter(autonomous_system=self.autonomous_system).count(), 90)
+        self.assertEqual(Anomaly.objects.filter(detection_method__type="Anchor Down").count(), 45)
+        self.assertEqual(sink.flush(), 0)
+
+    def test_full_batch_is_written(self):
+        """ Anomalies are written as soon as a batch is full. """
+        sink = AnomalySink(batch_size=10, cache_ids=False)
+        for index in range(25):
+            self.add(sink, "Anchor Down", index)
+        self.assertEqual((Anomaly.objects.count(), len(sink), sink.stored), (20, 5, 20))
+
+    def test_invalid_row_is_dropped(self):
+        """ One anomaly that can not be written does not block the others. """
+        sink = AnomalySink(batch_size=1000, cache_ids=True)
+        for index in range(5):
+            self.add(sink, "Anchor Down", index)
+        sink.add("Anchor Down", time=timezone.now(), ip_address=None, description="Anchor is offline.",
+                 measurement_type=MeasurementType.PING, mean_increase=0, anomaly_score=4.0, prediction_value=False,
+                 asn=3333)  # ip_address is NOT NULL.
+        self.add(sink, "Anchor Down", 5)
+        with self.assertLogs('anomaly_detection_reworked.anomaly_sink') as logs:
+            self.assertEqual(sink.flush(), 6)
+        self.assertIn("Dropped an anomaly", "\n".join(logs.output))
+        self.assertEqual((Anomaly.objects.count(), len(sink), sink.stored, sink.dropped), (6, 0, 6, 1))
+
+    def test_database_unavailable(self):
+        """ Anomalies wait for the next flush while the database is unavailable, at most max_pending of them. """
+        sink = AnomalySink(batch_size=10, cache_ids=True, max_pending=15)
+        with patch.object(Anomaly.objects, 'bulk_create', side_effect=OperationalError("database is locked")), \
+                self.assertLogs('anomaly_detection_reworked.anomaly_sink'):
+            for index in range(12):
+                self.add(sink, "Anchor Down", index)
+            self.assertEqual((len(sink), sink.flush()), (2 + 10, 0))
+            for index in range(12, 20):
+                self.add(sink, "Anchor Down", index)
+        self.assertEqual((len(sink), sink.dropped), (15, 5))
+        self.assertEqual(sink.flush(), 15)
+        self.assertEqual(sorted(Anomaly.objects.values_list('ip_address', flat=True)),
+                         sorted(f"193.0.0.{index}" for index in range(5, 20)))
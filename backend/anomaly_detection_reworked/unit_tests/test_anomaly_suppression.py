@@ -0,0 +1,46 @@
+import datetime
+
+from django.test import TestCase
+
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression
+
+
+class TestAnomalySuppression(TestCase):
+    """ Test module for the shared anomaly suppression index. """
+
+    def test_windows(self):
+        """ An anomaly is suppressed for the TTL of its detection method and description, or forever. """
+        suppression = AnomalySuppression(default_ttl=3600)
+        suppression.set_ttl("Anchor Down", "Anchor has been abandoned.", None)
+        self.assertTrue(suppression.claim("Route Change", "AS1103", "Route changed.", 1000))
+        self.assertFalse(suppression.claim("Route Change", "AS1103", "Route changed.", 4599))
+        self.assertTrue(suppression.claim("Route Change", "AS1104", "Route changed.", 4599))  # Another target.
+        self.assertTrue(suppression.claim("Route Change", "AS1103", "Route changed.", 4600))  # Window passed.
+        moment = datetime.datetime(2022, 5, 1, tzinfo=datetime.timezone.utc)
+        self.assertTrue(suppression.claim("Anchor Down", "193.0.0.1", "Anchor has been abandoned.", moment))
+        self.assertFalse(suppression.claim("Anchor Down", "193.0.0.1", "Anchor has been abandoned.",
+                                           moment + datetime.timedelta(days=365)))
+        self.assertTrue(suppression.is_suppressed("Route Change", "AS1103", "Route changed.", now=5000))
+
+    def test_prune(self):
+        """ Anomalies whose window passed are forgotten, the others are kept. """
+        suppression = AnomalySuppression(default_ttl=10)
+        for target in range(2000):
+            suppression.claim("Route Change", target, "Route changed.", target)
+        self.assertLess(len(suppression), 2000)
+        suppression.prune(now=1995)
+        self.assertEqual(len(suppression), 14)  # Claimed after 1985.
+        self.assertFalse(suppression.claim("Route Change", 1999, "Route changed.", 2000))
+
+    def test_entries(self):
+        """ The entries of a detection method can be restored into another index, for example after a restart. """
+        suppression = AnomalySuppression(default_ttl=3600)
+        suppression.claim("Route Change", (5001, 'as'), "Route changed.", 1000)
+        suppression.claim("Entry Point Delay", 1103, "Round trip time went up.", 1000)
+        entries = suppression.entries("Route Change")
+        self.assertEqual(entries, {((5001, 'as'), "Route changed."): 4600})
+        restored = AnomalySuppression(default_ttl=3600)
+        restored.restore("Route Change", entries)
+        self.assertFalse(restored.claim("Route Change", (5001, 'as'), "Route changed.", 2000))
+        self.assertTrue(restored.claim("Entry Point Delay", 1103, "Round trip time went up.", 2000))
+
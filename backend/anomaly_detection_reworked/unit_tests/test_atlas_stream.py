@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import websockets
+from django.test import TestCase
+
+from anomaly_detection_reworked.atlas_stream import AsyncAtlasStream, message_type
+
+
+class TestAsyncAtlasStream(TestCase):
+    """ Test module for the asyncio Streaming API client, against a local websocket server that pretends to be
+        the RIPE Atlas Streaming API. """
+
+    def setUp(self):
+        self.subscriptions = []
+        self.batches = []
+
+    async def fake_streaming_api(self, websocket, *args):
+        """ Waits for two subscriptions, then sends 5 results (one per subscribed measurement alternately)
+            and an error message. """
+        for _ in range(2):
+            message = json.loads(await websocket.recv())
+            self.subscriptions.append(message)
+        await websocket.send(json.dumps(["atlas_subscribed", self.subscriptions[0][1]]))
+        for i in range(5):
+            measurement_id = self.subscriptions[i % 2][1]["msm"]
+            await websocket.send(json.dumps(["atlas_result", {"msm_id": measurement_id, "prb_id": i}]))
+        await websocket.send(json.dumps(["atlas_error", "Something went wrong"]))
+        await asyncio.sleep(1)
+
+    async def run_stream(self, batch_size: int, failing_batches: int = 0):
+        async def consumer(batch):
+            self.batches.append(batch)
+            if len(self.batches) <= failing_batches:
+                raise ValueError("Detection method bug")
+
+        async with websockets.serve(self.fake_streaming_api, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            stream = AsyncAtlasStream(consumer=consumer, url="ws://127.0.0.1:" + str(port) + "/",
+                                      batch_size=batch_size, batch_interval=0.1)
+            stream.subscribe("result", msm=1001)
+            stream.subscribe("result", msm=1002)
+            task = asyncio.ensure_future(stream.run())
+            await asyncio.sleep(0.5)
+            await stream.close()
+            await asyncio.wait_for(task, 5)
+
+    def test_subscriptions_share_one_connection(self):
+        """ Both measurements are subscribed to over the same connection. """
+        asyncio.run(self.run_stream(batch_size=500))
+        self.assertEqual([subscription[0] for subscription in self.subscriptions], ["atlas_subscribe"] * 2)
+        self.assertEqual([subscription[1]["msm"] for subscription in self.subscriptions], [1001, 1002])
+
+    def test_results_are_batched(self):
+        """ The 5 results arrive in batches of at most 2 raw messages, control messages are not passed on. """
+        asyncio.run(self.run_stream(batch_size=2))
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2, 1])
+        results = [json.loads(raw)[1]["prb_id"] for batch in self.batches for raw in batch]
+        self.assertEqual(results, [0, 1, 2, 3, 4])
+        self.assertTrue(all(isinstance(raw, str) for batch in self.batches for raw in batch))
+
+    def test_consumer_errors_are_logged(self):
+        """ A consumer that raises does not end the stream: the error is logged and the next batches arrive on the
+            same connection. """
+        with self.assertLogs('anomaly_detection_reworked.atlas_stream', level='ERROR') as logs:
+            asyncio.run(self.run_stream(batch_size=2, failing_batches=1))
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2, 1])
+        self.assertEqual(len(self.subscriptions), 2)  # Not reconnected.
+
+    def test_message_type(self):
+        self.assertEqual(message_type('["atlas_result", {"msm_id": 1001}]'), "atlas_result")
+        self.assertEqual(message_type('["atlas_probestatus",{"prb_id":6001}]'), "atlas_probestatus")
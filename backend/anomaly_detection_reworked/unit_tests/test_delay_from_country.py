@@ -0,0 +1,96 @@
+from unittest.mock import patch
+
+import numpy as np
+from django.test import TestCase
+
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression
+from anomaly_detection_reworked.detection_methods.delay_from_country import DelayFromCountry
+from anomaly_detection_reworked.probe_countries import ProbeCountryIndex
+
+
+def ping(probe_id: int, timestamp: int, rtt: float) -> dict:
+    """ A raw ping result with three replies. """
+    return {'msm_id': 1, 'prb_id': probe_id, 'timestamp': timestamp, 'type': 'ping', 'dst_addr': '193.0.0.1',
+            'min': rtt, 'avg': rtt + 1, 'max': rtt + 2, 'sent': 3, 'rcvd': 3}
+
+
+class TestProbeCountryIndex(TestCase):
+    """ Test module for the cached probe country index. """
+
+    def test_resolves_missing_probes_in_batches(self):
+        """ Unknown probes are resolved together, known probes are answered from the index. """
+        index = ProbeCountryIndex(fetch_in_background=False)
+        index.update({1: 'NL'})
+        with patch.object(ProbeCountryIndex, 'fetch', return_value={2: 'DE', 3: None}) as fetch:
+            self.assertEqual(index.get(1), 'NL')
+            fetch.assert_not_called()
+            self.assertIsNone(index.get(2))  # Resolved now, the first lookup does not wait for it.
+            fetch.assert_called_once_with([2])
+            self.assertEqual(index.get(2), 'DE')
+            index.missing.add(3)
+            index.fetch_missing()
+            self.assertIsNone(index.get(3))  # Known without country, not requested again.
+            self.assertEqual(fetch.call_count, 2)
+
+    def test_failed_fetch_is_retried(self):
+        """ Probes of a failed request stay missing. """
+        index = ProbeCountryIndex(fetch_in_background=False)
+        with patch.object(ProbeCountryIndex, 'fetch', side_effect=ConnectionError("offline")):
+            self.assertIsNone(index.get(7))
+        self.assertEqual(index.missing, {7})
+        self.assertFalse(index.fetching)
+
+
+class TestDelayFromCountry(TestCase):
+    """ Test module for the Delay from Country detection method. """
+
+    def feed(self, detection_method: DelayFromCountry, steps: range, shift_from: int = 25 * 4) -> list:
+        """ Feeds a result every 5 minutes from 20 probes, the probes in DE are 50 ms slower from shift_from on.
+            Returns the alerts. """
+        generator = np.random.default_rng(steps.start)
+        alerts = []
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in steps:
+                for probe_id in range(20):
+                    rtt = 30 + generator.exponential(2)
+                    if probe_id % 2 == 1 and step >= shift_from:
+                        rtt += 50
+                    detection_method.on_result_response(ping(probe_id, 1651363200 + step * 300, rtt))
+        return alerts
+
+    def detection_method(self) -> DelayFromCountry:
+        index = ProbeCountryIndex(fetch_in_background=False)
+        index.update({probe_id: ['NL', 'DE'][probe_id % 2] for probe_id in range(20)})
+        return DelayFromCountry(probe_countries=index, suppression=AnomalySuppression())
+
+    def test_alert(self):
+        """ A country whose round trip times go up is alerted once per statistic when its buckets are complete,
+            others are not. """
+        detection_method = self.detection_method()
+        alerts = self.feed(detection_method, range(30 * 4))  # 30 buckets of 20 minutes.
+        with patch.object(ProbeCountryIndex, 'fetch', return_value={}) as fetch:
+            detection_method.on_result_response(ping(99, 1651363200, 10.0))  # Country not known yet.
+        fetch.assert_called_once_with([99])
+        self.assertEqual(sorted((alert['country'], alert['statistic']) for alert in alerts),
+                         [('DE', 'avg'), ('DE', 'min')])
+        self.assertEqual(min(alert['time'] for alert in alerts).timestamp(), 1651363200 + 26 * 1200)
+        self.assertAlmostEqual(alerts[0]['mean_increase'], 50, delta=5)
+        self.assertEqual(set(detection_method.delays), {('NL', 'min'), ('NL', 'avg'), ('DE', 'min'), ('DE', 'avg')})
+
+    def test_shifted_buckets_stay_out_of_baseline(self):
+        """ The buckets of a shift are not merged into the baseline, so a shift that lasts longer than the
+            suppression (6 hours, 18 buckets) is alerted again instead of having become the baseline. """
+        detection_method = self.detection_method()
+        alerts = self.feed(detection_method, range(50 * 4))
+        self.assertLess(detection_method.delays[('DE', 'min')].baseline.quantile(0.5), 40)
+        self.assertEqual([alert['time'].timestamp() for alert in alerts if alert['statistic'] == 'min'],
+                         [1651363200 + 26 * 1200, 1651363200 + 44 * 1200])
+
+    def test_suppression_is_restored(self):
+        """ The suppressed shifts are part of the state, a restored detection method does not alert them again. """
+        detection_method = self.detection_method()
+        self.assertEqual(len(self.feed(detection_method, range(30 * 4))), 2)
+        restored = self.detection_method()
+        restored.set_state(detection_method.get_state())
+        self.assertEqual(self.feed(restored, range(30 * 4, 32 * 4)), [])
+        self.assertEqual(len(self.feed(self.detection_method(), range(30 * 4))), 2)
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.test import TestCase
+
+from anomaly_detection.as_tools import TEST_DUMP, ASLookUp
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression
+from anomaly_detection_reworked.detection_methods.anchor_down import AnchorDown
+from anomaly_detection_reworked.detection_methods.delay_from_country import DelayFromCountry
+from anomaly_detection_reworked.detection_methods.entry_point_delay import EntryPointDelay
+from anomaly_detection_reworked import measurement_result_stream
+from anomaly_detection_reworked.detector_state import HEADER, STATE_MAGIC, DetectorStateStore, StateError
+from anomaly_detection_reworked.measurement_result_stream import MeasurementResultStream
+from anomaly_detection_reworked.measurement_type import MeasurementType
+from anomaly_detection_reworked.probe_countries import ProbeCountryIndex
+from anomaly_detection_reworked.unit_tests.test_entry_point_delay import traceroute
+from ripe_interface.ripe_client import ripe_client
+
+
+class TestDetectorState(TestCase):
+    """ Test module for the snapshots of the state of the detection methods. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.as_look_up = ASLookUp(os.path.join(cls.directory.name, "ris_snapshot.bin"), dump_files=[TEST_DUMP])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.states = DetectorStateStore(tempfile.mkdtemp(dir=self.directory.name), interval=300)
+
+    def feed(self, detection_method: EntryPointDelay, steps: range) -> list:
+        """ Feeds the traceroutes of test_entry_point_delay (an increase at step 60) and returns the alerts. """
+        generator = np.random.default_rng(steps.start)
+        alerts = []
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in steps:
+                for probe_id in range(16):
+                    entry_ip = '145.100.4.1' if probe_id < 8 else '145.0.0.9'
+                    rtt = 20 + generator.normal(0, 1) + (100 if probe_id < 3 and step >= 60 else 0)
+                    detection_method.on_result_response(traceroute(probe_id, 1651363200 + step * 240 + probe_id,
+                                                                   entry_ip, rtt))
+        return alerts
+
+    def test_restore(self):
+        """ A restored detection method continues where the saved one stopped. """
+        saved = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        self.feed(saved, range(0, 58))
+        self.assertTrue(self.states.save(saved, now=1651377120))
+        self.assertLess(os.path.getsize(self.states.path(saved)), saved.history.rtts.nbytes)  # Spare rows are left out.
+
+        restored = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        self.assertEqual(self.states.restore(restored), 1651377120)
+        self.assertEqual(self.states.gap_start(), 1651377120)
+        self.assertEqual(len(restored.history), 16)
+        alerts = self.feed(restored, range(58, 80))
+        self.assertEqual(alerts, self.feed(saved, range(58, 80)))
+        self.assertEqual([alert['asn'] for alert in alerts], [1105])
+        no_baseline = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        self.assertEqual(len(self.feed(no_baseline, range(58, 80))), 0)
+
+    def test_unusable_snapshots(self):
+        """ Snapshots of another version, another detection method or damaged snapshots are not restored. """
+        detection_method = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        self.assertIsNone(self.states.restore(detection_method))  # No snapshot yet.
+        self.states.save(detection_method)
+        path = self.states.path(detection_method)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(STATE_MAGIC, 999, 0.0) + data[HEADER.size:])
+        self.assertRaises(StateError, self.states.load, detection_method)
+        with open(path, 'wb') as f:
+            f.write(data[:HEADER.size + 10])
+        self.assertRaises(StateError, self.states.load, detection_method)
+        os.replace(path, self.states.path(DelayFromCountry()))
+        self.assertRaises(StateError, self.states.load, DelayFromCountry())
+        self.assertIsNone(self.states.gap_start())
+
+    def test_schedule(self):
+        """ save_due writes the detection methods with state once the interval passed. """
+        index = ProbeCountryIndex(fetch_in_background=False)
+        index.update({1: 'NL'})
+        methods = [DelayFromCountry(probe_countries=index), AnchorDown()]
+        self.assertFalse(self.states.save_due(methods))
+        self.states.last_save -= 300
+        self.assertTrue(self.states.save_due(methods))
+        self.assertEqual(os.listdir(self.states.directory), ["DelayFromCountry.state"])  # AnchorDown has no state.
+        restored = DelayFromCountry(probe_countries=ProbeCountryIndex(fetch_in_background=False))
+        self.states.restore(restored)
+        self.assertEqual(restored.probe_countries.get(1), 'NL')
+
+    def test_shutdown_snapshot_waits_for_batch(self):
+        """ A snapshot requested from another thread is written after the batch that is being fed. """
+        index = ProbeCountryIndex(fetch_in_background=False)
+        index.update({2: 'DE'})
+        methods = [DelayFromCountry(probe_countries=index)]
+        self.states.lock.acquire()  # A batch is being fed.
+        saver = threading.Thread(target=self.states.save_all, args=(methods,))
+        saver.start()
+        time.sleep(0.1)
+        self.assertTrue(saver.is_alive())
+        index.update({1: 'NL'})
+        self.states.lock.release()
+        saver.join(5)
+        restored = DelayFromCountry(probe_countries=ProbeCountryIndex(fetch_in_background=False))
+        self.states.restore(restored)
+        self.assertEqual(restored.probe_countries.get(1), 'NL')
+
+
+def result(measurement_id: int, probe_id: int, timestamp: int) -> dict:
+    return {"msm_id": measurement_id, "prb_id": probe_id, "timestamp": timestamp, "type": "traceroute"}
+
+
+class TestBackfill(TestCase):
+    """ Test module for the backfill of the results missed since the restored snapshot. """
+
+    def setUp(self):
+        self.stream = MeasurementResultStream.__new__(MeasurementResultStream)  # Do not connect to the Streaming API.
+        self.method = MagicMock()
+        self.method.accepts.return_value = True
+        self.stream.measurement_ids = [5001, 5002]
+        self.stream.measurement_id_to_measurement_type = {5001: MeasurementType.TRACEROUTE,
+                                                          5002: MeasurementType.TRACEROUTE}
+        self.stream.measurement_type_to_detection_method = {MeasurementType.TRACEROUTE: [self.method]}
+        self.stream.detection_methods = []
+        self.requests = []
+
+    def results_api(self, url, params):
+        """ Every measurement has a result every 1000 seconds of probe 1, measurement 5002 is not available. """
+        self.requests.append((url, params))
+        if "5002" in url:
+            raise ConnectionError("Service unavailable.")
+        return [result(5001, 1, timestamp) for timestamp in range(0, 10000, 1000)
+                if params["start"] <= timestamp <= params["stop"]]
+
+    def fed(self) -> list:
+        return [call.args[0]['timestamp'] for call in self.method.on_result_response.call_args_list]
+
+    @patch.object(measurement_result_stream, 'DETECTOR_BACKFILL_CHUNK', 3000)
+    def test_backfill_in_chunks(self):
+        """ The gap is requested a chunk at a time, oldest first, a measurement that fails is skipped. """
+        recent = set()
+        with patch.object(ripe_client, 'get_json', side_effect=self.results_api):
+            self.assertEqual(self.stream.backfill(500, 9000, recent), 9)
+        self.assertEqual(self.fed(), list(range(1000, 10000, 1000)))
+        self.assertEqual([params for url, params in self.requests if "5001" in url],
+                         [{"start": 500, "stop": 3499}, {"start": 3500, "stop": 6499}, {"start": 6500, "stop": 9000}])
+        self.assertEqual(recent, {(5001, 1, 9000)})
+
+    def test_results_during_backfill_are_held_back(self):
+        """ The stream connects before the backfill, what it receives meanwhile is fed afterwards without the
+            results the backfill already fed. """
+        stream = self.stream
+        stream.backfill_since = time.time() - 60
+        stream.held_back = None
+        now = int(time.time())
+        raw = [json.dumps(["atlas_result", result(5001, 2, now - 1)]),
+               json.dumps(["atlas_result", result(5001, 1, now)])]
+
+        class Stream:
+            connected = asyncio.Event()
+
+            async def run(self):
+                self.connected.set()
+                await stream.on_result_batch(raw)
+
+        def backfill(start, stop, recent):
+            time.sleep(0.2)  # The stream sends its batch meanwhile.
+            stream.on_envelope(measurement_result_stream.ResultEnvelope.wrap(result(5001, 2, now - 1)))
+            recent.add((5001, 2, now - 1))
+
+        stream.stream = Stream()
+        with patch.object(stream, 'backfill', side_effect=backfill):
+            asyncio.run(stream.run())
+        self.assertEqual(self.fed(), [now - 1, now])
+        self.assertIsNone(stream.held_back)
+
@@ -0,0 +1,124 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+from django.test import TestCase
+
+from anomaly_detection.as_tools import TEST_DUMP, ASLookUp
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression
+from anomaly_detection_reworked.detection_methods.entry_point_delay import EntryPointDelay
+from anomaly_detection_reworked.traceroute import NO_AS, entry_hop, fastest_replies, resolve_asns
+
+
+def traceroute(probe_id: int, timestamp: int, entry_ip: str, rtt: float, measurement_id: int = 1) -> dict:
+    """ A raw traceroute result to 193.0.0.1 (AS3333) entering through entry_ip. """
+    return {
+        'msm_id': measurement_id, 'prb_id': probe_id, 'timestamp': timestamp, 'type': 'traceroute', 'dst_addr': '193.0.0.1',
+        'result': [
+            {'hop': 1, 'result': [{'from': '145.0.0.1', 'rtt': 1.0}, {'x': '*'}]},
+            {'hop': 2, 'error': 'Network unreachable'},
+            {'hop': 3, 'result': [{'from': entry_ip, 'rtt': rtt - 1}, {'from': entry_ip, 'rtt': rtt - 2}]},
+            {'hop': 4, 'result': [{'x': '*'}, {'x': '*'}]},
+            {'hop': 5, 'result': [{'from': '193.0.0.2', 'rtt': rtt + 1}, {'from': '193.0.0.2', 'rtt': rtt}]},
+            {'hop': 6, 'result': [{'from': '193.0.0.1', 'rtt': rtt + 2}]},
+        ]
+    }
+
+
+class TestEntryPointDelay(TestCase):
+    """ Test module for the streaming Entry Point Delay detection method. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.as_look_up = ASLookUp(os.path.join(cls.directory.name, "ris_snapshot.bin"), dump_files=[TEST_DUMP])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def test_entry_hop(self):
+        """ The entry hop is the last responding hop before our AS, with the round trip time behind it. """
+        result = traceroute(1, 0, '145.100.4.1', 20.0)
+        replies = fastest_replies(result)
+        self.assertEqual(replies, [('145.0.0.1', 1.0), (None, None), ('145.100.4.1', 18.0), (None, None),
+                                   ('193.0.0.2', 20.0), ('193.0.0.1', 22.0)])
+        asns = resolve_asns([ip for ip, _ in replies], self.as_look_up)
+        self.assertEqual(asns, [1103, NO_AS, 1105, NO_AS, 3333, 3333])
+        self.assertEqual(entry_hop(replies, asns, 3333), ('145.100.4.1', 1105, 20.0))
+        self.assertIsNone(entry_hop(replies[:3], asns[:3], 3333))  # Never reaches our AS.
+        self.assertIsNone(entry_hop(replies[4:], asns[4:], 3333))  # Never leaves it.
+        # A private address between the entry hop and our AS has no AS, it is not the entry hop.
+        replies[3] = ('10.0.0.1', 19.0)
+        self.assertEqual(entry_hop(replies, asns, 3333), ('145.100.4.1', 1105, 20.0))
+
+    def test_alert(self):
+        """ An entry AS is alerted once when enough of its probes agree on an increase, other ASes are not. """
+        generator = np.random.default_rng(0)
+        detection_method = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = []
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in range(80):
+                for probe_id in range(16):
+                    entry_ip = '145.100.4.1' if probe_id < 8 else '145.0.0.9'
+                    rtt = 20 + generator.normal(0, 1)
+                    if probe_id < 3 and step >= 60:
+                        rtt += 100
+                    detection_method.on_result_response(traceroute(probe_id, 1651363200 + step * 240 + probe_id,
+                                                                   entry_ip, rtt))
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0]['asn'], 1105)
+        self.assertEqual(alerts[0]['ip_address'], ['145.100.4.1'])
+        self.assertGreater(alerts[0]['anomaly_score'], 10)
+        self.assertAlmostEqual(alerts[0]['mean_increase'], 100, delta=5)
+        self.assertEqual(alerts[0]['time'].timestamp(), 1651363200 + 61 * 240 + alerts[0]['affected_probes'] - 1)
+        self.assertEqual(len(detection_method.history), 16)
+
+    def test_probe_changes_entry_as(self):
+        """ A probe is counted for its current entry AS only. """
+        detection_method = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        detection_method.add(1, 1, 0, '145.100.4.1', 1105, 20.0)
+        detection_method.add(1, 1, 60, '145.0.0.9', 1103, 20.0)
+        self.assertEqual(detection_method.as_probes[1105], {})
+        self.assertEqual(detection_method.as_probes[1103], {(1, 1): 60})
+
+    def test_probe_measures_several_targets(self):
+        """ The round trip times of a probe to targets with other baselines (two anchoring measurements) are not
+            one time series: results of a second measurement, from step 60 on, are not a level shift. """
+        generator = np.random.default_rng(0)
+        detection_method = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = []
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in range(80):
+                for probe_id in range(16):
+                    for measurement_id, baseline in [(1, 20), (2, 80)][:1 if step < 60 else 2]:
+                        rtt = baseline + generator.normal(0, 1)
+                        detection_method.on_result_response(traceroute(
+                            probe_id, 1651363200 + step * 240 + probe_id, '145.100.4.1', rtt, measurement_id))
+        self.assertEqual(alerts, [])
+        self.assertEqual(len(detection_method.history), 32)
+        self.assertEqual(len(detection_method.as_probes[1105]), 32)
+
+    def test_idle_series(self):
+        """ Series without recent results are not counted in the anomaly score, and are forgotten after a day. """
+        generator = np.random.default_rng(0)
+        detection_method = EntryPointDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = []
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in range(80):
+                for probe_id in range(40 if step < 50 else 8):  # 32 probes stop after step 49.
+                    rtt = 20 + generator.normal(0, 1)
+                    if probe_id < 1 and step >= 60:
+                        rtt += 100
+                    detection_method.add(1, probe_id, 1651363200 + step * 240, '145.100.4.1', 1105, rtt)
+        self.assertEqual([alert['anomaly_score'] for alert in alerts], [12.5])
+        self.assertEqual(len(detection_method.as_probes[1105]), 40)
+
+        detection_method.add(1, 0, 1651363200 + 2 * 24 * 60 * 60, '145.100.4.1', 1105, 20.0)
+        self.assertEqual(detection_method.as_probes[1105], {(1, 0): 1651363200 + 2 * 24 * 60 * 60})
+        self.assertEqual(set(detection_method.probe_entry_as), {(1, 0)})
+        self.assertEqual(len(detection_method.history), 1)
+
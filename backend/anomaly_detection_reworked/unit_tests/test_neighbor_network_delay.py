@@ -0,0 +1,101 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+from django.test import TestCase
+
+from anomaly_detection.as_tools import TEST_DUMP, ASLookUp
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression
+from anomaly_detection_reworked.detection_methods.neighbor_network_delay import NeighborNetworkDelay
+from anomaly_detection_reworked.quantile_sketch import QuantileSketch
+
+
+def traceroute(probe_id: int, timestamp: int, neighbour_rtt: float) -> dict:
+    """ A raw traceroute result to 193.0.0.1 (AS3333) passing AS1103 and neighbour AS1105. """
+    hops = [('145.0.0.1', 1.0), ('145.100.4.1', neighbour_rtt), ('145.100.4.2', neighbour_rtt + 1),
+            ('193.0.0.1', neighbour_rtt + 2)]
+    return {'msm_id': 1, 'prb_id': probe_id, 'timestamp': timestamp, 'type': 'traceroute', 'dst_addr': '193.0.0.1',
+            'result': [{'hop': hop, 'result': [{'from': ip, 'rtt': rtt}]}
+                       for hop, (ip, rtt) in enumerate(hops, start=1)]}
+
+
+class TestQuantileSketch(TestCase):
+    """ Test module for the mergeable quantile sketch. """
+
+    def test_accuracy(self):
+        """ Quantiles are within the relative accuracy of the exact quantiles. """
+        data = np.random.default_rng(0).lognormal(3, 1, 20000)
+        sketch = QuantileSketch(accuracy=0.01)
+        self.assertIsNone(sketch.quantile(0.5))
+        for value in data:
+            sketch.add(value)
+        sketch.add(None)
+        sketch.add(float('inf'))
+        self.assertEqual(len(sketch), len(data))
+        for q in (0.0, 0.1, 0.5, 0.9, 0.99, 1.0):
+            self.assertAlmostEqual(sketch.quantile(q), np.quantile(data, q, method='inverted_cdf'),
+                                   delta=0.0101 * np.quantile(data, q, method='inverted_cdf'))
+
+    def test_merge(self):
+        """ Merging sketches gives the sketch of all values, the size does not depend on the values. """
+        data = np.random.default_rng(1).exponential(20, 3000)
+        whole, first = QuantileSketch(), QuantileSketch()
+        second = first.empty_copy()
+        for i, value in enumerate(data):
+            whole.add(value)
+            (first if i % 2 else second).add(value)
+        first.merge(second)
+        np.testing.assert_array_equal(first.counts, whole.counts)
+        self.assertEqual(first.quantile(0.9), whole.quantile(0.9))
+        self.assertEqual(len(first.counts), len(QuantileSketch().counts))
+        with self.assertRaises(ValueError):
+            first.merge(QuantileSketch(accuracy=0.02))
+
+
+class TestNeighborNetworkDelay(TestCase):
+    """ Test module for the Neighbor Network Delay detection method. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.as_look_up = ASLookUp(os.path.join(cls.directory.name, "ris_snapshot.bin"), dump_files=[TEST_DUMP])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def feed(self, detection_method: NeighborNetworkDelay, steps: range) -> list:
+        """ Feeds a result every 2 minutes from 10 probes, AS1105 is 40 ms slower from bucket 25 on. Returns the
+            alerts. """
+        generator = np.random.default_rng(0)
+        alerts = []
+        with patch('ripe_interface.ripe_requests.RipeRequests.get_neighbours', return_value={1105, 1200}) as get, \
+                patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in steps:
+                for probe_id in range(10):
+                    rtt = 20 + generator.exponential(2) + (40 if step >= 25 * 10 else 0)
+                    detection_method.on_result_response(traceroute(probe_id, 1651363200 + step * 120, rtt))
+        get.assert_called_once_with(3333)
+        return alerts
+
+    def test_alert(self):
+        """ A slower neighbour is alerted once when its buckets are complete, the neighbours are loaded once. """
+        detection_method = NeighborNetworkDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = self.feed(detection_method, range(30 * 10))  # 30 buckets of 20 minutes.
+        self.assertEqual(set(detection_method.delays), {1105})
+        # Every complete bucket after the increase (25 to 28) is above the baseline, only the first is alerted.
+        self.assertEqual([alert['time'].timestamp() for alert in alerts], [1651363200 + 26 * 1200])
+        self.assertEqual(alerts[0]['asn'], 1105)
+        self.assertAlmostEqual(alerts[0]['mean_increase'], 40, delta=5)
+
+    def test_shifted_buckets_stay_out_of_baseline(self):
+        """ A shift that lasts longer than the suppression (6 hours, 18 buckets) is alerted again instead of having
+            become the baseline. """
+        detection_method = NeighborNetworkDelay(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = self.feed(detection_method, range(50 * 10))
+        self.assertLess(detection_method.delays[1105].baseline.quantile(0.5), 30)
+        self.assertEqual([alert['time'].timestamp() for alert in alerts],
+                         [1651363200 + 26 * 1200, 1651363200 + 44 * 1200])
@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+from django.test import TestCase
+
+from anomaly_detection_reworked.probe_rtt_history import ProbeRttHistory
+
+
+class TestProbeRttHistory(TestCase):
+    """ Test module for the streaming level shift detector. """
+
+    def setUp(self):
+        self.generator = np.random.default_rng(0)
+
+    def test_detects_increase_right_away(self):
+        """ A level shift is flagged one value after it starts, a decrease is not flagged. """
+        history = ProbeRttHistory(window=3, c=10.0)
+        flags = [history.update('probe', value) for value in 20 + self.generator.normal(0, 1, 100)]
+        self.assertFalse(any(flags))
+        self.assertFalse(history.update('probe', 120.0))
+        self.assertTrue(history.update('probe', 121.0))
+        self.assertGreater(history.last_diff[history.rows['probe']], 90)
+
+        flags = [history.update('probe', value) for value in 120 + self.generator.normal(0, 1, 20)]
+        flags += [history.update('probe', value) for value in 20 + self.generator.normal(0, 1, 20)]
+        self.assertFalse(any(flags[3:]))
+
+    def test_missing_values(self):
+        """ Windows with missing or infinite values are skipped. """
+        history = ProbeRttHistory(window=3, min_samples=1)
+        for value in [1.0, 2.0, None, 1.0, math.inf, 2.0, 1.0, 2.0, math.nan]:
+            self.assertFalse(history.update('probe', value))
+        self.assertEqual(history.diff_counts[history.rows['probe']], 0)
+        for value in [1.0, 2.0, 1.0, 2.0, 1.0, 2.0]:
+            history.update('probe', value)
+        self.assertEqual(history.diff_counts[history.rows['probe']], 1)
+
+    def test_probes_are_independent(self):
+        """ Every probe has its own windows and differences. """
+        history = ProbeRttHistory(min_samples=10)
+        for value in 20 + self.generator.normal(0, 1, 50):
+            history.update(6001, value)
+            history.update(6002, value)
+        history.update(6001, 120.0)
+        self.assertTrue(history.update(6001, 120.0))
+        self.assertFalse(history.update(6002, 20.0))
+
+    def test_bounded_history(self):
+        """ The history of a probe is bounded, and rows are added for new probes. """
+        history = ProbeRttHistory(window=3, diffs=16, min_samples=8, capacity=2)
+        flags = [history.update('probe', value) for value in [20.0] * 50 + [120.0, 121.0, 119.0]]
+        self.assertFalse(any(flags[:51]))
+        self.assertTrue(flags[51])
+        self.assertAlmostEqual(history.last_diff[history.rows['probe']], 100.0)
+        for probe in range(100):
+            history.update(probe, 1.0)
+        self.assertEqual(len(history), 101)
+        self.assertEqual(history.rtts.shape, (128, 6))
+        self.assertEqual(history.diffs.shape, (128, 16))
+        self.assertEqual(history.rtt_counts[history.rows['probe']], 53)
+
+    def test_remove(self):
+        """ Removed probes start over, the history of the others is kept. """
+        history = ProbeRttHistory(window=3, min_samples=1, capacity=2)
+        for value in [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]:
+            for probe in ['a', 'b', 'c']:
+                history.update(probe, value)
+        history.update('c', 7.0)
+        history.remove(['a', 'missing'])
+        self.assertEqual(history.rows, {'b': 0, 'c': 1})
+        self.assertEqual(list(history.rtt_counts[:3]), [6, 7, 0])
+        self.assertEqual(history.diff_counts[history.rows['c']], 2)
+        self.assertTrue(np.isnan(history.rtts[2]).all())
+        history.update('a', 1.0)
+        self.assertEqual(history.rows['a'], 2)
+        self.assertEqual(history.rtt_counts[2], 1)
+
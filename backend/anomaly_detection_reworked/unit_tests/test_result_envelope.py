@@ -0,0 +1,104 @@
+import json
+from unittest.mock import MagicMock
+
+from django.test import TestCase
+
+from anomaly_detection_reworked.measurement_result_stream import MeasurementResultStream
+from anomaly_detection_reworked.measurement_type import MeasurementType
+from anomaly_detection_reworked.result_envelope import ResultEnvelope
+
+TRACEROUTE_RESULT = {
+    "fw": 5020, "lts": 12, "endtime": 1652100012, "dst_name": "195.169.125.10", "dst_addr": "195.169.125.10",
+    "src_addr": "10.0.0.2", "proto": "ICMP", "af": 4, "size": 48, "paris_id": 1,
+    "result": [{"hop": 1, "result": [{"from": "10.0.0.1", "ttl": 64, "size": 76, "rtt": 1.123}]},
+               {"hop": 2, "result": [{"x": "*"}, {"x": "*"}, {"x": "*"}]}],
+    "msm_id": 5001, "prb_id": 6001, "timestamp": 1652100000, "msm_name": "Traceroute", "from": "84.1.2.3",
+    "type": "traceroute", "group_id": 5001, "stored_timestamp": 1652100020
+}
+
+# A hop with ICMP extension objects, serialized the way RIPE does: the 'result' list before the other fields.
+ICMPEXT_RESULT = {
+    "fw": 5020, "lts": 12, "endtime": 1652100012, "dst_name": "195.169.125.10", "dst_addr": "195.169.125.10",
+    "src_addr": "10.0.0.2", "proto": "ICMP", "af": 4, "size": 48, "paris_id": 1,
+    "result": [{"hop": 3, "result": [{"from": "62.40.98.1", "ttl": 252, "size": 140, "rtt": 8.2,
+                                      "icmpext": {"version": 2, "rfc4884": 1,
+                                                  "obj": [{"class": 1, "type": 1,
+                                                           "mpls": [{"exp": 0, "label": 24001, "s": 1,
+                                                                     "ttl": 1}]}]}}]}],
+    "msm_id": 5001, "prb_id": 6001, "timestamp": 1652100000, "msm_name": "Traceroute", "from": "84.1.2.3",
+    "type": "traceroute", "group_id": 5001, "stored_timestamp": 1652100020
+}
+
+
+class TestResultEnvelope(TestCase):
+    """ Test module for lazily decoded Streaming API results. """
+
+    def setUp(self):
+        self.raw = json.dumps(["atlas_result", TRACEROUTE_RESULT])
+
+    def test_scan_routing_fields(self):
+        """ The routing fields are read without decoding the result. """
+        envelope = ResultEnvelope.scan(self.raw)
+        self.assertEqual(envelope.msm_id, 5001)
+        self.assertEqual(envelope.prb_id, 6001)
+        self.assertEqual(envelope.timestamp, 1652100000)
+        self.assertEqual(envelope.type, "traceroute")
+        self.assertFalse(envelope.is_decoded)
+
+    def test_scan_nested_fields(self):
+        """ The 'type' of an ICMP extension object inside the hops is not the type of the result. """
+        for separators in [(", ", ": "), (",", ":")]:
+            envelope = ResultEnvelope.scan(json.dumps(["atlas_result", ICMPEXT_RESULT], separators=separators))
+            self.assertEqual((envelope.msm_id, envelope.prb_id, envelope.timestamp, envelope.type),
+                             (5001, 6001, 1652100000, "traceroute"))
+            self.assertFalse(envelope.is_decoded)
+        envelope = ResultEnvelope.scan(json.dumps(ICMPEXT_RESULT))
+        self.assertEqual(envelope.type, "traceroute")
+
+    def test_scan_brackets_in_strings(self):
+        """ Brackets inside strings make the scan lose track of the depth, the message is decoded instead. """
+        result = dict(ICMPEXT_RESULT, msm_name="Traceroute {")
+        result = {key: result[key] for key in ["msm_name", *ICMPEXT_RESULT]}
+        envelope = ResultEnvelope.scan(json.dumps(["atlas_result", result]))
+        self.assertEqual((envelope.msm_id, envelope.prb_id, envelope.type), (5001, 6001, "traceroute"))
+        self.assertTrue(envelope.is_decoded)
+
+    def test_decode(self):
+        """ Decoding returns the result (not the Streaming API message), and only parses it once. """
+        envelope = ResultEnvelope.scan(self.raw)
+        self.assertEqual(envelope.decode(), TRACEROUTE_RESULT)
+        self.assertIs(envelope.decode(), envelope.decode())
+        self.assertEqual(ResultEnvelope.scan(json.dumps(TRACEROUTE_RESULT)).decode(), TRACEROUTE_RESULT)
+
+    def test_scan_compact_json(self):
+        envelope = ResultEnvelope.scan(json.dumps(["atlas_result", TRACEROUTE_RESULT], separators=(",", ":")))
+        self.assertEqual((envelope.msm_id, envelope.prb_id, envelope.type), (5001, 6001, "traceroute"))
+
+    def test_routing(self):
+        """ A result is only decoded and passed on when a detection method of its measurement accepts it. """
+        stream = MeasurementResultStream.__new__(MeasurementResultStream)  # Do not connect to the Streaming API.
+        interested, not_interested = MagicMock(), MagicMock()
+        interested.accepts.return_value = True
+        not_interested.accepts.return_value = False
+        stream.measurement_id_to_measurement_type = {5001: MeasurementType.TRACEROUTE}
+        stream.measurement_type_to_detection_method = {MeasurementType.TRACEROUTE: [interested, not_interested]}
+        stream.on_raw_result(self.raw)
+        interested.on_result_response.assert_called_once_with(TRACEROUTE_RESULT)
+        not_interested.on_result_response.assert_not_called()
+
+        interested.reset_mock()
+        stream.on_raw_result(self.raw.replace('"msm_id": 5001', '"msm_id": 9999'))  # Not one of our measurements.
+        interested.accepts.assert_not_called()
+        interested.on_result_response.assert_not_called()
+
+    def test_malformed_message(self):
+        """ A message that cannot be processed is logged, the other messages of the batch are still processed. """
+        stream = MeasurementResultStream.__new__(MeasurementResultStream)  # Do not connect to the Streaming API.
+        method = MagicMock()
+        method.accepts.return_value = True
+        stream.measurement_id_to_measurement_type = {5001: MeasurementType.TRACEROUTE}
+        stream.measurement_type_to_detection_method = {MeasurementType.TRACEROUTE: [method]}
+        stream.detection_methods = []
+        with self.assertLogs('anomaly_detection_reworked.measurement_result_stream', level='ERROR'):
+            stream.process_batch(['["atlas_result", {"msm_id": 5001, "prb_id": 6001, "type": "tracer', self.raw])
+        method.on_result_response.assert_called_once_with(TRACEROUTE_RESULT)
@@ -0,0 +1,112 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from anomaly_detection.as_tools import TEST_DUMP, ASLookUp
+from anomaly_detection_reworked.anomaly_suppression import AnomalySuppression
+from anomaly_detection_reworked.detection_methods.route_change import RouteChange
+from anomaly_detection_reworked.path_fingerprints import FingerprintTable, as_path, fingerprint, ip_path
+from anomaly_detection_reworked.traceroute import NO_AS
+
+
+def traceroute(probe_id: int, timestamp: int, path: list, measurement_id: int = 1) -> dict:
+    """ A raw traceroute result to 193.0.0.1 (AS3333) over the given router IPs (None for hops without reply). """
+    hops = [{'hop': hop, 'result': [{'from': ip, 'rtt': float(hop)}] if ip else [{'x': '*'}]}
+            for hop, ip in enumerate(path + ['193.0.0.1'], start=1)]
+    return {'msm_id': measurement_id, 'prb_id': probe_id, 'timestamp': timestamp, 'type': 'traceroute', 'dst_addr': '193.0.0.1',
+            'result': hops}
+
+
+class TestRouteChange(TestCase):
+    """ Test module for the Route Change detection method. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.as_look_up = ASLookUp(os.path.join(cls.directory.name, "ris_snapshot.bin"), dump_files=[TEST_DUMP])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def test_paths(self):
+        """ Unknown and repeated ASes are left out of AS paths, fingerprints are stable integers. """
+        self.assertEqual(as_path([1103, NO_AS, 1103, 1105, 3333, 3333]), (1103, 1105, 3333))
+        self.assertEqual(ip_path([('10.0.0.1', 1.0), (None, None), ('10.0.0.2', 2.0)]), ('10.0.0.1', '10.0.0.2'))
+        self.assertEqual(fingerprint((1103, 1105, 3333)), fingerprint([1103, 1105, 3333]))
+        self.assertNotEqual(fingerprint((1103, 1105, 3333)), fingerprint((1103, 3333)))
+        self.assertLess(fingerprint(('10.0.0.1', '10.0.0.2')), 2 ** 64)
+
+    def test_fingerprint_table(self):
+        """ Paths become part of the baseline, only new paths after the warmup are reported, rows are bounded. """
+        table = FingerprintTable(slots=4, min_seen=3, warmup=10, capacity=1)
+        reports = [table.observe('probe', [11, 12][i % 2]) for i in range(20)]  # Two load balanced paths.
+        self.assertFalse(any(reports))
+        self.assertEqual(sorted(table.baseline('probe')), [11, 12])
+        self.assertEqual([table.observe('probe', 13) for _ in range(4)], [True, True, True, False])
+        for path in range(20, 40):  # More paths than slots.
+            table.observe('probe', path)
+        self.assertEqual(table.fingerprints.shape, (1, 4))
+        table.observe('other', 11)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.counts.shape, (2, 4))
+
+    def test_alert(self):
+        """ A route change is alerted once when many probes take a new path, with the new neighbour AS. """
+        detection_method = RouteChange(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = []
+        old_path = ['145.0.0.1', '145.100.4.1', None]
+        new_path = ['145.0.0.1', '145.100.0.1', None]
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in range(40):
+                for probe_id in range(10):
+                    path = new_path if step >= 30 and probe_id < 4 else old_path
+                    detection_method.on_result_response(traceroute(probe_id, 1651363200 + step * 240, path))
+        self.assertEqual([(alert['kind'], alert['asn']) for alert in alerts], [('as', 1104), ('ip', 1104)])
+        self.assertEqual(alerts[0]['affected_probes'], 2)
+        self.assertEqual(alerts[0]['anomaly_score'], 20.0)
+
+    def test_unresponsive_hops(self):
+        """ Hops that do not reply are left out of the IP path, so more or fewer of them is no route change. """
+        detection_method = RouteChange(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = []
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in range(40):
+                for probe_id in range(10):
+                    silent_hops = [None, None] if step >= 30 and probe_id < 4 else [None]
+                    path = ['145.0.0.1'] + silent_hops + ['145.100.4.1']
+                    detection_method.on_result_response(traceroute(probe_id, 1651363200 + step * 240, path))
+        self.assertEqual(alerts, [])
+
+    def test_idle_probes(self):
+        """ Probes without results in the agreement window are not counted in the anomaly score. """
+        detection_method = RouteChange(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = []
+        old_path = ['145.0.0.1', '145.100.4.1', None]
+        new_path = ['145.0.0.1', '145.100.0.1', None]
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in range(40):
+                for probe_id in range(20 if step < 25 else 6):  # 14 probes stop after step 24.
+                    path = new_path if step >= 32 and probe_id < 2 else old_path
+                    detection_method.on_result_response(traceroute(probe_id, 1651363200 + step * 240, path))
+        self.assertEqual([(alert['kind'], alert['anomaly_score']) for alert in alerts], [('as', 16.67), ('ip', 16.67)])
+        self.assertEqual(len(detection_method.measurement_probes[1]), 6)
+
+    def test_several_targets(self):
+        """ A probe measuring more anchors than a table has slots keeps a baseline per measurement, stable paths to
+            every target are never new. """
+        detection_method = RouteChange(as_look_up=self.as_look_up, suppression=AnomalySuppression())
+        alerts = []
+        with patch.object(detection_method, 'create_anomaly', side_effect=alerts.append):
+            for step in range(40):
+                for measurement_id in range(1, 11):
+                    path = ['145.0.0.1', '145.100.' + str(measurement_id) + '.1', None]
+                    for probe_id in range(10):
+                        detection_method.on_result_response(traceroute(probe_id, 1651363200 + step * 240, path,
+                                                                       measurement_id))
+        self.assertEqual(alerts, [])
+        self.assertEqual(len(detection_method.tables['ip']), 100)
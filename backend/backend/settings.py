@@ -177,3 +177,39 @@ NINJA_AUTH_ENABLED = False
 if 'test' in sys.argv:
     NINJA_AUTH_ENABLED = False
 
+# Onboarding of an autonomous system (see ripe_interface/onboarding.py)
+ONBOARDING_WORKERS = 8  # Maximum amount of concurrent requests to RIPE Atlas per onboarding job.
+ONBOARDING_RUN_IN_BACKGROUND = True
+# Run onboarding jobs inside the request when testing, so the test database transaction sees the results.
+if 'test' in sys.argv:
+    ONBOARDING_RUN_IN_BACKGROUND = False
+
+# Entry connection analysis (see anomaly_detection/parallel_analysis.py)
+ANALYSIS_WORKERS = None  # Worker processes, None for one per CPU.
+ANALYSIS_SERIAL_MAX_ROWS = 200000  # Measurements up to this amount are analyzed without worker processes.
+
+# Analysis of streamed results in micro-batches (see anomaly_detection/analysis_scheduler.py)
+ANALYSIS_BUCKET_MINUTES = 20  # A measurement is analyzed when its results reach a new bucket of this many minutes,
+ANALYSIS_MAX_PENDING = 5000  # or when this many of its results are waiting.
+
+# Snapshots of the state of the detection methods (see anomaly_detection_reworked/detector_state.py)
+DETECTOR_STATE_DIRECTORY = BASE_DIR / 'detector_state'
+DETECTOR_STATE_INTERVAL = 300  # Seconds between snapshots while the stream runs, they are also written at shutdown.
+DETECTOR_BACKFILL_MAX = 24 * 60 * 60  # Seconds of results requested after a restart to fill the gap since the snapshot.
+DETECTOR_BACKFILL_CHUNK = 60 * 60  # Seconds of results requested (and held in memory) at a time while backfilling.
+
+# Anchor Down (see anomaly_detection_reworked/detection_methods/anchor_down.py)
+ANCHOR_STATUS_EVENTS = True  # Follow the connection events of the anchors on the Streaming API.
+ANCHOR_POLL_INTERVAL = 30  # Seconds between checks of the probes API without connection events,
+ANCHOR_RECONCILE_INTERVAL = 15 * 60  # and with them, to catch up on events missed while disconnected.
+
+# Duplicate anomalies (see anomaly_detection_reworked/anomaly_suppression.py)
+ANOMALY_SUPPRESSION_TTL = 24 * 60 * 60  # Seconds the same anomaly is suppressed, unless a detection method sets another.
+
+# Buffered writing of anomalies (see anomaly_detection_reworked/anomaly_sink.py)
+ANOMALY_SINK_BATCH_SIZE = 500  # Anomalies are written together, at the latest when this many are waiting.
+ANOMALY_SINK_MAX_PENDING = 20 * ANOMALY_SINK_BATCH_SIZE  # Anomalies kept while the database is unavailable.
+ANOMALY_SINK_CACHE_IDS = True
+# Every test has its own rows, do not keep the ids of one test for the next.
+if 'test' in sys.argv:
+    ANOMALY_SINK_CACHE_IDS = False
@@ -0,0 +1,5 @@
+"""
+Benchmarks, run them from the backend directory, for example:
+
+    python -m benchmarks.bench_as_lookup
+"""
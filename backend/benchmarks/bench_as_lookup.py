@@ -0,0 +1,121 @@
+"""
+Benchmark of IP to AS lookups: a py-radix tree (search_best per IP, how ASLookUp used to work) against the
+prefix table, per IP and in batches, with and without the cache of ASLookUp. The batches are as large as the
+callers make them: one traceroute (clean_hops, the streaming detection methods) or a micro-batch of results.
+
+Uses the test dump by default, pass the path of a full riswhois dump to benchmark a real routing table:
+
+    python -m benchmarks.bench_as_lookup [riswhois dump file] [distinct router IPs]
+"""
+import functools
+import ipaddress
+import os
+import random
+import sys
+import tempfile
+import time
+
+import radix
+
+from anomaly_detection.as_tools import TEST_DUMP, ASLookUp, parse_ris_rows, read_ris_dump
+
+ROUTERS = 5_000  # Distinct router IPs seen in traceroutes.
+LOOKUPS = 200_000
+HOPS = 15  # Lookups per traceroute, clean_hops looks up one traceroute at a time.
+MICRO_BATCH = 500 * HOPS  # The hops of a batch of streamed results.
+REPEATS = 5  # The fastest run counts, single runs vary a lot on shared machines.
+
+
+def random_addresses(generator: random.Random, rows: list, routers_amount: int = ROUTERS) -> list:
+    """ Traceroutes pass the same routers over and over again: draw the lookups from a fixed set of router IPs. """
+    routers = []
+    for _ in range(routers_amount):
+        network = ipaddress.ip_network(generator.choice(rows)[1])
+        routers.append(str(network.network_address + generator.randrange(min(network.num_addresses, 2 ** 16))))
+    return [generator.choice(routers) for _ in range(LOOKUPS)]
+
+
+def timed(benchmarks: list) -> list:
+    """
+    Runs every benchmark, a (name, function, setup) tuple, REPEATS times and prints its fastest run. The benchmarks
+    take turns, so a slow moment of a shared machine does not hit one of them only. setup runs before every run of
+    its benchmark (for example to empty a cache). Returns the result of every benchmark.
+    """
+    fastest = [float('inf')] * len(benchmarks)
+    results = [None] * len(benchmarks)
+    for _ in range(REPEATS):
+        for position, (_, function, setup) in enumerate(benchmarks):
+            setup()
+            start = time.perf_counter()
+            results[position] = function()
+            fastest[position] = min(fastest[position], time.perf_counter() - start)
+    for (name, _, _), elapsed in zip(benchmarks, fastest):
+        print(f"{name:<42}{elapsed:>8.3f} s {LOOKUPS / elapsed:>12,.0f} lookups/s")
+    return results
+
+
+def main():
+    dump_file = sys.argv[1] if len(sys.argv) > 1 else TEST_DUMP
+    routers_amount = int(sys.argv[2]) if len(sys.argv) > 2 else ROUTERS
+    generator = random.Random(0)
+    rows = list(parse_ris_rows(read_ris_dump(dump_file)))
+    addresses = random_addresses(generator, rows, routers_amount)
+
+    tree = radix.Radix()
+    for asn, prefix in rows:
+        tree.add(prefix).data["asn"] = str(asn)
+
+    with tempfile.TemporaryDirectory() as directory:
+        as_look_up = ASLookUp(snapshot_path=os.path.join(directory, "ris_snapshot.bin"), dump_files=[dump_file])
+        table = as_look_up.table
+        print(f"{len(rows):,} prefixes, {LOOKUPS:,} lookups of {routers_amount:,} distinct IPs")
+
+        def radix_search_best():
+            nodes = (tree.search_best(ip) for ip in addresses)
+            return [None if node is None else node.data["asn"] for node in nodes]
+
+        def table_lookup():
+            return [table.lookup(ip) for ip in addresses]
+
+        def table_lookup_batch():
+            return table.lookup_batch(addresses)
+
+        def as_look_up_batch():
+            return as_look_up.get_as_batch(addresses)
+
+        def as_look_up_per_ip():
+            return [as_look_up.get_as(ip) for ip in addresses]
+
+        def as_look_up_batches(size: int):
+            asns = []
+            for start in range(0, LOOKUPS, size):
+                asns.extend(as_look_up.get_as_batch(addresses[start:start + size]))
+            return asns
+
+        def clear():
+            as_look_up.cache.cache_clear()
+
+        def warm():
+            clear()
+            as_look_up_batch()
+
+        def nothing():
+            pass
+
+        results = timed([
+            ("radix search_best (per IP)", radix_search_best, nothing),
+            ("prefix table lookup (per IP)", table_lookup, nothing),
+            ("prefix table lookup_batch", table_lookup_batch, nothing),
+            ("ASLookUp.get_as_batch (cold cache)", as_look_up_batch, clear),
+            ("ASLookUp.get_as_batch (warm cache)", as_look_up_batch, warm),
+            ("ASLookUp.get_as (per IP)", as_look_up_per_ip, clear),
+            (f"ASLookUp.get_as_batch ({HOPS} IPs per call)", functools.partial(as_look_up_batches, HOPS), clear),
+            (f"ASLookUp.get_as_batch ({MICRO_BATCH} IPs per call)", functools.partial(as_look_up_batches, MICRO_BATCH),
+             clear),
+        ])
+        expected = results[0]
+        for result in results[3:]:
+            assert result == expected, "The prefix table and the radix tree disagree."
+
+if __name__ == '__main__':
+    main()
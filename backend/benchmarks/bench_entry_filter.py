@@ -0,0 +1,61 @@
+"""
+Benchmark of the scoring of level shifts per entry AS (the filter step of the entry connection detection method):
+the loops over entry ASes and their probes against the grouped aggregations, for a day of measurements per probe
+with 10 probes per entry AS.
+
+    python -m benchmarks.bench_entry_filter [--loop-max-probes N]
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from anomaly_detection.entry_scoring import score_entry_ases
+from anomaly_detection.level_shift import detect_level_shifts
+from benchmarks.bench_level_shift import measurements, timed
+
+
+def loop_scores(df_outlier: pd.DataFrame) -> list:
+    """ The filter loops before they were vectorized (without the plot call). """
+    alerts = []
+    for as_num in df_outlier['entry_as'].unique():
+        single_as_df = df_outlier[df_outlier['entry_as'] == as_num]
+        probes_in_as = len(single_as_df['probe_id'].unique())
+        if probes_in_as > 4:
+            as_anomalies = single_as_df.groupby(pd.Grouper(
+                freq="20T", closed='right', convention='end'))["level_shift"].agg("sum")
+            score = round((as_anomalies[-3] / probes_in_as) * 100, 2)
+            if score > 10:
+                changes_in_rtt = []
+                for probe_id in single_as_df['probe_id'].unique():
+                    single_probe = single_as_df[single_as_df["probe_id"] == probe_id]
+                    if len(single_probe) > 4:
+                        changes_in_rtt.append(single_probe['entry_rtt'][-3] - single_probe['entry_rtt'][:-4].median())
+                alerts.append((as_anomalies.index[-3], as_num, score, sum(changes_in_rtt) / len(changes_in_rtt)))
+    return alerts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--loop-max-probes', type=int, default=10000)
+    arguments = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    for probes in (1000, 10000):
+        df = measurements(probes)
+        df['entry_ip'] = "192.0.2." + (df['probe_id'] % 250).astype(str)
+        df_outlier = detect_level_shifts(df)
+        print(f"{probes:,} probes, {df['entry_as'].nunique():,} entry ASes, {len(df):,} measurements")
+        alerts = timed("grouped aggregations", score_entry_ases, df_outlier)
+        if probes <= arguments.loop_max_probes:
+            expected = timed("loops", loop_scores, df_outlier)
+            assert [(alert['time'], alert['asn'], alert['anomaly_score']) for alert in alerts] == \
+                   [alert[:3] for alert in expected]
+            assert np.allclose([alert['mean_increase'] for alert in alerts], [alert[3] for alert in expected])
+        print(f"{len(alerts):,} alerting entry ASes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark of the level shift detection of the entry connection detection method: the per probe ADTK loop against
+the vectorized detection of all probes at once, for a day of measurements (one per 5 minutes) per probe.
+
+    python -m benchmarks.bench_level_shift [--adtk-max-probes N]
+
+The ADTK loop takes minutes at 10k probes, so it only runs up to 1k probes by default.
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from adtk.data import validate_series
+from adtk.detector import LevelShiftAD
+
+from anomaly_detection.level_shift import detect_level_shifts
+
+MEASUREMENTS_PER_PROBE = 288  # A day of measurements, one per 5 minutes.
+
+
+def measurements(probes: int, seed: int = 0) -> pd.DataFrame:
+    generator = np.random.default_rng(seed)
+    created = pd.date_range("2022-05-01", periods=MEASUREMENTS_PER_PROBE, freq="5T")
+    entry_rtt = generator.uniform(1, 50, (probes, 1)) + generator.normal(0, 1, (probes, MEASUREMENTS_PER_PROBE))
+    entry_rtt[generator.random(probes) < 0.1, -12:] += 100  # Some probes see a level shift during the last hour.
+    return pd.DataFrame({
+        "probe_id": np.repeat(np.arange(probes), MEASUREMENTS_PER_PROBE),
+        "created": np.tile(created, probes),
+        "entry_rtt": entry_rtt.ravel(),
+        "entry_as": np.repeat(generator.integers(0, probes // 10 + 1, probes), MEASUREMENTS_PER_PROBE),
+    })
+
+
+def adtk_level_shifts(df: pd.DataFrame) -> pd.DataFrame:
+    """ The per probe loop the entry connection detection method used before. """
+    level_shift = LevelShiftAD(c=10.0, side='positive', window=3)
+    df_outlier = pd.DataFrame()
+    for probe_id in df["probe_id"].unique():
+        single_probe = df[df["probe_id"] == probe_id].copy()
+        single_probe.set_index('created', inplace=True)
+        try:
+            single_probe["level_shift"] = level_shift.fit_detect(validate_series(single_probe['entry_rtt']))
+            df_outlier = pd.concat([df_outlier, single_probe])
+        except RuntimeError:
+            pass
+    return df_outlier
+
+
+def timed(name: str, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(f"{name:<40}{time.perf_counter() - start:>10.3f} s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--adtk-max-probes', type=int, default=1000)
+    arguments = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    for probes in (1000, 10000):
+        df = measurements(probes)
+        print(f"{probes:,} probes, {len(df):,} measurements")
+        df_outlier = timed("vectorized", detect_level_shifts, df)
+        if probes <= arguments.adtk_max_probes:
+            expected = timed("ADTK per probe", adtk_level_shifts, df)
+            assert np.array_equal(df_outlier['level_shift'].to_numpy(),
+                                  expected['level_shift'].astype(float).to_numpy(), equal_nan=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Benchmark of the level shift detection of the entry connection detection method with a growing amount of worker
+processes, for a day of measurements of 10k probes. Speed-ups need as many CPUs as workers.
+
+    python -m benchmarks.bench_parallel_analysis [--probes N] [--workers 1 2 4]
+"""
+import argparse
+import os
+import warnings
+
+from anomaly_detection.parallel_analysis import detect_level_shifts_parallel
+from benchmarks.bench_level_shift import measurements, timed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--probes', type=int, default=10000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    arguments = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    df = measurements(arguments.probes)
+    print(f"{arguments.probes:,} probes, {len(df):,} measurements, {os.cpu_count()} CPUs")
+    expected = None
+    for workers in arguments.workers:
+        df_outlier = timed(f"{workers} worker(s)", detect_level_shifts_parallel, df, workers, 0)
+        if expected is None:
+            expected = df_outlier
+        assert df_outlier.equals(expected)
+
+
+if __name__ == '__main__':
+    main()
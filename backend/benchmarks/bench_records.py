@@ -0,0 +1,103 @@
+"""
+Benchmark of the records made by the preprocessing of the entry connection detection method: a dict per hop and per
+result that are then copied into HopFormat and ProbeMeasurement objects with a __dict__ (how it used to work),
+against the slotted records made directly. Measures the allocations per result, the memory of the results waiting
+for the next analysis (ANALYSIS_MAX_PENDING of them) and the peak RSS of a process holding them.
+
+    python -m benchmarks.bench_records [--results N]
+"""
+import argparse
+import datetime
+import multiprocessing
+import resource
+import time
+import tracemalloc
+
+from anomaly_detection.format import HopFormat, ProbeMeasurement
+
+HOPS = 15  # Hops per traceroute.
+
+
+class LegacyProbeMeasurement:
+    def __init__(self, probe_id, created, entry_rtt, entry_ip, entry_as):
+        self.probe_id = probe_id
+        self.created = created
+        self.entry_rtt = entry_rtt
+        self.entry_ip = entry_ip
+        self.entry_as = entry_as
+
+
+class LegacyHopFormat:
+    def __init__(self, hop, ip, min_rtt, asn):
+        self.hop = hop
+        self.ip_address = ip
+        self.min_rtt = min_rtt
+        self.asn = asn
+
+
+def raw_hops(index: int) -> list:
+    return [(hop, f"10.{index % 250}.{hop}.1", 1.0 + hop + index % 7, str(1100 + hop)) for hop in range(1, HOPS + 1)]
+
+
+def legacy_result(index: int, created: datetime.datetime) -> tuple:
+    """ clean_hops made a dict per hop and preprocess a dict per result, the monitor copied them into objects. """
+    hops = [{'hop': hop, 'ip': ip, 'asn': asn, 'min_rtt': rtt} for hop, ip, rtt, asn in raw_hops(index)]
+    result = {'probe_id': index, 'created': created, 'entry_rtt': hops[-1]['min_rtt'], 'entry_ip': hops[-2]['ip'],
+              'entry_as': hops[-2]['asn']}
+    return LegacyProbeMeasurement(**result), [LegacyHopFormat(**hop) for hop in hops]
+
+
+def record_result(index: int, created: datetime.datetime) -> tuple:
+    hops = [HopFormat(hop, ip, rtt, asn) for hop, ip, rtt, asn in raw_hops(index)]
+    return ProbeMeasurement(index, created, hops[-1].min_rtt, hops[-2].ip_address, hops[-2].asn), hops
+
+
+VARIANTS = {'dicts and objects': legacy_result, 'slotted records': record_result}
+
+
+def hold(variant: str, results: int) -> int:
+    """ Makes and keeps the results in a fresh process, returns its peak RSS in KiB. """
+    created = datetime.datetime(2022, 5, 1)
+    kept = [VARIANTS[variant](index, created) for index in range(results)]
+    assert len(kept) == results
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--results', type=int, default=5000)
+    arguments = parser.parse_args()
+    created = datetime.datetime(2022, 5, 1)
+    context = multiprocessing.get_context('spawn')
+
+    print(f"{arguments.results:,} results of {HOPS} hops")
+    # Child processes start with the peak RSS of their parent, so they run before this process allocates anything.
+    with context.Pool(1) as pool:
+        empty_rss = pool.apply(hold, (next(iter(VARIANTS)), 0))
+    rss = {}
+    for variant in VARIANTS:
+        with context.Pool(1) as pool:
+            rss[variant] = pool.apply(hold, (variant, arguments.results)) - empty_rss
+
+    baseline = None
+    for variant, make in VARIANTS.items():
+        start = time.perf_counter()
+        for index in range(arguments.results):
+            make(index, created)
+        seconds = time.perf_counter() - start
+
+        tracemalloc.start()
+        kept = [make(index, created) for index in range(arguments.results)]
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+
+        per_result = peak / arguments.results
+        baseline = baseline or per_result
+        print(f"{variant:>18}: {seconds / arguments.results * 1e6:6.1f} us/result, "
+              f"{per_result:7.0f} bytes/result allocated ({per_result / baseline:.0%}), "
+              f"{held / 2 ** 20:6.1f} MiB held, peak RSS +{rss[variant] / 1024:6.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -101,15 +101,20 @@ class Tag(models.Model):
 
     @staticmethod
     def get_tag_ids(tags: dict) -> list[int]:
-        result: list[int] = []
-        for tag in tags:
-            if Tag.objects.filter(name=tag).exists():
-                result.append(Tag.objects.get(name=tag).id)
-            else:
-                tag_i = Tag.objects.create(name=tag)
-                tag_i.save()
-                result.append(tag_i.id)
-        return result
+        tag_ids = Tag.get_tag_id_map(tags)
+        return [tag_ids[tag] for tag in tags]
+
+    @staticmethod
+    def get_tag_id_map(tags) -> dict[str, int]:
+        """ Returns a dictionary (Key: tag name and Value: tag ID) for all given tag names. Missing tags are created
+            with a single insert, so the amount of queries does not depend on the amount of tags. """
+        names = set(tags)
+        tag_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        missing = names - tag_ids.keys()
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+            tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+        return tag_ids
 
 
 class MeasurementCollection(models.Model):
@@ -134,11 +139,7 @@ class MeasurementCollection(models.Model):
 
     @staticmethod
     def delete_all_by_asn(system: AutonomousSystem) -> None:
-        system_exist = MeasurementCollection.objects.filter(autonomous_system=system).exists()
-        if system_exist:
-            collections = MeasurementCollection.objects.all().filter(autonomous_system=system)
-            for x in collections:
-                x.delete()
+        MeasurementCollection.objects.filter(autonomous_system=system).delete()
 
 
 class Probe(models.Model):
@@ -1,3 +1,5 @@
+from django.db import transaction
+
 from database.models import MeasurementCollection, AutonomousSystem, Tag
 
 
@@ -60,3 +62,26 @@ class AnchoringMeasurement:
         measurement_collection.tags.set(tags)
         measurement_collection.save()
 
+
+    @staticmethod
+    def save_all_to_database(measurements: list['AnchoringMeasurement'], system: AutonomousSystem) -> int:
+        """ Replaces all measurement collections of the autonomous system with the given measurements.
+            Everything is written in one transaction with bulk inserts: one query for the tags, one for the
+            collections and one for the tag relations, no matter how many measurements there are.
+            Returns the amount of measurement collections saved. """
+        unique_measurements = {measurement.id: measurement for measurement in measurements}.values()
+        tag_ids = Tag.get_tag_id_map(tag for measurement in unique_measurements for tag in measurement.tags)
+        with transaction.atomic():
+            MeasurementCollection.delete_all_by_asn(system=system)
+            MeasurementCollection.objects.bulk_create([
+                MeasurementCollection(autonomous_system=system, type=measurement.type, target=measurement.target,
+                                      measurement_id=measurement.id, description=measurement.description)
+                for measurement in unique_measurements])
+            # Not every database backend returns primary keys from a bulk insert, so look them up in one query.
+            collection_ids = dict(MeasurementCollection.objects.filter(autonomous_system=system)
+                                  .values_list('measurement_id', 'id'))
+            through = MeasurementCollection.tags.through
+            through.objects.bulk_create([
+                through(measurementcollection_id=collection_ids[measurement.id], tag_id=tag_ids[tag])
+                for measurement in unique_measurements for tag in set(measurement.tags)])
+        return len(collection_ids)
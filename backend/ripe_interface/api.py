@@ -7,11 +7,11 @@ from django.utils import timezone
 from ninja import Router, Path
 from ninja.pagination import paginate, PageNumberPagination
 from ninja.security import django_auth
-import threading
 
-from anomaly_detection.monitor_manager import MonitorManager
 from database.models import AutonomousSystem, Setting, MeasurementCollection, Anomaly, MeasurementType, DetectionMethod, Tag
-from ripe_interface.api_schemas import AutonomousSystemSetting, ASNumber, AutonomousSystemSetting2, AnomalyOut
+from ripe_interface.api_schemas import AutonomousSystemSetting, ASNumber, AutonomousSystemSetting2, AnomalyOut, \
+    OnboardingJobOut
+from ripe_interface.onboarding import start_onboarding, get_onboarding_job
 from ripe_interface.ripe_requests import RipeRequests
 
 anomaly_router = Router()
@@ -75,7 +75,8 @@ def get_autonomous_system_setting(request):
 @settings_router.put("/{as_number}", response=AutonomousSystemSetting, tags=[ASN_SETTINGS_TAG])
 def set_autonomous_system_setting(request, asn: ASNumber = Path(...)):
     """To monitor a specific Autonomous System, we'll first need a valid Autonomous
-    System Number (ASN). This endpoint validates and saves the ASN configuration in the database.  """
+    System Number (ASN). This endpoint validates and saves the ASN configuration in the database.
+    The anchoring measurements are collected by a background job, use the returned job ID to follow its progress.  """
     asn_name = "ASN" + str(asn.value)
     username = get_username(request)
     if not RipeRequests.autonomous_system_exist(asn.value):
@@ -101,17 +102,18 @@ def set_autonomous_system_setting(request, asn: ASNumber = Path(...)):
                              "message:": "User '" + username + "' settings is missing!"}, status=400)
 
     autonomous_system = AutonomousSystem.register_asn(setting=setting, system_number=asn.value, location=asn_location)
-    MeasurementCollection.delete_all_by_asn(system=autonomous_system)
-    for anchor in anchors:
-        measurements = RipeRequests.get_anchoring_measurements(anchor.ip_v4)
-        for measurement in measurements:
-            measurement.save_to_database(system=autonomous_system)
-
-    mesh_tag = Tag.objects.get(name="mesh")
-    measurements_list = MeasurementCollection.objects.filter(autonomous_system=autonomous_system, type="traceroute", tags=mesh_tag.id)
-    thread = threading.Thread(target=MonitorManager, args=(measurements_list,), daemon=True)
-    thread.start()
-    print("Starting new thread!")
-    
-    
-    return JsonResponse({"monitoring_possible": True, "host": asn_location, "message": "Success!"}, status=200)
+    job = start_onboarding(autonomous_system=autonomous_system, anchors=anchors)
+    return JsonResponse({"monitoring_possible": True, "host": asn_location, "message": "Success!",
+                         "job_id": job.id}, status=200)
+
+
+@settings_router.get("/onboarding/{job_id}", response=OnboardingJobOut, tags=[ASN_SETTINGS_TAG])
+def get_onboarding_status(request, job_id: str):
+    """Retrieve the progress of an onboarding job. The job ID is returned when the ASN configuration is saved.  """
+    job = get_onboarding_job(job_id)
+    if job is None:
+        return JsonResponse({"message": "Onboarding job '" + job_id + "' not found!"}, status=404)
+    return JsonResponse({"job_id": job.id, "status": job.status.value,
+                         "autonomous_system": "ASN" + str(job.autonomous_system.number),
+                         "anchors_total": job.anchors_total, "anchors_done": job.anchors_done,
+                         "measurements_saved": job.measurements_saved, "message": job.message}, status=200)
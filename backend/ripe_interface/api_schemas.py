@@ -11,6 +11,19 @@ class AutonomousSystemSetting(Schema):
                                    description="Whether it is possible or not to monitor the given autonomous system.")
     host: str = Field("VODANET - Vodafone GmbH", description="Hostname of the autonomous system.")
     message: str = Field("Success!", description="Response from the server.")
+    job_id: Optional[str] = Field("0f1e2d3c4b5a69788796a5b4c3d2e1f0",
+                                  description="ID of the onboarding job, use it to follow the progress of the "
+                                              "onboarding.")
+
+
+class OnboardingJobOut(Schema):
+    job_id: str = Field("0f1e2d3c4b5a69788796a5b4c3d2e1f0", description="ID of the onboarding job.")
+    status: str = Field("running", description="Status of the job: pending, running, finished or failed.")
+    autonomous_system: str = Field("ASN1103", description="The autonomous system that is being onboarded.")
+    anchors_total: int = Field(12, description="Amount of anchors in the autonomous system.")
+    anchors_done: int = Field(5, description="Amount of anchors of which the measurements have been retrieved.")
+    measurements_saved: int = Field(0, description="Amount of measurement collections saved to the database.")
+    message: str = Field("Retrieving anchoring measurements.", description="Progress message of the job.")
 
 
 class AutonomousSystemSetting2(Schema):
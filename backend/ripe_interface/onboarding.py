@@ -0,0 +1,128 @@
+"""
+Onboarding of an autonomous system.
+
+Collecting the anchoring measurements of every anchor in an autonomous system takes one request per anchor, which is
+too slow to do inside an HTTP request for large autonomous systems. An OnboardingJob does this work in the background:
+the per-anchor requests are sent concurrently and all measurement collections are written in bulk afterwards.
+The progress of a job can be followed through the settings API.
+"""
+import enum
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+from django import db
+from django.utils import timezone
+
+from backend.settings import ONBOARDING_WORKERS, ONBOARDING_RUN_IN_BACKGROUND
+from database.models import AutonomousSystem, MeasurementCollection
+from ripe_interface.anchor import Anchor, AnchoringMeasurement
+from ripe_interface.ripe_requests import RipeRequests
+
+MAX_JOBS_KEPT = 100
+
+
+class OnboardingStatus(enum.Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+
+class OnboardingJob:
+
+    def __init__(self, autonomous_system: AutonomousSystem, anchors: list[Anchor]):
+        self.id = uuid.uuid4().hex
+        self.autonomous_system = autonomous_system
+        self.anchors = anchors
+        self.status = OnboardingStatus.PENDING
+        self.anchors_total = len(anchors)
+        self.anchors_done = 0
+        self.measurements_saved = 0
+        self.message = "Waiting to be started."
+        self.created = timezone.now()
+        self.finished = None
+
+    def __str__(self) -> str:
+        return "Onboarding job (" + self.id + ") - ASN" + str(self.autonomous_system.number) + ": " + \
+               self.status.value
+
+    @property
+    def is_done(self) -> bool:
+        return self.status in (OnboardingStatus.FINISHED, OnboardingStatus.FAILED)
+
+    def run(self) -> None:
+        """ Retrieves the anchoring measurements of all anchors concurrently, saves them in bulk and starts
+            monitoring the mesh measurements. Any error marks the job as failed instead of killing the thread. """
+        self.status = OnboardingStatus.RUNNING
+        self.message = "Retrieving anchoring measurements."
+        try:
+            measurements = self.collect_measurements()
+            self.message = "Saving measurement collections."
+            self.measurements_saved = AnchoringMeasurement.save_all_to_database(measurements, self.autonomous_system)
+            self.start_monitoring()
+            self.status = OnboardingStatus.FINISHED
+            self.message = "Success!"
+        except Exception as exception:
+            self.status = OnboardingStatus.FAILED
+            self.message = "Onboarding failed: " + str(exception)
+            print(self.message)
+        finally:
+            self.finished = timezone.now()
+            if ONBOARDING_RUN_IN_BACKGROUND:
+                db.connection.close()  # Each thread gets its own database connection, do not leak it.
+
+    def collect_measurements(self) -> list[AnchoringMeasurement]:
+        """ Sends one request per anchor, at most ONBOARDING_WORKERS at the same time. """
+        measurements: list[AnchoringMeasurement] = []
+        if self.anchors_total == 0:
+            return measurements
+        workers = min(ONBOARDING_WORKERS, self.anchors_total)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="onboarding") as executor:
+            futures = [executor.submit(RipeRequests.get_anchoring_measurements, anchor.ip_v4)
+                       for anchor in self.anchors]
+            for future in as_completed(futures):
+                measurements.extend(future.result())
+                self.anchors_done += 1
+        return measurements
+
+    def start_monitoring(self) -> None:
+        from anomaly_detection.monitor_manager import MonitorManager
+        measurements_list = MeasurementCollection.objects.filter(autonomous_system=self.autonomous_system,
+                                                                 type="traceroute", tags__name="mesh")
+        thread = threading.Thread(target=MonitorManager, args=(measurements_list,), daemon=True)
+        thread.start()
+        print("Starting new thread!")
+
+
+_jobs: dict[str, OnboardingJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def start_onboarding(autonomous_system: AutonomousSystem, anchors: list[Anchor]) -> OnboardingJob:
+    """ Starts onboarding the autonomous system, or returns the job that is already onboarding it.
+        When ONBOARDING_RUN_IN_BACKGROUND is disabled (while testing) the job runs before this function returns. """
+    with _jobs_lock:
+        for job in _jobs.values():
+            if job.autonomous_system.id == autonomous_system.id and not job.is_done:
+                return job
+        job = OnboardingJob(autonomous_system=autonomous_system, anchors=anchors)
+        _jobs[job.id] = job
+        _forget_old_jobs()
+    if ONBOARDING_RUN_IN_BACKGROUND:
+        threading.Thread(target=job.run, name=str(job), daemon=True).start()
+    else:
+        job.run()
+    return job
+
+
+def get_onboarding_job(job_id: str) -> Optional[OnboardingJob]:
+    return _jobs.get(job_id)
+
+
+def _forget_old_jobs() -> None:
+    """ Only the most recent MAX_JOBS_KEPT jobs are remembered, jobs that are still running are never forgotten. """
+    finished_jobs = [job for job in _jobs.values() if job.is_done]
+    for job in finished_jobs[:max(0, len(_jobs) - MAX_JOBS_KEPT)]:
+        del _jobs[job.id]
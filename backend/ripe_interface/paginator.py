@@ -0,0 +1,65 @@
+"""
+Lazy pagination of RIPE Atlas list endpoints.
+
+RIPE Atlas returns list endpoints (anchors, probes, measurements, ...) in pages of the form
+{"count": ..., "next": <url or null>, "previous": ..., "results": [...]}. paginate() turns such an endpoint into a
+generator of results: the next page is requested in the background while the results of the current page are being
+processed, and nothing after the current page is requested when the caller stops iterating. A prefetch that is
+still running when the caller stops is waited for and its page is thrown away, so it never outlives the generator.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+from ripe_interface.ripe_client import RipeClient, ripe_client
+
+DEFAULT_PAGE_SIZE = 500  # The largest page size RIPE Atlas accepts.
+
+
+def paginate(url: str, params: Optional[dict] = None, fields: Optional[str] = None,
+             page_size: int = DEFAULT_PAGE_SIZE, prefetch: bool = True,
+             client: Optional[RipeClient] = None) -> Iterator[dict]:
+    """
+    Yields every result of a RIPE Atlas list endpoint, following the 'next' links lazily.
+
+    Parameters:
+            url (str): URL of the list endpoint, for example PROBES_URL.
+            params (dict): Query parameters (filters) of the first request.
+            fields (str): Comma separated fields to request, keeps the payload small. None requests the default fields.
+            page_size (int): Amount of results per page.
+            prefetch (bool): Request the next page while the current page is being processed.
+            client (RipeClient): Client that sends the requests, the shared ripe_client by default.
+
+    Returns:
+            results (Iterator[dict]): The results of all pages, in order.
+    """
+    params = dict(params or {})
+    params['page_size'] = page_size
+    if fields is not None:
+        params['fields'] = fields
+
+    client = client if client is not None else ripe_client
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="paginator") if prefetch else None
+    try:
+        page = get_page(url, params, client)
+        while page is not None:
+            next_url = page.get('next')
+            # The 'next' link already contains all query parameters.
+            next_page = None
+            if next_url and executor is not None:
+                next_page = executor.submit(get_page, next_url, None, client)
+            for result in page.get('results') or []:
+                yield result
+            if not next_url:
+                return
+            page = next_page.result() if next_page is not None else get_page(next_url, None, client)
+    finally:
+        if executor is not None:
+            # Cancels a prefetch that has not started and waits for one that has, its page (or error) is discarded.
+            # Otherwise the request would keep running after the caller stopped, and identical requests sent later
+            # would join it through the single flight of the client.
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_page(url: str, params: Optional[dict], client: RipeClient) -> dict:
+    """ Requests a single page of a list endpoint. """
+    return client.get_json(url, params=params)
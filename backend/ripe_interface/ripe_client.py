@@ -0,0 +1,166 @@
+"""
+Shared HTTP client for the RIPE Atlas and RIPEstat APIs.
+
+All GET requests to RIPE go through one RipeClient (ripe_client), which does two things:
+ - Identical requests that are sent at the same time (same URL and parameters) are merged into one request, every
+   caller receives the same (shared, do not modify it) JSON result. This is called single flight.
+ - Every endpoint has a token bucket, so we never send more than its rate per second. Requests that exceed the rate
+   wait in line instead of failing, and a '429 Too Many Requests' response is retried after waiting. Server errors
+   (5xx) are retried as well. Other error responses, and a request that still fails after MAX_RETRIES retries, raise
+   requests.HTTPError: the body of an error response is never returned as data.
+"""
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future
+from typing import Callable, Hashable, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+DEFAULT_RATE = 10.0  # Requests per second per endpoint.
+DEFAULT_BURST = 20  # Amount of requests that may be sent at once before the rate applies.
+ENDPOINT_RATES = {
+    "stat.ripe.net": (4.0, 8),
+}
+REQUEST_TIMEOUT = 30  # Seconds.
+MAX_RETRIES = 5  # Retries after a '429 Too Many Requests' or a server error response.
+RETRY_BACKOFF = 1.0  # Seconds before the first retry of a server error without Retry-After, doubled every retry.
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """ Allows 'rate' acquisitions per second with bursts of at most 'capacity'. Callers that are over the rate
+        reserve a future token and sleep until it is available, so they are served in the order they arrived. """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """ Takes one token, waiting if necessary. Returns the amount of seconds waited. """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1  # A negative amount of tokens means other callers are already waiting.
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """ Makes every caller wait at least the given amount of seconds, used when RIPE asks us to slow down. """
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class SingleFlight:
+    """ Merges concurrent calls with the same key into one call, every caller receives the same result. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, function: Callable):
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(function())
+        except BaseException as exception:
+            future.set_exception(exception)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return future.result()
+
+
+class RipeClient:
+
+    def __init__(self, default_rate: float = DEFAULT_RATE, default_burst: int = DEFAULT_BURST,
+                 endpoint_rates: Optional[dict] = None):
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.endpoint_rates = ENDPOINT_RATES if endpoint_rates is None else endpoint_rates
+        self.buckets: dict[str, TokenBucket] = {}
+        self.buckets_lock = threading.Lock()
+        self.single_flight = SingleFlight()
+        self.session = requests.Session()
+
+    def get_json(self, url: str, params: Optional[dict] = None) -> dict:
+        """ Sends a GET request and returns the decoded JSON response. Concurrent identical requests share one
+            request and one result. """
+        key = (url, tuple(sorted((str(k), str(v)) for k, v in (params or {}).items())))
+        return self.single_flight.do(key, lambda: self.request(url, params))
+
+    def request(self, url: str, params: Optional[dict] = None) -> dict:
+        bucket = self.get_bucket(url)
+        for retry in range(MAX_RETRIES + 1):
+            bucket.acquire()
+            response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            if retry == MAX_RETRIES or (response.status_code != 429 and response.status_code < 500):
+                break
+            if response.status_code == 429:
+                retry_after = self.retry_after(response, 1.0)
+                logger.warning("RIPE rate limit reached for %s, retrying in %s seconds.", url, retry_after)
+                bucket.pause(retry_after)  # Every request to the endpoint waits, not only this one.
+            else:
+                retry_after = self.retry_after(response, RETRY_BACKOFF * 2 ** retry)
+                logger.warning("RIPE answered %s for %s, retrying in %s seconds.", response.status_code, url,
+                               retry_after)
+                time.sleep(retry_after)
+        response.raise_for_status()  # Do not hand the body of an error response to the caller as data.
+        return response.json()
+
+    @staticmethod
+    def retry_after(response: requests.Response, default: float) -> float:
+        """ Returns the seconds to wait from the Retry-After header, which is either an amount of seconds or an
+            HTTP date. The default is used when the header is missing or invalid. """
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return default
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return default
+
+    def get_bucket(self, url: str) -> TokenBucket:
+        endpoint = self.get_endpoint(url)
+        with self.buckets_lock:
+            bucket = self.buckets.get(endpoint)
+            if bucket is None:
+                host = endpoint.split("/")[0]
+                rate, burst = self.endpoint_rates.get(endpoint) or self.endpoint_rates.get(host) or \
+                    (self.default_rate, self.default_burst)
+                bucket = TokenBucket(rate=rate, capacity=burst)
+                self.buckets[endpoint] = bucket
+        return bucket
+
+    @staticmethod
+    def get_endpoint(url: str) -> str:
+        """ Returns the endpoint a URL belongs to: the host and the resource, for example
+            'atlas.ripe.net/probes' for https://atlas.ripe.net/api/v2/probes/123/ and
+            'stat.ripe.net/as-overview' for https://stat.ripe.net/data/as-overview/data.json. """
+        parts = urlsplit(url)
+        path = [part for part in parts.path.split("/") if part]
+        if path[:2] == ["api", "v2"] or path[:1] == ["data"]:
+            path = path[2:] if path[0] == "api" else path[1:]
+        return parts.netloc + "/" + (path[0] if path else "")
+
+
+ripe_client = RipeClient()
@@ -1,6 +1,6 @@
-import requests
-
 from ripe_interface.anchor import AnchoringMeasurement, Anchor
+from ripe_interface.paginator import paginate
+from ripe_interface.ripe_client import ripe_client
 
 # from .anchor import Anchor
 # "RIPE API URLS"
@@ -29,22 +29,13 @@ class RipeRequests:
         """Returns all anchors based on the autonomous system number, if empty then there have been no anchors found.
            Disclaimer: Not all autonomous systems contain anchors, some contain probes only."""
         params = {"as_v4": str(as_number)}
-        response = requests.get(url=ANCHORS_URL, params=params).json()
-        results = response.get('results')  # There are multiple anchors.
-        if not results:
-            return []
-        else:
-            anchor_array = []
-            for x in results:
-                anchor = Anchor(**x)
-                anchor_array.append(anchor)
-        return anchor_array
+        return [Anchor(**x) for x in paginate(ANCHORS_URL, params)]  # There are multiple anchors (and pages).
 
     @staticmethod
     def autonomous_system_exist(as_number: int) -> bool:
         """Returns whether the autonomous system number exists or not. """
         params = {"asn_v4": str(as_number)}
-        response = requests.get(url=PROBES_URL, params=params).json()
+        response = ripe_client.get_json(PROBES_URL, params=params)
         probes_amount = response.get('count')
         return not probes_amount == 0
 
@@ -58,24 +49,26 @@ class RipeRequests:
         params = {
             'tags': 'anchoring',
             'status': 'ongoing',
-            'target_ip': target_address,
-            'fields': WANTED_ANCHOR_MEASUREMENT_FIELDS
+            'target_ip': target_address
         }
-        response = requests.get(MEASUREMENTS_URL, params=params).json()
-        results = response.get('results')
-        measurements = []
-        for x in results:
-            anchor_measurement = AnchoringMeasurement(**x)
-            measurements.append(anchor_measurement)
-        return measurements
+        results = paginate(MEASUREMENTS_URL, params, fields=WANTED_ANCHOR_MEASUREMENT_FIELDS)
+        return [AnchoringMeasurement(**x) for x in results]
 
     @staticmethod
     def get_company_name(as_number: int) -> str:
         """ Returns the company name of an autonomous system. """
         company: str = ""
         params = {"resource": str(as_number)}
-        response = requests.get(url=RIPE_STATS_ASN, params=params).json()
+        response = ripe_client.get_json(RIPE_STATS_ASN, params=params)
         results = response.get('data')
         if results['holder']:
             company = results['holder']
         return company
+
+    @staticmethod
+    def get_neighbours(as_number: int) -> set[int]:
+        """ Returns the AS numbers of the neighbours of an autonomous system, as seen in BGP by RIPEstat. """
+        params = {"resource": str(as_number)}
+        response = ripe_client.get_json(RIPE_STATS_ASN_NEIGHBOURS, params=params)
+        neighbours = (response.get('data') or {}).get('neighbours') or []
+        return {int(neighbour['asn']) for neighbour in neighbours}
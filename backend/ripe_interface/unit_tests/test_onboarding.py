@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase, Client
+
+from database.models import Setting, AutonomousSystem, MeasurementCollection, Tag
+from ripe_interface.anchor import AnchoringMeasurement
+from ripe_interface.onboarding import start_onboarding, OnboardingStatus, OnboardingJob
+
+
+def fake_anchoring_measurements(target_address: str) -> list[AnchoringMeasurement]:
+    """ Every anchor has a ping and a traceroute measurement, the ids are derived from the last digit of the ip. """
+    number = int(target_address.split(".")[-1])
+    return [AnchoringMeasurement(id=number * 10, type="ping", interval=240, target=target_address,
+                                 description="Anchoring Mesh Measurement: Ping IPv4 for anchor", tags=["anchoring",
+                                                                                                       "mesh"]),
+            AnchoringMeasurement(id=number * 10 + 1, type="traceroute", interval=900, target=target_address,
+                                 description="Anchoring Mesh Measurement: Traceroute IPv4 for anchor",
+                                 tags=["anchoring", "mesh", "ipv4"])]
+
+
+@patch.object(OnboardingJob, 'start_monitoring')
+@patch('ripe_interface.onboarding.RipeRequests.get_anchoring_measurements', side_effect=fake_anchoring_measurements)
+class OnboardingJobTest(TestCase):
+    """ Test module for the onboarding job of an autonomous system. """
+
+    def setUp(self):
+        user = User.objects.create_superuser(username="admin", email="admin@ripe.net", password="password")
+        setting = Setting.objects.create(user=user)
+        self.system = AutonomousSystem.objects.create(setting=setting, number=1103, name="SURFNET-NL - SURF B.V.")
+        self.anchors = [SimpleNamespace(ip_v4="10.0.0." + str(i)) for i in range(1, 6)]
+
+    def test_onboarding_saves_all_measurements(self, get_measurements, start_monitoring):
+        """ All 5 anchors are requested and their 10 measurements are saved with the correct tags. """
+        job = start_onboarding(autonomous_system=self.system, anchors=self.anchors)
+        self.assertEqual(job.status, OnboardingStatus.FINISHED)
+        self.assertEqual(get_measurements.call_count, 5)
+        self.assertEqual(job.anchors_done, 5)
+        self.assertEqual(job.measurements_saved, 10)
+        self.assertEqual(MeasurementCollection.objects.filter(autonomous_system=self.system).count(), 10)
+        traceroute = MeasurementCollection.objects.get(measurement_id=31)
+        self.assertCountEqual(traceroute.tags.values_list('name', flat=True), ["anchoring", "mesh", "ipv4"])
+        self.assertEqual(Tag.objects.count(), 3)
+        start_monitoring.assert_called_once()
+
+    def test_onboarding_replaces_old_measurements(self, get_measurements, start_monitoring):
+        """ Onboarding the same autonomous system twice replaces the measurement collections. """
+        start_onboarding(autonomous_system=self.system, anchors=self.anchors)
+        start_onboarding(autonomous_system=self.system, anchors=self.anchors[:2])
+        self.assertEqual(MeasurementCollection.objects.filter(autonomous_system=self.system).count(), 4)
+
+    def test_onboarding_failure_is_reported(self, get_measurements, start_monitoring):
+        """ A failing request marks the job as failed instead of raising. """
+        get_measurements.side_effect = ConnectionError("RIPE Atlas is unreachable")
+        job = start_onboarding(autonomous_system=self.system, anchors=self.anchors)
+        self.assertEqual(job.status, OnboardingStatus.FAILED)
+        self.assertIn("RIPE Atlas is unreachable", job.message)
+        start_monitoring.assert_not_called()
+
+    def test_onboarding_status_endpoint(self, get_measurements, start_monitoring):
+        """ The status endpoint reports the progress of a job, and a 404 for unknown jobs. """
+        job = start_onboarding(autonomous_system=self.system, anchors=self.anchors)
+        client = Client()
+        response = client.get('/api/settings/onboarding/' + job.id)
+        result = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(result.get('status'), "finished")
+        self.assertEqual(result.get('autonomous_system'), "ASN1103")
+        self.assertEqual(result.get('anchors_total'), 5)
+        self.assertEqual(result.get('measurements_saved'), 10)
+        response = client.get('/api/settings/onboarding/unknown')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,61 @@
+import responses
+from django.test import TestCase
+
+from ripe_interface.paginator import paginate
+from ripe_interface.ripe_client import RipeClient
+
+PROBES_URL = "https://atlas.ripe.net/api/v2/probes/"
+
+
+class PaginatorTest(TestCase):
+    """ Test module for the lazy paginator of RIPE Atlas list endpoints. The RIPE Atlas API is mocked with 3 pages
+        of 2 probes each. Every test has its own client, so no request is shared between tests. """
+
+    def setUp(self):
+        self.client = RipeClient()
+        self.pages = []
+        for page in range(1, 4):
+            next_url = PROBES_URL + "?asn_v4=1103&page_size=2&page=" + str(page + 1) if page < 3 else None
+            self.pages.append({"count": 6, "next": next_url, "previous": None,
+                               "results": [{"id": page * 10 + 1}, {"id": page * 10 + 2}]})
+
+    def add_pages(self):
+        responses.add(responses.GET, PROBES_URL, json=self.pages[0],
+                      match=[responses.matchers.query_param_matcher({"asn_v4": "1103", "page_size": "2",
+                                                                     "fields": "id"})])
+        for page in range(1, 3):
+            responses.add(responses.GET, PROBES_URL, json=self.pages[page],
+                          match=[responses.matchers.query_param_matcher({"asn_v4": "1103", "page_size": "2",
+                                                                         "page": str(page + 1)})])
+
+    @responses.activate
+    def test_paginate_all_pages(self):
+        """ All results of all pages are returned in order, the fields projection is sent with the first request. """
+        self.add_pages()
+        probes = list(paginate(PROBES_URL, {"asn_v4": 1103}, fields="id", page_size=2, client=self.client))
+        self.assertEqual([probe["id"] for probe in probes], [11, 12, 21, 22, 31, 32])
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_paginate_without_prefetch(self):
+        """ Disabling prefetching gives the same results. """
+        self.add_pages()
+        probes = list(paginate(PROBES_URL, {"asn_v4": 1103}, fields="id", page_size=2, prefetch=False,
+                               client=self.client))
+        self.assertEqual(len(probes), 6)
+
+    @responses.activate
+    def test_paginate_stop_early(self):
+        """ Stopping after the first result never requests the third page. """
+        self.add_pages()
+        results = paginate(PROBES_URL, {"asn_v4": 1103}, fields="id", page_size=2, client=self.client)
+        self.assertEqual(next(results)["id"], 11)
+        results.close()
+        self.assertLessEqual(len(responses.calls), 2)
+        self.assertEqual(self.client.single_flight.in_flight, {})  # The prefetch is finished or cancelled.
+
+    @responses.activate
+    def test_paginate_empty(self):
+        """ An endpoint without results (or an error response) returns nothing. """
+        responses.add(responses.GET, PROBES_URL, json={"detail": "Not found."})
+        self.assertEqual(list(paginate(PROBES_URL, {"asn_v4": 0}, client=self.client)), [])
@@ -0,0 +1,112 @@
+import threading
+import time
+from email.utils import formatdate
+
+import requests
+import responses
+from django.test import TestCase
+
+from ripe_interface.ripe_client import MAX_RETRIES, RipeClient, TokenBucket
+
+MEASUREMENT_URL = "https://atlas.ripe.net/api/v2/measurements/1001/"
+
+
+class RipeClientTest(TestCase):
+    """ Test module for the shared RIPE client: single flight, rate limiting and retrying. """
+
+    @responses.activate
+    def test_concurrent_identical_requests_are_merged(self):
+        """ 8 threads ask for the same measurement at once, only one request is sent and all share the result. """
+        def slow_response(request):
+            time.sleep(0.2)
+            return 200, {}, '{"id": 1001, "target_asn": 1103}'
+
+        responses.add_callback(responses.GET, MEASUREMENT_URL, callback=slow_response)
+        client = RipeClient()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.get_json(MEASUREMENT_URL)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    @responses.activate
+    def test_sequential_requests_are_not_cached(self):
+        """ Single flight only merges requests that are in flight at the same time. """
+        responses.add(responses.GET, MEASUREMENT_URL, json={"id": 1001})
+        client = RipeClient()
+        client.get_json(MEASUREMENT_URL)
+        client.get_json(MEASUREMENT_URL)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_too_many_requests_is_retried(self):
+        """ A '429 Too Many Requests' response is waited for and retried instead of returned. """
+        responses.add(responses.GET, MEASUREMENT_URL, status=429, headers={"Retry-After": "0"})
+        responses.add(responses.GET, MEASUREMENT_URL, json={"id": 1001})
+        self.assertEqual(RipeClient().get_json(MEASUREMENT_URL), {"id": 1001})
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_retries_exhausted(self):
+        """ When every retry is answered with '429 Too Many Requests' an HTTPError is raised, the body of the error
+            response is not returned as data. """
+        responses.add(responses.GET, MEASUREMENT_URL, status=429, headers={"Retry-After": "0"},
+                      json={"detail": "Too many requests."})
+        with self.assertLogs('ripe_interface.ripe_client', level='WARNING'):
+            with self.assertRaises(requests.HTTPError):
+                RipeClient().get_json(MEASUREMENT_URL)
+        self.assertEqual(len(responses.calls), MAX_RETRIES + 1)
+
+    @responses.activate
+    def test_server_errors_are_retried(self):
+        """ A server error is retried, other error responses raise an HTTPError right away. """
+        responses.add(responses.GET, MEASUREMENT_URL, status=503, headers={"Retry-After": "0"})
+        responses.add(responses.GET, MEASUREMENT_URL, json={"id": 1001})
+        with self.assertLogs('ripe_interface.ripe_client', level='WARNING'):
+            self.assertEqual(RipeClient().get_json(MEASUREMENT_URL), {"id": 1001})
+        self.assertEqual(len(responses.calls), 2)
+
+        responses.reset()
+        responses.add(responses.GET, MEASUREMENT_URL, status=404, json={"detail": "Not found."})
+        with self.assertRaises(requests.HTTPError):
+            RipeClient().get_json(MEASUREMENT_URL)
+        self.assertEqual(len(responses.calls), 1)
+
+    def test_retry_after(self):
+        """ Retry-After is either an amount of seconds or an HTTP date, a missing or invalid value uses the
+            default. """
+        def retry_after(value):
+            response = requests.Response()
+            if value is not None:
+                response.headers['Retry-After'] = value
+            return RipeClient.retry_after(response, 1.5)
+
+        self.assertEqual(retry_after("3"), 3.0)
+        self.assertAlmostEqual(retry_after(formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertEqual(retry_after(formatdate(time.time() - 30, usegmt=True)), 0.0)
+        self.assertEqual(retry_after(None), 1.5)
+        self.assertEqual(retry_after("soon"), 1.5)
+
+    def test_token_bucket_queues_requests(self):
+        """ With a rate of 20 per second and no burst, 5 acquisitions take at least 0.2 seconds. """
+        bucket = TokenBucket(rate=20, capacity=1)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_endpoints(self):
+        """ Every RIPE resource gets its own endpoint (and token bucket). """
+        self.assertEqual(RipeClient.get_endpoint(MEASUREMENT_URL), "atlas.ripe.net/measurements")
+        self.assertEqual(RipeClient.get_endpoint("https://atlas.ripe.net/api/v2/probes/?asn_v4=1103"),
+                         "atlas.ripe.net/probes")
+        self.assertEqual(RipeClient.get_endpoint("https://stat.ripe.net/data/as-overview/data.json"),
+                         "stat.ripe.net/as-overview")
+        client = RipeClient()
+        self.assertEqual(client.get_bucket("https://stat.ripe.net/data/as-overview/data.json").rate, 4.0)
+        self.assertIs(client.get_bucket(MEASUREMENT_URL), client.get_bucket("https://atlas.ripe.net/api/v2/measurements/"))